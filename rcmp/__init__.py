@@ -105,6 +105,12 @@ Class Architecture
 .. autoclass:: ComparisonList
    :members:
 
+.. autoclass:: Budget
+   :members:
+
+.. autoclass:: NormalizeRule
+   :members:
+
 Comparators
 ===========
 
@@ -116,7 +122,9 @@ Listed in default order of application:
 .. autoclass:: InodeComparator
 .. autoclass:: EmptyFileComparator
 .. autoclass:: DirComparator
+.. autoclass:: DirArchiveComparator
 .. autoclass:: ArMemberMetadataComparator
+.. autoclass:: ZipCRCComparator
 .. autoclass:: BitwiseComparator
 .. autoclass:: SymlinkComparator
 
@@ -124,13 +132,18 @@ Listed in default order of application:
 
 .. autoclass:: ElfComparator
 .. autoclass:: ArComparator
+.. autoclass:: RuleComparator
 .. autoclass:: AMComparator
 .. autoclass:: ConfigLogComparator
 .. autoclass:: KernelConfComparator
 .. autoclass:: ZipComparator
 .. autoclass:: TarComparator
+.. autoclass:: TarStreamComparator
 .. autoclass:: GzipComparator
 .. autoclass:: Bz2Comparator
+.. autoclass:: XZComparator
+.. autoclass:: ZstdComparator
+.. autoclass:: LZ4Comparator
 .. autoclass:: CpioMemberMetadataComparator
 .. autoclass:: CpioComparator
 .. autoclass:: DateBlotBitwiseComparator
@@ -140,6 +153,8 @@ Utilities
 =========
 
 .. autofunction:: date_blot
+.. autofunction:: date_blot_bytes
+.. autofunction:: load_rules
 .. autofunction:: ignoring
 
 Exceptions
@@ -147,6 +162,7 @@ Exceptions
 
 .. autoexception:: RcmpException
 .. autoexception:: IndeterminateResult
+.. autoexception:: BudgetExceeded
 
 Logging strategy:
 =================
@@ -179,65 +195,111 @@ __all__ = [
     'Box',
     'Comparison',
     'ComparisonList',
+    'Budget',
+    'NormalizeRule',
     'rootItem',
 
     # utilities
     'ignoring',
-    'date_blot'
+    'date_blot',
+    'date_blot_bytes',
+    'load_rules',
 
     # comparators
     'NoSuchFileComparator',
     'InodeComparator',
     'EmptyFileComparator',
     'DirComparator',
+    'DirArchiveComparator',
     'ArMemberMetadataComparator',
+    'ZipCRCComparator',
     'BitwiseComparator',
     'SymlinkComparator',
     'BuriedPathComparator',
     'ElfComparator',
     'ArComparator',
+    'RuleComparator',
     'AMComparator',
     'ConfigLogComparator',
     'KernelConfComparator',
     'ZipComparator',
     'TarComparator',
+    'TarStreamComparator',
     'GzipComparator',
     'Bz2Comparator',
+    'XZComparator',
+    'ZstdComparator',
+    'LZ4Comparator',
     'CpioMemberMetadataComparator',
     'CpioComparator',
     'DateBlotBitwiseComparator',
     'FailComparator',
-]
 
-lzma = False
+    # exceptions
+    'RcmpException',
+    'IndeterminateResult',
+    'BudgetExceeded',
+]
 
 import abc
 
-if lzma:
-    import backports.lzma as lzma
+try:
+    import lzma
+
+except ImportError:
+    try:
+        import backports.lzma as lzma
+
+    except ImportError:
+        lzma = False
 
+try:
+    from compression import zstd
+
+except ImportError:
+    try:
+        import zstandard as zstd
+
+    except ImportError:
+        zstd = False
+
+try:
+    import lz4.frame as lz4frame
+
+except ImportError:
+    lz4frame = False
+
+import binascii
+import bisect
 import bz2file as bz2
+import collections
 import contextlib
 import difflib
 import errno
 import fnmatch
 import gzip
+import hashlib
 import io
+import json
 import logging
 import mmap
+import multiprocessing
 import operator
 import os
+import posixpath
 import re
 import stat
+import struct
 import subprocess
 import sys
 import tarfile
+import threading
 import tempfile
+import time
 import zipfile
+import zlib
 
-import elffile
-import arpy
-import cpiofile
+from multiprocessing.pool import ThreadPool
 
 DIFFERENCES = logging.WARNING
 SAMES = logging.WARNING - 1
@@ -264,9 +326,102 @@ def _loggable(cls):
     cls.logger = logging.getLogger('{}.{}'.format(__name__, cls.__name__))
     return cls
 
+# : Number of worker threads used for decoding in parallel.  None
+# : means one per cpu.
+threads = None
+
+# : Directory in which indexes, (see :py:class:`_TarIndex`), are kept
+# : from one run to the next.  None means they aren't.
+cache_dir = None
+
+def _cache_name(kind, name, *versions):
+    """
+    The name of the file in :py:data:`cache_dir` holding a *kind* of
+    thing about the file *name*, keyed on its identity, (path, inode,
+    size and mtime), and *versions*.  The key is the same whether
+    *name* is bytes or text.
+    """
+    statbuf = os.stat(name)
+    path = os.path.realpath(name)
+    if not isinstance(path, bytes):
+        path = path.encode(sys.getfilesystemencoding() or 'utf-8')
+
+    key = hashlib.sha1(path)
+    for part in (['{}'.format(version) for version in versions]
+                 + ['{:d}'.format(statbuf.st_ino), '{:d}'.format(statbuf.st_size), '{!r}'.format(float(statbuf.st_mtime))]):
+        key.update(b'\x00' + part.encode('ascii'))
+
+    return os.path.join(cache_dir, '{}-{}.json'.format(kind, key.hexdigest()))
+
+@contextlib.contextmanager
+def _threadpool():
+    pool = ThreadPool(threads)
+    try:
+        yield pool
+
+    finally:
+        pool.close()
+        pool.join()
+
+def _pool_size():
+    return threads if threads else multiprocessing.cpu_count()
+
+class _Prefetcher(object):
+    """
+    Compute *function(key)* for each of *keys* on *pool*, in order,
+    ahead of need.  At most *window* results are held at any one time.
+    Results are expected to be fetched in the order of *keys*, though
+    not all of them need be: those of keys passed over are dropped.
+
+    .. note:: not intended to be shared between threads.  Only the
+       calls to *function* run elsewhere.
+    """
+
+    def __init__(self, pool, function, keys, window):
+        self.pool = pool
+        self.function = function
+        self.keys = collections.deque(keys)
+        self.window = window
+        self.order = {}
+        self.pending = collections.OrderedDict()
+        self.taken = set()
+
+        for (position, key) in enumerate(self.keys):
+            self.order.setdefault(key, position)
+
+        self._fill()
+
+    def _fill(self):
+        while self.keys and len(self.pending) < self.window:
+            key = self.keys.popleft()
+            if key not in self.taken:
+                self.pending[key] = self.pool.apply_async(self.function, (key,))
+
+    def get(self, key):
+        """
+        Return the result for *key* if it has been, or is being,
+        computed.  Otherwise, return None and forget about *key* so
+        that it won't be computed later.
+        """
+        self.taken.add(key)
+
+        # those before *key* will never be asked for now, (their
+        # members settled without reading them, say), and would
+        # otherwise hold their places in the window for good.
+        position = self.order.get(key)
+        while position is not None and self.pending and self.order[next(iter(self.pending))] < position:
+            self.pending.popitem(last=False)
+
+        result = self.pending.pop(key, None)
+        self._fill()
+        return result.get() if result else None
+
 
 _read_count = 3
 
+# : How much to read when peeking at the start of a file.
+_peek_size = 4096
+
 @_loggable
 class Item(object):
     """
@@ -289,6 +444,8 @@ class Item(object):
         self._statbuf = False
         self._fd = False
         self._content = False
+        self._peek = b''
+        self._peeked = 0
         self._link = False
         self._size = None
         self._read_count = 0
@@ -355,6 +512,25 @@ class Item(object):
 
         return self._content
 
+    def peek(self, size):
+        """
+        The first *size* bytes of the contents.  For file system files
+        whose content hasn't already been read, only the first few
+        bytes are read, (and cached).  This is intended for checking
+        magic numbers.
+
+        :rtype: bytes
+        """
+        if self._content is False and self.parent.box is DirComparator:
+            if size > self._peeked:
+                self._peeked = max(size, _peek_size)
+                with open(self.name, 'rb') as fd:
+                    self._peek = fd.read(self._peeked)
+
+            return self._peek[0:size]
+
+        return bytes(self.content[0:size])
+
     def reset(self):
         self.logger.log(logging.DEBUG, 'resetting %s', self.name)
         self._content = False
@@ -536,6 +712,171 @@ class Different(object):
     """
     pass
 
+def _myers(left, right, limit, deadline):
+    """
+    Myers' O(ND) difference of the sequences *left* and *right*.
+    Return their matching blocks, (as
+    :py:meth:`difflib.SequenceMatcher.get_matching_blocks` does), or
+    None if they differ by more than *limit* insertions and deletions
+    or the clock passes *deadline*.
+    """
+    (n, m) = (len(left), len(right))
+    offset = limit + 1
+    v = [0] * (2 * limit + 3)
+    trace = []
+
+    for d in range(limit + 1):
+        if time.time() > deadline:
+            return None
+
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+
+            y = x - k
+            while x < n and y < m and left[x] == right[y]:
+                (x, y) = (x + 1, y + 1)
+
+            v[offset + k] = x
+
+            if x >= n and y >= m:
+                trace.append(v[offset - d:offset + d + 1])
+                return _myers_blocks(trace, n, m)
+
+        trace.append(v[offset - d:offset + d + 1])
+
+    return None
+
+def _myers_blocks(trace, x, y):
+    """
+    Walk back through the *trace* of :py:func:`_myers` from (*x*, *y*)
+    collecting the snakes, (runs of matching elements), on the way.
+    """
+    blocks = [(x, y, 0)]
+
+    for d in range(len(trace) - 1, 0, -1):
+        # trace[d - 1] holds diagonals -(d - 1) to d - 1.
+        (previous, k) = (trace[d - 1], x - y)
+        if k == -d or (k != d and previous[k - 1 + d - 1] < previous[k + 1 + d - 1]):
+            pk = k + 1
+            px = previous[pk + d - 1]
+            (sx, sy) = (px, px - pk + 1)
+        else:
+            pk = k - 1
+            px = previous[pk + d - 1]
+            (sx, sy) = (px + 1, px - pk)
+
+        if x > sx:
+            blocks.append((sx, sy, x - sx))
+
+        (x, y) = (px, px - pk)
+
+    if x > 0:
+        blocks.append((0, 0, x))
+
+    blocks.reverse()
+    return blocks
+
+def _diff_hunks(blocks, context):
+    """
+    Group the opcodes following from matching *blocks* into hunks with
+    *context* lines, as
+    :py:meth:`difflib.SequenceMatcher.get_grouped_opcodes` does.
+    """
+    (codes, i, j) = ([], 0, 0)
+    for (ai, bj, size) in blocks:
+        if i < ai or j < bj:
+            tag = 'replace' if i < ai and j < bj else 'delete' if i < ai else 'insert'
+            codes.append((tag, i, ai, j, bj))
+
+        (i, j) = (ai + size, bj + size)
+        if size:
+            codes.append(('equal', ai, i, bj, j))
+
+    if not codes:
+        return
+
+    # trim the leading and trailing context.
+    if codes[0][0] == 'equal':
+        (tag, i1, i2, j1, j2) = codes[0]
+        codes[0] = (tag, max(i1, i2 - context), i2, max(j1, j2 - context), j2)
+
+    if codes[-1][0] == 'equal':
+        (tag, i1, i2, j1, j2) = codes[-1]
+        codes[-1] = (tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context))
+
+    group = []
+    for (tag, i1, i2, j1, j2) in codes:
+        # split at long runs of matches.
+        if tag == 'equal' and i2 - i1 > context * 2:
+            group.append((tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)))
+            yield group
+            group = []
+            (i1, j1) = (max(i1, i2 - context), max(j1, j2 - context))
+
+        group.append((tag, i1, i2, j1, j2))
+
+    if group and not (len(group) == 1 and group[0][0] == 'equal'):
+        yield group
+
+def _unified_range(start, stop):
+    if stop - start == 1:
+        return '{}'.format(start + 1)
+
+    return '{},{}'.format(start + 1 if stop > start else start, stop - start)
+
+def _unified_diff(left, right, names, context=3, lines=200000, edits=1000, output=1000, seconds=2.0):
+    """
+    Yield a unified diff of the sequences of lines *left* and *right*,
+    like :py:func:`difflib.unified_diff` but bounded.  Only the lines
+    between any common head and tail are diffed.  If there are more
+    than *lines* of them on either side, or they differ by more than
+    *edits* insertions and deletions, or diffing takes more than
+    *seconds*, then only a summary is given.  No more than *output*
+    lines of the diff are given.
+    """
+    head = _first_difference(left, right)
+    if head is None:
+        return
+
+    tail = _first_difference(left[head:][::-1], right[head:][::-1])
+    tail = min(len(left), len(right)) - head if tail is None else tail
+    (lmiddle, rmiddle) = (left[head:len(left) - tail], right[head:len(right) - tail])
+
+    blocks = None
+    if len(lmiddle) <= lines and len(rmiddle) <= lines:
+        blocks = _myers(lmiddle, rmiddle, edits, time.time() + seconds)
+
+    if blocks is None:
+        yield '{} lines differ, first at line {}'.format(max(len(lmiddle), len(rmiddle)), head + 1)
+        return
+
+    # back into whole file terms, with the common head and tail.
+    blocks = ([(0, 0, head)]
+              + [(i + head, j + head, size) for (i, j, size) in blocks[:-1]]
+              + [(len(left) - tail, len(right) - tail, tail), (len(left), len(right), 0)])
+
+    diff = ['--- {}'.format(names[0]), '+++ {}'.format(names[1])]
+    for group in _diff_hunks(blocks, context):
+        (first, last) = (group[0], group[-1])
+        diff.append('@@ -{} +{} @@'.format(_unified_range(first[1], last[2]), _unified_range(first[3], last[4])))
+
+        for (tag, i1, i2, j1, j2) in group:
+            if tag == 'equal':
+                diff.extend(' ' + line for line in left[i1:i2])
+                continue
+
+            diff.extend('-' + line for line in left[i1:i2])
+            diff.extend('+' + line for line in right[j1:j2])
+
+    for line in diff[:output]:
+        yield line
+
+    if len(diff) > output:
+        yield '... {} more lines of diff not shown'.format(len(diff) - output)
+
 @_loggable
 class Comparator(object):
     """
@@ -598,14 +939,37 @@ class Comparator(object):
     def _log_string(cls, s, comparison):
         return '{0} {1} {2}'.format(s, cls.__name__, comparison.pair[0].name.partition(os.sep)[2])
 
+    diff_lines = 200000
+    """
+    Most lines, aside from any common head and tail, which
+    :py:meth:`_log_unidiffs` will diff.  Beyond this, or the following
+    limits, only a summary of the difference is logged.
+    """
+
+    diff_edits = 1000
+    """
+    Most lines inserted and deleted which :py:meth:`_log_unidiffs`
+    will look for.
+    """
+
+    diff_seconds = 2.0
+    """
+    Longest time :py:meth:`_log_unidiffs` will spend on a diff.
+    """
+
+    diff_output = 1000
+    """
+    Most lines of diff which :py:meth:`_log_unidiffs` will log.
+    """
+
     @classmethod
     def _log_unidiffs(cls, content, names):
         try:
             cls.logger.log(DIFFERENCES,
-                            '\n'.join(difflib.unified_diff(content[0].split('\n'),
-                                                           content[1].split('\n'),
-                                                           names[0], names[1],
-                                                           '', '', 3, '')))
+                           '\n'.join(_unified_diff(content[0].split('\n'),
+                                                   content[1].split('\n'),
+                                                   names, 3, cls.diff_lines, cls.diff_edits,
+                                                   cls.diff_output, cls.diff_seconds)))
         except UnicodeError:
             pass
 
@@ -628,68 +992,193 @@ class Comparator(object):
 
 
 class DatePattern(object):
-    def __init__(self, pattern, replacement):
+    """
+    A date *pattern* and the constant *replacement* which blots it out.
+
+    *hint* is a cheaper regular expression which matches somewhere in
+    every line that *pattern* matches in.  Every date we know of
+    includes two digits in a row, but so do most lines of build logs,
+    so the closer the hint the better.
+    """
+    def __init__(self, pattern, replacement, hint=r'[0-9]{2}'):
         self.pattern = pattern
         self.replacement = replacement
+        self.hint = hint
         self.compiled = re.compile(pattern)
+        self.compiled_bytes = re.compile(pattern.encode('ascii'))
+        self.replacement_bytes = replacement.encode('ascii')
 
 dow = r'(Sun|Mon|Tue|Wed|Thu|Fri|Sat)'
 moy = r'(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)'
 lmoy = r'(January|February|March|April|May|June|July|August|September|October|November|December)'
+ymd = r'20*[0-9]{2}-*[0-9]{2}-*[0-9]{2}'
 
 date_patterns = [
     # Sun Feb 13 12:29:28 PST 2011
     DatePattern(dow + r' ' + moy + r' *[0-9]{1,2} [0-9]{2}:[0-9]{2}:[0-9]{2} (PST|PDT) [0-9]{4}',
-     'Day Mon 00 00:00:00 LOC 2011'),
+     'Day Mon 00 00:00:00 LOC 2011', r'[0-9]:[0-9]'),
     
     DatePattern(dow + r' ' + moy + r' *[0-9]{1,2} [0-9]{2}:[0-9]{2}:[0-9]{2} [0-9]{4}',
-     'Day Mon 00 00:00:00 2011'),
+     'Day Mon 00 00:00:00 2011', r'[0-9]:[0-9]'),
 
     # 13 FEB 2011 11:52
     DatePattern(r'(?i) *[0-9]{1,2} (JAN|FEB|MAR|APR|MAY|JUN|JUL|AUG|SEP|OCT|NOV|DEC) [0-9]{4} [0-9]{2}:[0-9]{2}',
-     '00 MON 2011 00:00'),
+     '00 MON 2011 00:00', r'[0-9]:[0-9]'),
 
     # "April  7, 2011"
-    DatePattern(lmoy + r' *[0-9]{1,2}\\?, [0-9]{4}', 'Month 00, 2011'),
+    DatePattern(lmoy + r' *[0-9]{1,2}\\?, [0-9]{4}', 'Month 00, 2011', r'[0-9]\\?, [0-9]'),
 
     # Wed Apr 13 2011
-    DatePattern(dow + r' ' + moy + r' *[0-9]{1,2} *[0-9]{4}', 'Day Mon 00 2011'),
+    DatePattern(dow + r' ' + moy + r' *[0-9]{1,2} *[0-9]{4}', 'Day Mon 00 2011', moy + r' *[0-9]'),
 
     # Wed 13 Apr 2011
-    DatePattern(dow + r' *[0-9]{1,2} *' + moy + r' *[0-9]{4}', 'Day 00 Mon 2011'),
+    DatePattern(dow + r' *[0-9]{1,2} *' + moy + r' *[0-9]{4}', 'Day 00 Mon 2011', dow + r' *[0-9]'),
 
     # Wed 13 April 2011
-    DatePattern(dow + r' *[0-9]{1,2} *' + lmoy + r' *[0-9]{4}', 'Day 00 Month 2011'),
+    DatePattern(dow + r' *[0-9]{1,2} *' + lmoy + r' *[0-9]{4}', 'Day 00 Month 2011', dow + r' *[0-9]'),
 
     # 2011-04-13
-    DatePattern(r'20*[0-9]{2}-*[0-9]{2}-*[0-9]{2}', '2011-00-00'),
+    DatePattern(ymd, '2011-00-00', ymd),
 
     # Apr 2011
-    DatePattern(moy + r' [0-9]{4}', 'Mon 2011'),
+    DatePattern(moy + r' [0-9]{4}', 'Mon 2011', moy + r' *[0-9]'),
 
     # 00:00:00
-    DatePattern(r'[0-9]{2}:[0-9]{2}:[0-9]{2}', '00:00:00'),
+    DatePattern(r'[0-9]{2}:[0-9]{2}:[0-9]{2}', '00:00:00', r'[0-9]:[0-9]'),
 
     # 2011-07-11T170033Z
-    DatePattern(r'[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{6}Z', '00000000T000000Z'),
+    DatePattern(r'[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{6}Z', '00000000T000000Z', r'-[0-9]{2}T'),
     ]
 
+# : The patterns for which :py:data:`_date_detectors` were compiled.
+_date_detected = ()
+_date_detectors = None
+
+def _date_detector():
+    """
+    Return a pair of lists of regular expressions, (text and bytes),
+    the :py:data:`date_patterns`' distinct hints.  Between them they
+    match in every line where any of the patterns might.
+
+    The hints are kept apart rather than joined in one alternation,
+    which :py:mod:`re` tries branch by branch at every position and so
+    costs more than searching with each in turn.
+    """
+    global _date_detected, _date_detectors
+
+    if _date_detected != tuple(date_patterns):
+        hints = sorted(set(pat.hint for pat in date_patterns))
+        _date_detectors = ([re.compile(hint) for hint in hints],
+                           [re.compile(hint.encode('ascii')) for hint in hints])
+        _date_detected = tuple(date_patterns)
+
+    return _date_detectors
+
+# : Candidate lines, (see :py:func:`_blot_lines`), no more than this
+# : many bytes apart are blotted together, as costing less than the
+# : patterns' calls for each.
+_blot_gap = 256
+
+def _blot_lines(content, detectors, subs, newline):
+    """
+    Apply *subs* in turn to each line of *content* in which any of
+    *detectors* matches, and only to those.  None of the date patterns
+    can match across a line break, and a line none of them matches in
+    isn't changed by applying them, so, line by line, this gives just
+    what applying them in turn to all of *content* would.  Candidate
+    lines close together are blotted together, as a block.
+    """
+    pieces = []
+    position = 0
+    (start, end) = (0, None)
+    found = [detector.search(content) for detector in detectors]
+
+    def search(offset):
+        # the first match of any detector from *offset* on, searching
+        # again only with those whose last match is behind it.
+        for (i, match) in enumerate(found):
+            if match and match.start() < offset:
+                found[i] = detectors[i].search(content, offset)
+
+        matches = [match for match in found if match]
+        return min(matches, key=lambda match: match.start()) if matches else None
+
+    def blot(block):
+        for (compiled, replacement) in subs:
+            block = compiled.sub(replacement, block)
+
+        return block
+
+    match = search(0)
+    while match:
+        # the previous block ends at a line break, so there's no
+        # need to look back any further for this line's beginning.
+        floor = position if end is None else end
+        line = content.rfind(newline, floor, match.start()) + 1 or floor
+
+        if end is not None and line - end > _blot_gap:
+            pieces.extend([content[position:start], blot(content[start:end])])
+            position = end
+            end = None
+
+        if end is None:
+            start = line
+
+        # the lines which follow closely are likely blotted along with
+        # this one so, the longer the block has grown, the further
+        # ahead it's taken without searching line by line.
+        end = content.find(newline, match.end() + max(_blot_gap, match.end() - start))
+        if end < 0:
+            end = len(content)
+
+        match = search(end)
+
+    if end is None:
+        return content
+
+    if not pieces and start == 0 and end == len(content):
+        # one block of everything, as dense content comes to.
+        return blot(content)
+
+    pieces.extend([content[position:start], blot(content[start:end]), content[end:]])
+    return content[0:0].join(pieces)
+
 def date_blot(input_string):
     """Convert dates embedded in a string into innocuous constants of uniform length.
     
     :param input_string: input string
     :rtype: string
     """
-    retval = input_string
+    try:
+        # a python 2 str would be decoded again for every text newline
+        # looked for in it.
+        return _blot_lines(input_string, _date_detector()[0],
+                           [(pat.compiled, pat.replacement) for pat in date_patterns],
+                           b'\n' if isinstance(input_string, bytes) else '\n')
 
-    for pat in date_patterns:
-        try:
-            retval = pat.compiled.sub(pat.replacement, retval)
+    except UnicodeError:
+        # some pattern can't be applied at all, (undecodable bytes on
+        # python2).  Apply the rest, as ever.
+        retval = input_string
 
-        except UnicodeError:
-            pass
+        for pat in date_patterns:
+            try:
+                retval = pat.compiled.sub(pat.replacement, retval)
+
+            except UnicodeError:
+                pass
+
+        return retval
 
-    return retval
+def date_blot_bytes(content):
+    """Convert dates embedded in bytes into innocuous constants of uniform
+    length, as :py:func:`date_blot` does for strings, without decoding.
+
+    :param content: input bytes
+    :rtype: bytes
+    """
+    return _blot_lines(content, _date_detector()[1],
+                       [(pat.compiled_bytes, pat.replacement_bytes) for pat in date_patterns], b'\n')
 
 # def ignoring(ignores, fname):
 #     """
@@ -804,6 +1293,78 @@ class BadZipfile(RcmpException):
     """Raised when we fail to open a zip archive"""
     pass
 
+class BudgetExceeded(RcmpException):
+    """
+    Raised when a comparison would exceed its :py:class:`Budget`.  The
+    pair being compared is reported as :py:class:`Different`.
+    """
+    pass
+
+class Budget(object):
+    """
+    Limits on how far a comparison may go into nested archives and
+    compressed files, as a guard against decompression bombs.  A limit
+    of None is no limit.  One budget is shared by all of the
+    comparisons in a run.
+
+    :param max_depth: most archives, or compressed files, to descend
+        through
+    :type max_depth: int
+    :param max_member: most bytes to decode for any one member
+    :type max_member: int
+    :param max_total: most bytes to decode in all
+    :type max_total: int
+    :param max_ratio: greatest ratio of decoded to encoded size for any
+        one member
+    :type max_ratio: float
+    """
+
+    def __init__(self, max_depth=None, max_member=None, max_total=None, max_ratio=None):
+        self.max_depth = max_depth
+        self.max_member = max_member
+        self.max_total = max_total
+        self.max_ratio = max_ratio
+
+        # : bytes decoded so far.
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def descend(self, item):
+        """
+        Raise :py:exc:`BudgetExceeded` unless the contents of *item*
+        may be compared.
+        """
+        depth = 0
+        while item is not root:
+            if item.parent.box is not DirComparator:
+                depth += 1
+
+            item = item.parent
+
+        if self.max_depth is not None and depth >= self.max_depth:
+            raise BudgetExceeded('nested more than {} deep'.format(self.max_depth))
+
+    def check(self, size, encoded):
+        """
+        Raise :py:exc:`BudgetExceeded` if *size* bytes decoded from
+        *encoded* bytes is too much.
+        """
+        if self.max_member is not None and size > self.max_member:
+            raise BudgetExceeded('decoded more than {} bytes'.format(self.max_member))
+
+        if self.max_ratio is not None and size > self.max_ratio * max(encoded, 1):
+            raise BudgetExceeded('decoded more than {} times {} bytes'.format(self.max_ratio, encoded))
+
+        if self.max_total is not None and self.total + size > self.max_total:
+            raise BudgetExceeded('decoded more than {} bytes in all'.format(self.max_total))
+
+    def spend(self, size):
+        """
+        Count *size* more bytes as decoded.
+        """
+        with self._lock:
+            self.total += size
+
 class _Packer(object):
     """
     just for aggregation, not intended for instantiation.
@@ -845,13 +1406,31 @@ class Box(Comparator):
     def box_keys(cls, item):
         raise NotImplementedError
 
+    @classmethod
+    def box_keyset(cls, item):
+        """
+        The :py:meth:`box_keys` of *item* as a set, built once per item,
+        so that membership tests don't scan the list.
+        """
+        if not hasattr(item, 'keyset'):
+            item.keyset = frozenset(cls.box_keys(item))
+
+        return item.keyset
+
     @classmethod
     def _no_mate(cls, name, logger):
         cls.logger.log(DIFFERENCES, 'Different %s No mate: %s', cls.__name__, name)
 
     @classmethod
     def _expand(cls, ignoring, item):
+        # members already found the same, (see TarComparator.stream,
+        # ArComparator and CpioComparator).
+        settled = getattr(item, 'settled', frozenset())
+
         for shortname in cls.box_keys(item):
+            if shortname in settled:
+                continue
+
             fullname = cls._packer.join(item.name, shortname)
             ignore = ignoring(fullname)
             if ignore:
@@ -866,7 +1445,7 @@ class Box(Comparator):
     @staticmethod
     def _mates(item, container):
         #Box.logger.log(logging.DEBUG, '_mates: item = %s, container = %s', item.name, container.name)
-        return item.shortname in container.box.box_keys(container)
+        return item.shortname in container.box.box_keyset(container)
 
     @classmethod
     def _outer_join(cls, comparison, invert=False, spool=True):
@@ -894,7 +1473,8 @@ class Box(Comparator):
                                                           comparators=comparison.comparators,
                                                           ignores=comparison.ignores,
                                                           exit_asap=comparison.exit_asap,
-                                                          ignore_ownerships=comparison.ignore_ownerships))
+                                                          ignore_ownerships=comparison.ignore_ownerships,
+                                                          budget=comparison.budget))
             else:
                 cls._no_mate(litem.name, logger)
                 result = Different
@@ -1122,8 +1702,17 @@ class DirComparator(Box):
     @contextlib.contextmanager
     def member_mmap(member):
         with open(member.name, 'rb') as fd:
-            yield mmap.mmap(fd.fileno(), 0, mmap.MAP_SHARED, mmap.PROT_READ)
-            fd.close()
+            if os.fstat(fd.fileno()).st_size == 0:
+                # can't map an empty file
+                yield b''
+                return
+
+            m = mmap.mmap(fd.fileno(), 0, mmap.MAP_SHARED, mmap.PROT_READ)
+            try:
+                yield m
+
+            finally:
+                m.close()
 
     @staticmethod
     def member_content(member):
@@ -1212,627 +1801,3340 @@ class DirComparator(Box):
         return os.readlink(member.name)
 
 
-@_loggable
-class BitwiseComparator(Comparator):
+@contextlib.contextmanager
+def _content_buffer(item):
     """
-    Objects which are bitwise identical are close enough.
+    Yield the content of *item* as something which can be sliced.
+    File system files which haven't already been read are mapped
+    rather than read so that only the parts actually used get paged
+    in.  Use :py:func:`_as_file` to read the result like a file.
     """
+    if item._content is False and item.parent.box is DirComparator and item.isreg:
+        with DirComparator.member_mmap(item) as m:
+            yield m
 
-    @staticmethod
-    def _applies(item):
-        BitwiseComparator.logger.log(logging.DEBUG, 'testing whether BitwiseComparator applies to %s', item.name)
-        return item.isreg
+    else:
+        yield item.content
 
-    @classmethod
-    def cmp(cls, comparison):
-        # if they're not the same size, then they're not bitwise identical.
+class _MappedFile(object):
+    """
+    A read only file object over an mmap.  The mmap's own file methods
+    won't do as :py:meth:`mmap.read` insists on a size on some
+    pythons, which :py:mod:`zipfile` and :py:mod:`tarfile` don't
+    always give.  Each keeps its own position so that several can
+    read the same mmap.
+    """
+    def __init__(self, m):
+        self.mmap = m
+        self.position = 0
 
-        if not reduce(operator.eq, [i.size for i in comparison.pair]):
-            cls._log_indeterminate(comparison)
-            return False
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self.mmap) - self.position
 
-        # If we already have their content mapped, or they aren't file
-        # system files, then use content.  If they're the same, then
-        # we can drop the content because we won't need it again.
+        content = self.mmap[self.position:self.position + size]
+        self.position += len(content)
+        return content
 
-        if (reduce(operator.eq, [bool(i._content) for i in comparison.pair] + [True])
-             or comparison.pair[0].parent.box != DirComparator):
-            if comparison.pair[0].content == comparison.pair[1].content:
-                comparison.reset()
-                cls._log_same(comparison)
-                return Same
+    def seek(self, offset, whence=os.SEEK_SET):
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self.position, os.SEEK_END: len(self.mmap)}[whence]
+        self.position = max(base + offset, 0)
 
-            else:
-                cls._log_indeterminate(comparison)
-                return False
+    def tell(self):
+        return self.position
 
-        # at this point we know that a) we are regular files in file
-        # system files and b) neither one yet has _content.
+    def close(self):
+        pass
 
-        # This is clumsy but the vast majority of file comparisons
-        # turn out to be Same on BitwiseComparator.  And I was sorry
-        # to lose the mmap earlier so I'm putting it back in here.
+def _as_file(buf):
+    """
+    Return a seekable file object reading from *buf*, as yielded by
+    :py:func:`_content_buffer`.
+    """
+    return _MappedFile(buf) if isinstance(buf, mmap.mmap) else io.BytesIO(buf)
 
-        # Mmap both files.  Compare.  If they're the same, we're done
-        # with these files.  If they're not the same, then copy their
-        # contents out of mmap into _content.
+def _buffers_equal(left, right):
+    """
+    Compare two buffers a chunk at a time so that mapped files needn't
+    be copied out whole.
+    """
+    if len(left) != len(right):
+        return False
 
-        with contextlib.nested(DirComparator.member_mmap(comparison.pair[0]),
-                               DirComparator.member_mmap(comparison.pair[1])) as (m1, m2):
-            if m1 == m2:
-                cls._log_same(comparison)
-                return Same
+    for offset in range(0, len(left), _chunk_size):
+        if left[offset:offset + _chunk_size] != right[offset:offset + _chunk_size]:
+            return False
+
+    return True
+
+def _view(buf, offset, size):
+    """
+    A view of *size* bytes of *buf* from *offset* which doesn't copy
+    them.  Mmaps can't be viewed through a memoryview on python2.
+    """
+    try:
+        return memoryview(buf)[offset:offset + size]
+
+    except TypeError:
+        return buffer(buf, offset, size)
 
+def _first_difference(left, right):
+    """
+    The offset of the first byte at which buffers *left* and *right*
+    differ, or None if they don't.  Chunks are compared whole and the
+    differing chunk is bisected, so this runs at memcmp speed.
+    """
+    size = min(len(left), len(right))
+
+    for offset in range(0, size, _chunk_size):
+        end = min(offset + _chunk_size, size)
+        (lchunk, rchunk) = (left[offset:end], right[offset:end])
+        if lchunk == rchunk:
+            continue
+
+        # the first low bytes match, the first high don't.
+        (low, high) = (0, len(lchunk))
+        while high - low > 1:
+            middle = (low + high) // 2
+            if lchunk[:middle] == rchunk[:middle]:
+                low = middle
             else:
-                comparison.pair[0]._content = m1[:]
-                comparison.pair[1]._content = m2[:]
+                high = middle
 
-                cls._log_indeterminate(comparison)
-                retval = False
+        return offset + low
 
-        return retval
+    return None if len(left) == len(right) else size
 
+def _hexdump(view, base):
+    """
+    Yield lines dumping *view*, (from offset *base*), much as objdump
+    -s does.
+    """
+    for offset in range(0, len(view), 16):
+        row = bytearray(view[offset:offset + 16])
+        words = ' '.join(binascii.hexlify(bytes(row[i:i + 4])).decode('ascii') for i in range(0, len(row), 4))
+        text = ''.join(chr(c) if 32 <= c < 127 else '.' for c in row)
+        yield ' {:04x} {:<35}  {}'.format(base + offset, words, text)
 
-@_loggable
-class DateBlotBitwiseComparator(Comparator):
+def _differing_ranges(left, right, row=16):
     """
-    Objects which are bitwise identical after date blotting are close
-    enough.  But this should only be tried late.
+    Yield (start, end) offsets of the runs of *row* byte rows in which
+    buffers *left* and *right* differ.  Whatever follows the end of the
+    shorter is part of the last.  Matching chunks are passed over
+    whole, so this is linear in size.
     """
+    size = min(len(left), len(right))
+    start = None
 
-    @staticmethod
-    def _applies(item):
-        return item.isreg
+    for offset in range(0, size, _chunk_size):
+        end = min(offset + _chunk_size, size)
+        if left[offset:end] == right[offset:end]:
+            if start is not None:
+                yield (start, offset)
+                start = None
 
-    @classmethod
-    def cmp(cls, comparison):
-        if (reduce(operator.eq, [date_blot(i.content) for i in comparison.pair])):
-            cls._log_same(comparison)
-            retval = Same
-        else:
-            cls._log_indeterminate(comparison)
-            retval = False
+            continue
 
-        return retval
+        for r in range(offset, end, row):
+            stop = min(r + row, end)
+            if left[r:stop] == right[r:stop]:
+                if start is not None:
+                    yield (start, r)
+                    start = None
 
+            elif start is None:
+                start = r
 
-@_loggable
-class NoSuchFileComparator(Comparator):
+    if len(left) != len(right) and start is None:
+        start = size
+
+    if start is not None:
+        yield (start, max(len(left), len(right)))
+
+def _files_equal(left, right):
     """
-    Objects are different if either one is missing.
+    Compare two file objects a chunk at a time.
     """
-    # FIXME: perhaps this should return same if both are missing.
+    while True:
+        (lchunk, rchunk) = (left.read(_chunk_size), right.read(_chunk_size))
+        if lchunk != rchunk:
+            return False
 
-    @staticmethod
-    def _applies(item):
-        return True
+        if not lchunk:
+            return True
 
-    @classmethod
-    def cmp(cls, comparison):
-        e = [i.exists for i in comparison.pair]
-        if reduce(operator.ne, e):
-            cls._log_different(comparison)
-            return Different
+class _Tee(object):
+    """
+    A file object reading through to *fileobj*, copying what's read to
+    *spool*, if given.  It remembers the last piece read and how far
+    into *fileobj* that piece began, so once :py:func:`_files_equal`
+    finds a difference, everything before that offset is known to have
+    been the same on both sides.
+    """
+    def __init__(self, fileobj, spool=None):
+        self.fileobj = fileobj
+        self.spool = spool
+        self.offset = 0
+        self.last = b''
 
-        if e[0] is False:
-            cls._log_same(comparison)
-            return Same
+    def read(self, size=-1):
+        self.offset += len(self.last)
+        self.last = self.fileobj.read(size)
+        if self.spool is not None:
+            self.spool.write(self.last)
 
-        cls._log_indeterminate(comparison)
-        return False
+        return self.last
 
-@_loggable
-class ElfComparator(Comparator):
+def _copy(src, dst, size=-1):
     """
-    Elf files are different if any of the important sections are
-    different.
+    Copy *size* bytes, (or all that's left), of file object *src* to
+    *dst* a chunk at a time.
     """
+    while size:
+        piece = src.read(_chunk_size if size < 0 else min(size, _chunk_size))
+        if not piece:
+            break
 
-    _magic = b'\x7fELF'
+        dst.write(piece)
+        size -= len(piece) if size > 0 else 0
 
-    @staticmethod
-    def _applies(item):
-        return item.content.find(ElfComparator._magic, 0, len(ElfComparator._magic)) == 0
+def _spool(fileobj=None, spool=None):
+    """
+    Copy what's left of *fileobj*, if given, to *spool*, (or to a new
+    temporary file held in memory until it outgrows a chunk), and
+    return it rewound.
+    """
+    if spool is None:
+        spool = tempfile.SpooledTemporaryFile(max_size=_chunk_size)
 
-    @classmethod
-    def cmp(cls, comparison):
-        e = [(i.content.find(cls._magic, 0, len(cls._magic)) == 0) for i in comparison.pair]
-        if not reduce(operator.iand, e):
-            cls._log_different(comparison)
-            return Different
+    if fileobj is not None:
+        _copy(fileobj, spool)
 
-        e = [elffile.open(name=i.name, block=i.content) for i in comparison.pair]
-        if e[0].close_enough(e[1]):
-            cls._log_same(comparison)
-            return Same
-        else:
-            cls._log_different(comparison)
+    spool.seek(0)
+    return spool
 
-            with tempfile.NamedTemporaryFile(delete=False) as left:
-                leftname = left.name
-                left.write(comparison.pair[0].content)
+def _line_blocks(buf):
+    """
+    Yield (start, end) offsets splitting *buf* into blocks of about a
+    chunk each, cut only at line breaks, (or at the end).
+    """
+    (start, size) = (0, len(buf))
 
-            lcontent = subprocess.check_output(str('objdump -sfh {}'.format(leftname)).split())
-            os.remove(leftname)
+    while start < size:
+        end = start + _chunk_size
+        if end < size:
+            cut = buf.rfind(b'\n', start, end)
+            if cut < 0:
+                # a line longer than a chunk.
+                cut = buf.find(b'\n', end)
 
-            with tempfile.NamedTemporaryFile(delete=False) as right:
-                rightname = right.name
-                right.write(comparison.pair[1].content)
+            end = size if cut < 0 else cut + 1
 
-            rcontent = subprocess.check_output(str('objdump -sfh {}'.format(rightname)).split())
-            os.remove(rightname)
+        end = min(end, size)
+        yield (start, end)
+        start = end
 
-            cls._log_unidiffs([lcontent, rcontent], [i.name for i in comparison.pair])
-            return Different
+def _blotted_chunks(buf):
+    """
+    Yield the content of *buf*, date blotted, a chunk at a time.  Dates
+    never span lines so each chunk is cut at a line break rather than
+    overlapping its neighbours.
+    """
+    for (start, end) in _line_blocks(buf):
+        yield date_blot_bytes(buf[start:end])
 
-@_loggable
-class ArMemberMetadataComparator(Comparator):
+def _streams_equal(left, right):
     """
-    Verify the metadata of each member of an ar archive.
+    Compare two iterables of byte strings as though each had been
+    joined, without joining them, stopping at the first difference.
     """
-    @staticmethod
-    def _applies(item):
-        return (item.parent is not None) and (item.parent.box is ArComparator)
+    (left, right) = (iter(left), iter(right))
+    (lpending, rpending) = (b'', b'')
 
-    @classmethod
-    def cmp(cls, comparison):
-        cls.logger.log(logging.DEBUG, 'cmp: pair[0] = %s', comparison.pair[0].name)
-        cls.logger.log(logging.DEBUG, 'cmp: parent = %s', comparison.pair[0].parent.name)
+    while True:
+        while lpending == b'':
+            lpending = next(left, None)
 
-        (left, right) = [i.parent.ar.archived_files[i.shortname].header for i in comparison.pair]
+        while rpending == b'':
+            rpending = next(right, None)
 
-        if ((comparison.ignore_ownerships
-             or (left.uid == right.uid
-                 and left.gid == right.gid))
-            and left.mode == right.mode):
+        if lpending is None or rpending is None:
+            return lpending is rpending
+
+        length = min(len(lpending), len(rpending))
+        if lpending[:length] != rpending[:length]:
             return False
-        else:
-            cls._log_different(comparison)
-            diffmsg = ''
 
-            if left.uid != right.uid:
-                diffmsg += '\n uid = {} {}'.format(left.uid, right.uid)
+        (lpending, rpending) = (lpending[length:], rpending[length:])
 
-            if left.gid != right.gid:
-                diffmsg += '\n gid = {} {}'.format(left.gid, right.gid)
+def _head_lines(text, count):
+    """
+    The first *count* lines of *text*.
+    """
+    p = -1
+    for i in range(count):
+        p = text.find(b'\n', p + 1)
+        if p < 0:
+            return text
 
-            if left.mode != right.mode:
-                diffmsg += '\nmode = {} {}'.format(left.mode, right.mode)
+    return text[:p + 1]
 
-            diffmsg += '\n\n'
-            cls.logger.log(DIFFERENCES, diffmsg)
-            return Different
+def _tail_lines(text, count):
+    """
+    The last *count* complete lines of *text*, and whatever follows
+    the last line break.
+    """
+    p = len(text)
+    for i in range(count + 1):
+        p = text.rfind(b'\n', 0, p)
+        if p < 0:
+            return text
 
+    return text[p + 1:]
 
-@contextlib.contextmanager
-def openar(filename, fileobj):
+def _stream_difference(left, right, context=3):
     """
+    Compare two iterables of byte strings as though each had been
+    joined, without joining them, stopping at the first difference.
+    Only a few lines are kept for reporting.
+
+    Return None if they're the same.  Otherwise return the number of
+    the line in which they first differ, (counting from 1), and the
+    *context* lines before it followed by as many as *context* + 1
+    lines from it on, for each side.
     """
-    ar = arpy.Archive(filename=filename, fileobj=fileobj)
-    ar.read_all_headers()
-    yield ar
-    ar.close()
+    (left, right) = (iter(left), iter(right))
+    (lpending, rpending) = (b'', b'')
+    (lineno, before) = (1, b'')
 
-# its possible that ar can hold directories or devices.  It has a
-# "mode" field.  But in practice, this doesn't seem to be used.
+    while True:
+        while lpending == b'':
+            lpending = next(left, None)
 
-@_loggable
-class ArComparator(ContentOnlyBox):
-    """
-    Ar archive files are different if any of the important members are
-    different.
+        while rpending == b'':
+            rpending = next(right, None)
 
-    .. note:: This is a strategy - there are no instance
-       properties. Rather, the content is stored in the comparison
-       pairs.
-    """
+        if lpending is None and rpending is None:
+            return None
 
-    _magic = b'!<arch>\n'
+        (lpending, rpending) = (lpending or b'', rpending or b'')
+        length = min(len(lpending), len(rpending))
+        offset = _first_difference(lpending, rpending)
 
-    _packer = _Packer('{ar}')
+        if offset is not None and offset < length:
+            break
+
+        # alike as far as the shorter goes.
+        if length == 0:
+            offset = 0
+            break
+
+        lineno += lpending.count(b'\n', 0, length)
+        before = _tail_lines(before + lpending[:length], context)
+        (lpending, rpending) = (lpending[length:], rpending[length:])
+
+    lineno += lpending.count(b'\n', 0, offset)
+    before = _tail_lines(before + lpending[:offset], context)
+    cut = before.rfind(b'\n') + 1
+    (before, partial) = (before[:cut], before[cut:])
+
+    windows = []
+    for (pending, blocks) in [(lpending, left), (rpending, right)]:
+        after = partial + pending[offset:]
+        while after.count(b'\n') <= context:
+            block = next(blocks, None)
+            if block is None:
+                break
+
+            after += block
+
+        windows.append(before + _head_lines(after, context + 1))
+
+    return (lineno, windows)
+
+@_loggable
+class BitwiseComparator(Comparator):
+    """
+    Objects which are bitwise identical are close enough.
+    """
 
     @staticmethod
     def _applies(item):
-        return item.content.find(ArComparator._magic, 0, len(ArComparator._magic)) == 0
+        BitwiseComparator.logger.log(logging.DEBUG, 'testing whether BitwiseComparator applies to %s', item.name)
+        return item.isreg
 
     @classmethod
-    def box_keys(cls, item):
-        cls.logger.log(logging.DEBUG, '%s.box_keys(%s) -> %s', cls.__name__,
-                                                                     item.name,
-                                                                     item.ar.archived_files.keys())
-        return item.ar.archived_files.keys()
+    def cmp(cls, comparison):
+        # if they're not the same size, then they're not bitwise identical.
 
-    @staticmethod
-    def member_size(member):
-        return member.parent.ar.archived_files[member.shortname].header.size
+        if not reduce(operator.eq, [i.size for i in comparison.pair]):
+            cls._log_indeterminate(comparison)
+            return False
+
+        # If we already have their content mapped, or they aren't file
+        # system files, then use content.  If they're the same, then
+        # we can drop the content because we won't need it again.
+
+        if [i for i in comparison.pair if i._content is not False or i.parent.box is not DirComparator]:
+            if comparison.pair[0].content == comparison.pair[1].content:
+                comparison.reset()
+                cls._log_same(comparison)
+                return Same
+
+            else:
+                cls._log_indeterminate(comparison)
+                return False
+
+        # at this point we know that a) we are regular files in file
+        # system files and b) neither one yet has _content.
+
+        # This is clumsy but the vast majority of file comparisons
+        # turn out to be Same on BitwiseComparator.  And I was sorry
+        # to lose the mmap earlier so I'm putting it back in here.
+
+        # Mmap both files.  Compare.  If they're the same, we're done
+        # with these files.  If they're not the same, leave their
+        # contents to be read only if some later comparator needs
+        # them.
+
+        with contextlib.nested(DirComparator.member_mmap(comparison.pair[0]),
+                               DirComparator.member_mmap(comparison.pair[1])) as (m1, m2):
+            if _buffers_equal(m1, m2):
+                cls._log_same(comparison)
+                return Same
+
+            else:
+                cls._log_indeterminate(comparison)
+                retval = False
+
+        return retval
+
+
+@_loggable
+class DateBlotBitwiseComparator(Comparator):
+    """
+    Objects which are bitwise identical after date blotting are close
+    enough.  But this should only be tried late.
+    """
 
     @staticmethod
-    def member_content(member):
-        return member.parent.ar.archived_files[member.shortname].read()
+    def _applies(item):
+        return item.isreg
 
     @classmethod
     def cmp(cls, comparison):
-        with contextlib.nested(openar(comparison.pair[0].name,
-                                      io.BytesIO(comparison.pair[0].content)),
-                               openar(comparison.pair[1].name,
-                                      io.BytesIO(comparison.pair[1].content))) as (comparison.pair[0].ar,
-                                                                                   comparison.pair[1].ar):
-            return super(cls, cls).cmp(comparison)
+        # blot and compare a chunk at a time rather than holding
+        # blotted copies of both in memory.
+
+        with contextlib.nested(_content_buffer(comparison.pair[0]),
+                               _content_buffer(comparison.pair[1])) as (lbuf, rbuf):
+            same = _streams_equal(_blotted_chunks(lbuf), _blotted_chunks(rbuf))
+
+        if same:
+            cls._log_same(comparison)
+            retval = Same
+        else:
+            cls._log_indeterminate(comparison)
+            retval = False
+
+        return retval
 
 
 @_loggable
-class CpioMemberMetadataComparator(Comparator):
+class NoSuchFileComparator(Comparator):
     """
-    Verify the metadata of each member of a cpio archive.
+    Objects are different if either one is missing.
     """
+    # FIXME: perhaps this should return same if both are missing.
+
     @staticmethod
     def _applies(item):
-        return item.parent.box is CpioComparator
+        return True
 
     @classmethod
     def cmp(cls, comparison):
-        (left, right) = [i.parent.cpio.get_member(i.shortname) for i in comparison.pair]
+        e = [i.exists for i in comparison.pair]
+        if reduce(operator.ne, e):
+            cls._log_different(comparison)
+            return Different
 
-        if (left.mode == right.mode
-            and (comparison.ignore_ownerships
-                 or (left.uid == right.uid
-                     and left.gid == right.gid))
-            and left.rdevmajor == right.rdevmajor
-            and left.rdevminor == right.rdevminor
-            and left.filesize == right.filesize):
+        if e[0] is False:
+            cls._log_same(comparison)
+            return Same
 
-            # if the file has no content then we can say conclusively
-            # that they are the same at this point.
-            if left.filesize == 0:
-                return Same
+        cls._log_indeterminate(comparison)
+        return False
+
+# : elf header, section header and program header layouts, by elf
+# : class, (1 for 32 bit, 2 for 64), after e_ident.
+_elf_layouts = {
+    1: (b'HHIIIIIHHHHHH', b'IIIIIIIIII', b'IIIIIIII'),
+    2: (b'HHIQQQIHHHHHH', b'IIQQQQIIQQ', b'IIQQQQQQ'),
+}
+
+_elf_ident_size = 16
+
+class _ElfSection(object):
+    """
+    A section header, named.
+    """
+    def __init__(self, name, fields):
+        self.name = name
+        (self.nameoffset, self.type, self.flags, self.addr, self.offset, self.size,
+         self.link, self.info, self.align, self.entsize) = fields
+
+    def close_enough(self, other):
+        """
+        As :py:mod:`elffile` had it, everything but the offset, (and
+        the content).
+        """
+        return ((self.nameoffset, self.type, self.flags, self.addr, self.size,
+                 self.link, self.info, self.align, self.entsize)
+                == (other.nameoffset, other.type, other.flags, other.addr, other.size,
+                    other.link, other.info, other.align, other.entsize))
+
+class _ElfImage(object):
+    """
+    The headers of the elf file held in *buf*.  Only the file header,
+    the section and program header tables and the section name table
+    are read, so over an mmap, the rest of the file is never touched.
+
+    Raises :py:exc:`ValueError` if *buf* doesn't parse.
+    """
+
+    SHT_NOBITS = 8
+    SHT_NOTE = 7
+    PT_NOTE = 4
+    NT_GNU_BUILD_ID = 3
+
+    def __init__(self, buf):
+        ident = bytes(buf[0:_elf_ident_size])
+        if len(ident) < _elf_ident_size or ident[0:4] != ElfComparator._magic:
+            raise ValueError('not an elf file')
+
+        (elfclass, data) = bytearray(ident[4:6])
+        if elfclass not in _elf_layouts or data not in [1, 2]:
+            raise ValueError('unknown elf class {} or data encoding {}'.format(elfclass, data))
+
+        self.buf = buf
+        self.ident = ident
+        self.order = b'<' if data == 1 else b'>'
+        (header, section, segment) = [struct.Struct(self.order + layout) for layout in _elf_layouts[elfclass]]
+        self._section = section
+
+        try:
+            self.header = fields = header.unpack_from(buf, _elf_ident_size)
+            (phoff, shoff) = fields[4:6]
+            (phentsize, phnum, shentsize, shnum, shstrndx) = fields[8:13]
+            if phnum and phentsize < segment.size:
+                raise ValueError('elf program headers too small')
+
+            self.segments = [segment.unpack_from(buf, phoff + i * phentsize) for i in range(phnum)]
+
+            if elfclass == 2:
+                # 64 bit program headers put p_flags second.
+                self.segments = [(p[0], p[2], p[5], p[7]) for p in self.segments]
             else:
-                return False
-        else:
-            cls._log_different(comparison)
-            diffmsg = ''
+                self.segments = [(p[0], p[1], p[4], p[7]) for p in self.segments]
 
-            if left.uid != right.uid:
-                diffmsg += '\n uid = {} {}'.format(left.uid, right.uid)
+            if shoff and not shnum:
+                # too many sections for e_shnum, (see the gabi).
+                shnum = self._section_fields(shoff, shentsize)[5]
 
-            if left.gid != right.gid:
-                diffmsg += '\n gid = {} {}'.format(left.gid, right.gid)
+            raw = [self._section_fields(shoff + i * shentsize, shentsize) for i in range(shnum)]
+            if raw and shstrndx == 0xffff:
+                shstrndx = raw[0][6]
 
-            if left.rdevmajor != right.rdevmajor:
-                diffmsg += '\nrdevmajor = {} {}'.format(left.rdevmajor, right.rdevmajor)
+        except struct.error as err:
+            raise ValueError('truncated elf file: {}'.format(err))
 
-            if left.rdevminor != right.rdevminor:
-                diffmsg += '\nrdevminor = {} {}'.format(left.rdevminor, right.rdevminor)
+        names = raw[shstrndx] if raw and shstrndx < len(raw) else None
+        self.sections = [_ElfSection(self._name(names, r[0]), r) for r in raw]
+        self.digests = {}
 
-            if left.filesize != right.filesize:
-                diffmsg += '\nfilesize = {} {}'.format(left.filesize, right.filesize)
+    def _section_fields(self, offset, entsize):
+        if entsize < self._section.size:
+            raise ValueError('elf section headers too small')
 
-            diffmsg += '\n\n'
-            cls.logger.log(DIFFERENCES, diffmsg)
-            return Different
+        return self._section.unpack_from(self.buf, offset)
 
+    def _name(self, names, index):
+        if names is None:
+            return ''
 
-@contextlib.contextmanager
-def opencpio(filename, guts):
-    """
-    """
-    cpio = cpiofile.CpioFile().open(name=filename, block=guts)
-    yield cpio
-    cpio.close()
+        start = names[4] + index
+        end = bytes(self.buf[start:names[4] + names[5]]).find(b'\x00')
+        return bytes(self.buf[start:start + end if end >= 0 else names[4] + names[5]]).decode('latin-1')
+
+    def notes(self):
+        """
+        Yield (name, type, desc) for each note, looking in the note
+        segments if there are any and the note sections otherwise.
+        """
+        regions = [(offset, size, align) for (type, offset, size, align) in self.segments if type == self.PT_NOTE]
+        if not regions:
+            regions = [(s.offset, s.size, s.align) for s in self.sections if s.type == self.SHT_NOTE]
+
+        note = struct.Struct(self.order + b'III')
+        for (offset, size, align) in regions:
+            pad = 8 if align == 8 else 4
+            (position, end) = (offset, offset + size)
+            while position + note.size <= end:
+                (namesz, descsz, type) = note.unpack_from(self.buf, position)
+                name = position + note.size
+                desc = _pad(name + namesz, pad)
+                if desc + descsz > end:
+                    raise ValueError('elf note overruns its region at offset {}'.format(position))
+
+                yield (bytes(self.buf[name:name + namesz]).rstrip(b'\x00'), type, bytes(self.buf[desc:desc + descsz]))
+                position = _pad(desc + descsz, pad)
+
+    def header_close_enough(self, other):
+        """
+        As :py:mod:`elffile` had it, the whole file header but for the
+        section header table's offset.
+        """
+        return (self.ident == other.ident
+                and self.header[0:5] + self.header[6:] == other.header[0:5] + other.header[6:])
+
+    def digest(self, index):
+        """
+        A hash of the content of section *index*, computed once.
+        """
+        if index not in self.digests:
+            section = self.sections[index]
+            if section.type == self.SHT_NOBITS:
+                view = b''
+            else:
+                view = _view(self.buf, section.offset, section.size)
+                if len(view) != section.size:
+                    raise ValueError('elf section {} overruns the file'.format(section.name))
+
+            self.digests[index] = hashlib.sha1(view).digest()
+
+        return self.digests[index]
+
+    def build_id(self):
+        """
+        The gnu build-id, or None if there isn't one.
+        """
+        for (name, type, desc) in self.notes():
+            if name == b'GNU' and type == self.NT_GNU_BUILD_ID:
+                return desc
+
+        return None
 
 @_loggable
-class CpioComparator(UnixBox):
+class ElfComparator(Comparator):
     """
-    Cpio archive files are different if any of the important members
-    are different.
+    Elf files are different if any of the important sections are
+    different.
 
-    .. note:: This is a strategy - there are no instance
-       properties. Rather, the content is stored in the comparison
-       pairs.
+    Headers are read from a map of the file and compared first.  Then
+    the contents of the sections which aren't ignored, (see
+    :py:attr:`ignore_sections`), are hashed on a thread pool and
+    compared in order, stopping at the first difference.  Only the
+    headers and the bytes of those sections are read.
     """
 
-    _packer = _Packer('{cpio}')
+    _magic = b'\x7fELF'
+
+    # : Take elf files with the same gnu build-id to be the same, reading
+    # : only their headers and notes.  Off by default as a build-id is
+    # : only as good as the tool chain which stamped it.
+    build_id = False
+
+    # : fnmatch style patterns of the names of sections whose contents
+    # : are ignored, (they vary with time, build location, etc).  Also
+    # : ignored are sections with no content in the file.
+    ignore_sections = [
+        '.ARM.attributes',
+        '.ARM.exidx',
+        '.ARM.extab',
+        '.comment',
+        '.debug_aranges',
+        '.debug_frame',
+        '.debug_info',
+        '.debug_line',
+        '.debug_loc',
+        '.debug_pubnames',
+        '.debug_ranges',
+        '.debug_str',
+        '.gnu_debuglink',
+        '.note.*',
+        '.rel.ARM.exidx',
+        '.rel.debug_aranges',
+        '.rel.debug_frame',
+        '.rel.debug_info',
+        '.rel.debug_line',
+        '.rel.debug_pubnames',
+        '.rel.text',
+        '.rodata',
+        '.rodata.str1.4',
+        '.shstrtab',
+        '.strtab',
+        '.symtab',
+        ]
 
     @staticmethod
     def _applies(item):
-        return bool(cpiofile.valid_magic(item.content))
+        return item.peek(len(ElfComparator._magic)) == ElfComparator._magic
+
+    @staticmethod
+    def _build_id(item):
+        with _content_buffer(item) as buf:
+            try:
+                return _ElfImage(buf).build_id()
+
+            except ValueError as err:
+                ElfComparator.logger.log(logging.DEBUG, 'no build-id for %s: %s', item.name, err)
+                return None
 
     @classmethod
-    def box_keys(cls, item):
-        return item.cpio.names
+    def _ignored(cls, section):
+        return (section.type == _ElfImage.SHT_NOBITS
+                or [pattern for pattern in cls.ignore_sections if fnmatch.fnmatchcase(section.name, pattern)])
 
     @staticmethod
-    def member_size(member):
-        return member.parent.cpio.get_member(member.shortname).filesize
+    def _digest(key):
+        (image, index) = key
+        return image.digest(index)
 
-    @staticmethod
-    def member_content(member):
-        return member.parent.cpio.get_member(member.shortname).content
+    # : Bounds on difference reports: the most sections whose contents
+    # : are shown and the most bytes shown of each.
+    report_sections = 8
+    report_bytes = 1024
 
-    @staticmethod
-    def member_isreg(member):
-        return stat.S_ISREG(member.parent.cpio.get_member(member.shortname).mode)
+    _header_fields = ['type', 'machine', 'version', 'entry', 'phoff', 'shoff', 'flags',
+                      'ehsize', 'phentsize', 'phnum', 'shentsize', 'shnum', 'shstrndx']
+
+    _section_fields = ['nameoffset', 'type', 'flags', 'addr', 'size', 'link', 'info', 'align', 'entsize']
+
+    @classmethod
+    def _section_diff(cls, images, names, index):
+        """
+        A unified diff of hex dumps of section *index* from a little
+        before its first difference, at most :py:attr:`report_bytes` of
+        it.
+        """
+        sections = [image.sections[index] for image in images]
+        views = [_view(image.buf, section.offset, section.size) for (image, section) in zip(images, sections)]
+
+        first = _first_difference(*views) or 0
+        start = max(first - first % 16 - 32, 0)
+        dumps = [list(_hexdump(view[start:start + cls.report_bytes], start)) for view in views]
+
+        lines = list(difflib.unified_diff(dumps[0], dumps[1],
+                                          '{}:{}'.format(names[0], sections[0].name),
+                                          '{}:{}'.format(names[1], sections[1].name),
+                                          '', '', 3, ''))
+
+        rest = max(len(view) for view in views) - start - cls.report_bytes
+        if rest > 0:
+            lines.append('... {} more bytes of {} not shown'.format(rest, sections[0].name))
+
+        return lines
+
+    @classmethod
+    def _report(cls, images, names):
+        """
+        Describe the differences between elf *images* from their
+        headers and those of their sections, and with hex dumps of the
+        contents of the sections which differ.  Sections already hashed
+        aren't hashed again, and those which can't be read are noted as
+        such.
+        """
+        (left, right) = images
+        lines = []
+
+        if left.ident != right.ident:
+            lines.append('ident = {} {}'.format(binascii.hexlify(left.ident).decode('ascii'),
+                                                binascii.hexlify(right.ident).decode('ascii')))
+
+        for (field, this, that) in zip(cls._header_fields, left.header, right.header):
+            if this != that:
+                lines.append('{} = {:#x} {:#x}'.format(field, this, that))
+
+        for (these, those) in [(left.sections, right.sections), (right.sections, left.sections)]:
+            for section in these[len(those):]:
+                lines.append('section {} only in {}'.format(section.name, names[these is right.sections]))
+
+        shown = 0
+        for index in range(min(len(left.sections), len(right.sections))):
+            (this, that) = (left.sections[index], right.sections[index])
+            if cls._ignored(this) and cls._ignored(that):
+                continue
+
+            if this.name != that.name:
+                lines.append('section {} name = {} {}'.format(index, this.name, that.name))
+
+            for field in cls._section_fields:
+                if getattr(this, field) != getattr(that, field):
+                    lines.append('section {} {} = {:#x} {:#x}'.format(this.name, field,
+                                                                       getattr(this, field), getattr(that, field)))
+
+            try:
+                differs = left.digest(index) != right.digest(index)
+
+            except ValueError as err:
+                lines.append('section {} unreadable: {}'.format(this.name, err))
+                continue
+
+            if differs:
+                if shown == cls.report_sections:
+                    lines.append('... more sections differ')
+                    break
+
+                lines.extend(cls._section_diff(images, names, index))
+                shown += 1
+
+        return lines
+
+    @classmethod
+    def _difference(cls, left, right):
+        """
+        Find the first important difference between elf images *left*
+        and *right*.
+
+        :returns: None if there is none, otherwise a description.
+        """
+        if not left.header_close_enough(right):
+            return 'file header'
+
+        if len(left.sections) != len(right.sections):
+            return 'section count'
+
+        indexes = [index for (index, section) in enumerate(left.sections) if not cls._ignored(section)]
+        for index in indexes:
+            (this, that) = (left.sections[index], right.sections[index])
+            if this.name != that.name or not this.close_enough(that):
+                return 'section header {}'.format(this.name)
+
+        keys = [(image, index) for index in indexes for image in [left, right]]
+
+        with _threadpool() as pool:
+            prefetch = _Prefetcher(pool, cls._digest, keys, 2 * _pool_size())
+            for index in indexes:
+                if prefetch.get((left, index)) != prefetch.get((right, index)):
+                    return 'section {}'.format(left.sections[index].name)
+
+        return None
+
+    @classmethod
+    def cmp(cls, comparison):
+        if cls.build_id:
+            ids = [cls._build_id(i) for i in comparison.pair]
+            if ids[0] and ids[0] == ids[1]:
+                cls._log_same(comparison)
+                return Same
+
+        with contextlib.nested(_content_buffer(comparison.pair[0]),
+                               _content_buffer(comparison.pair[1])) as bufs:
+            try:
+                images = [_ElfImage(buf) for buf in bufs]
+                difference = cls._difference(*images)
+
+            except ValueError as err:
+                cls.logger.log(logging.DEBUG, '%s could not read %s: %s', cls.__name__,
+                               [i.name for i in comparison.pair], err)
+                cls._log_indeterminate(comparison)
+                return False
+
+            if difference is None:
+                cls._log_same(comparison)
+                return Same
+
+            cls._log_different(comparison)
+            if cls.logger.isEnabledFor(DIFFERENCES):
+                cls.logger.log(DIFFERENCES, '\n'.join(['first difference in {}'.format(difference)]
+                                                      + cls._report(images, [i.name for i in comparison.pair])))
+            return Different
+
+@_loggable
+class ArMemberMetadataComparator(Comparator):
+    """
+    Verify the metadata of each member of an ar archive.
+    """
+    @staticmethod
+    def _applies(item):
+        return (item.parent is not None) and (item.parent.box is ArComparator)
+
+    @classmethod
+    def cmp(cls, comparison):
+        cls.logger.log(logging.DEBUG, 'cmp: pair[0] = %s', comparison.pair[0].name)
+        cls.logger.log(logging.DEBUG, 'cmp: parent = %s', comparison.pair[0].parent.name)
+
+        (left, right) = [i.parent.ar.archived_files[i.shortname].header for i in comparison.pair]
+
+        if ((comparison.ignore_ownerships
+             or (left.uid == right.uid
+                 and left.gid == right.gid))
+            and left.mode == right.mode):
+            return False
+        else:
+            cls._log_different(comparison)
+            diffmsg = ''
+
+            if left.uid != right.uid:
+                diffmsg += '\n uid = {} {}'.format(left.uid, right.uid)
+
+            if left.gid != right.gid:
+                diffmsg += '\n gid = {} {}'.format(left.gid, right.gid)
+
+            if left.mode != right.mode:
+                diffmsg += '\nmode = {} {}'.format(left.mode, right.mode)
+
+            diffmsg += '\n\n'
+            cls.logger.log(DIFFERENCES, diffmsg)
+            return Different
+
+
+# : ar member header: name, date, uid, gid, mode, size and magic.
+_ar_header = struct.Struct(b'16s12s6s6s8s10s2s')
+
+def _ar_int(field, base=10):
+    return int(field.strip() or b'0', base)
+
+class _ArHeader(object):
+    """
+    The header of one ar archive member.
+    """
+    def __init__(self, name, timestamp, uid, gid, mode, size, offset, file_offset):
+        self.name = name
+        self.timestamp = timestamp
+        self.uid = uid
+        self.gid = gid
+        self.mode = mode
+        self.size = size
+        self.offset = offset
+        self.file_offset = file_offset
+
+class _ArMember(object):
+    """
+    One member of an :py:class:`_ArArchive`.
+    """
+    def __init__(self, archive, header):
+        self.archive = archive
+        self.header = header
+
+    def view(self):
+        return _view(self.archive.buf, self.header.file_offset, self.header.size)
+
+    def read(self):
+        return bytes(self.archive.buf[self.header.file_offset:self.header.file_offset + self.header.size])
+
+class _ArArchive(object):
+    """
+    An index of the members of the ar archive held in *buf*.  Only the
+    member headers are read.
+
+    GNU's symbol table, ("/" or "/SYM64/"), is derived from the other
+    members and skipped.  GNU's long name table, ("//"), resolves the
+    names of members named "/offset".  BSD's long names, ("#1/length"),
+    follow their headers.
+
+    Raises :py:exc:`ValueError` if *buf* doesn't parse.
+    """
+    def __init__(self, buf):
+        if bytes(buf[0:len(ArComparator._magic)]) != ArComparator._magic:
+            raise ValueError('not an ar archive')
+
+        self.buf = buf
+        self.members = []
+        self.archived_files = {}
+        longnames = None
+
+        offset = len(ArComparator._magic)
+        while offset + _ar_header.size <= len(buf):
+            (name, timestamp, uid, gid, mode, size, magic) = _ar_header.unpack_from(buf, offset)
+            if magic != b'`\n':
+                raise ValueError('bad ar header at offset {}'.format(offset))
+
+            (name, size) = (name.rstrip(b' '), _ar_int(size))
+            file_offset = offset + _ar_header.size
+            following = file_offset + size + ((file_offset + size) & 1)
+
+            if name in [b'/', b'/SYM64/']:
+                offset = following
+                continue
+
+            if name == b'//':
+                longnames = bytes(buf[file_offset:file_offset + size])
+                offset = following
+                continue
+
+            if name.startswith(b'#1/'):
+                length = _ar_int(name[3:])
+                name = bytes(buf[file_offset:file_offset + length]).rstrip(b'\x00')
+                (file_offset, size) = (file_offset + length, size - length)
+
+            elif name.startswith(b'/') and name[1:].isdigit():
+                if longnames is None:
+                    raise ValueError('ar long name without a long name table at offset {}'.format(offset))
+
+                start = int(name[1:])
+                name = longnames[start:longnames.find(b'\n', start)].rstrip(b'/')
+
+            elif len(name) > 1:
+                name = name.rstrip(b'/')
+
+            header = _ArHeader(name, _ar_int(timestamp), _ar_int(uid), _ar_int(gid), _ar_int(mode, 8),
+                               size, offset, file_offset)
+            member = _ArMember(self, header)
+            self.members.append(member)
+            self.archived_files[name] = member
+            offset = following
+
+@contextlib.contextmanager
+def openar(filename, buf):
+    """
+    Index the ar archive held in *buf*.  Members of the same name,
+    (which ar allows), are indexed by the last of them.
+    """
+    yield _ArArchive(buf)
+
+# its possible that ar can hold directories or devices.  It has a
+# "mode" field.  But in practice, this doesn't seem to be used.
+
+@_loggable
+class ArComparator(ContentOnlyBox):
+    """
+    Ar archive files are different if any of the important members are
+    different.
+
+    .. note:: This is a strategy - there are no instance
+       properties. Rather, the content is stored in the comparison
+       pairs.
+    """
+
+    _magic = b'!<arch>\n'
+
+    _packer = _Packer('{ar}')
+
+    @staticmethod
+    def _applies(item):
+        return item.peek(len(ArComparator._magic)) == ArComparator._magic
+
+    @classmethod
+    def box_keys(cls, item):
+        cls.logger.log(logging.DEBUG, '%s.box_keys(%s) -> %s', cls.__name__,
+                                                                     item.name,
+                                                                     item.ar.archived_files.keys())
+        return item.ar.archived_files.keys()
+
+    @staticmethod
+    def member_size(member):
+        return member.parent.ar.archived_files[member.shortname].header.size
+
+    @staticmethod
+    def member_content(member):
+        return member.parent.ar.archived_files[member.shortname].read()
+
+    @staticmethod
+    def _digest(member):
+        return hashlib.sha1(member.view()).digest()
+
+    @classmethod
+    def _settle(cls, comparison):
+        """
+        Find the mated members whose headers and content hashes match.
+        The hashing is done on a thread pool.  hashlib releases the gil.
+
+        :rtype: set of member names
+        """
+        (left, right) = [p.ar.archived_files for p in comparison.pair]
+
+        candidates = []
+        for (name, lmember) in left.items():
+            rmember = right.get(name)
+            if (rmember is not None
+                and lmember.header.size == rmember.header.size
+                and lmember.header.mode == rmember.header.mode
+                and (comparison.ignore_ownerships
+                     or (lmember.header.uid == rmember.header.uid
+                         and lmember.header.gid == rmember.header.gid))):
+                candidates.append((name, lmember, rmember))
+
+        with _threadpool() as pool:
+            digests = pool.map(cls._digest, [member for (name, lmember, rmember) in candidates
+                                             for member in [lmember, rmember]])
+
+        return frozenset(name for (i, (name, lmember, rmember)) in enumerate(candidates)
+                         if digests[2 * i] == digests[2 * i + 1])
+
+    @classmethod
+    def cmp(cls, comparison):
+        with contextlib.nested(_content_buffer(comparison.pair[0]),
+                               _content_buffer(comparison.pair[1])) as (lbuf, rbuf):
+            with contextlib.nested(openar(comparison.pair[0].name, lbuf),
+                                   openar(comparison.pair[1].name, rbuf)) as (comparison.pair[0].ar,
+                                                                              comparison.pair[1].ar):
+                settled = cls._settle(comparison)
+
+                if (len(settled) == len(comparison.pair[0].ar.archived_files)
+                    == len(comparison.pair[1].ar.archived_files)):
+                    cls._log_same(comparison)
+                    return Same
+
+                cls.logger.log(logging.DEBUG, '%s hashed %s settling %d of %d', cls.__name__,
+                               comparison.pair[0].name, len(settled), len(comparison.pair[0].ar.archived_files))
+
+                for p in comparison.pair:
+                    p.settled = settled
+
+                try:
+                    return super(cls, cls).cmp(comparison)
+
+                finally:
+                    for p in set(comparison.pair):
+                        del p.settled
+
+
+@_loggable
+class CpioMemberMetadataComparator(Comparator):
+    """
+    Verify the metadata of each member of a cpio archive.
+    """
+    @staticmethod
+    def _applies(item):
+        return item.parent.box is CpioComparator
+
+    @classmethod
+    def cmp(cls, comparison):
+        (left, right) = [i.parent.box.getmember(i) for i in comparison.pair]
+
+        if (left.mode == right.mode
+            and (comparison.ignore_ownerships
+                 or (left.uid == right.uid
+                     and left.gid == right.gid))
+            and left.rdevmajor == right.rdevmajor
+            and left.rdevminor == right.rdevminor
+            and left.filesize == right.filesize):
+
+            # if the file has no content then we can say conclusively
+            # that they are the same at this point.
+            if left.filesize == 0:
+                return Same
+            else:
+                return False
+        else:
+            cls._log_different(comparison)
+            diffmsg = ''
+
+            if left.uid != right.uid:
+                diffmsg += '\n uid = {} {}'.format(left.uid, right.uid)
+
+            if left.gid != right.gid:
+                diffmsg += '\n gid = {} {}'.format(left.gid, right.gid)
+
+            if left.rdevmajor != right.rdevmajor:
+                diffmsg += '\nrdevmajor = {} {}'.format(left.rdevmajor, right.rdevmajor)
+
+            if left.rdevminor != right.rdevminor:
+                diffmsg += '\nrdevminor = {} {}'.format(left.rdevminor, right.rdevminor)
+
+            if left.filesize != right.filesize:
+                diffmsg += '\nfilesize = {} {}'.format(left.filesize, right.filesize)
+
+            diffmsg += '\n\n'
+            cls.logger.log(DIFFERENCES, diffmsg)
+            return Different
+
+
+# : cpio headers.  newc and crc are in hex, odc in octal.  The old
+# : binary format is 16 bit words in either byte order.
+_cpio_newc = struct.Struct(b'6s8s8s8s8s8s8s8s8s8s8s8s8s8s')
+_cpio_odc = struct.Struct(b'6s6s6s6s6s6s6s6s11s6s11s')
+_cpio_bin = {
+    'little': struct.Struct(b'<13H'),
+    'big': struct.Struct(b'>13H'),
+}
+
+# : The ascii headers' digits, base and name size field.
+_cpio_ascii = {
+    'newc': (_cpio_newc, b'0123456789abcdefABCDEF', 16, 12),
+    'odc': (_cpio_odc, b'01234567', 8, 9),
+}
+
+_cpio_trailer = b'TRAILER!!!'
+
+def _cpio_format(magic):
+    """
+    Name the format of a cpio archive from its first six bytes, or
+    return None if it isn't one.
+    """
+    magic = bytes(magic[0:6])
+    if magic in [b'070701', b'070702']:
+        return 'newc'
+
+    if magic == b'070707':
+        return 'odc'
+
+    for (order, header) in _cpio_bin.items():
+        if len(magic) >= 2 and header.unpack_from(magic.ljust(header.size, b'\x00'))[0] == 0o070707:
+            return order
+
+    return None
+
+def _pad(offset, alignment):
+    return offset + (-offset % alignment)
+
+class _CpioMember(object):
+    """
+    One member of a :py:class:`_CpioArchive`.  The fields are as for
+    cpiofile, which this replaces.
+    """
+    def __init__(self, archive, name, ino, mode, uid, gid, nlink, mtime, dev, rdev, filesize, offset):
+        self.archive = archive
+        self.name = name
+        self.ino = ino
+        self.mode = mode
+        self.uid = uid
+        self.gid = gid
+        self.nlink = nlink
+        self.mtime = mtime
+        (self.devmajor, self.devminor) = dev
+        (self.rdevmajor, self.rdevminor) = rdev
+        self.filesize = filesize
+        self.offset = offset
+
+    def view(self):
+        return _view(self.archive.buf, self.offset, self.filesize)
+
+    @property
+    def content(self):
+        return bytes(self.archive.buf[self.offset:self.offset + self.filesize])
+
+class _CpioArchive(object):
+    """
+    An index of the members of the cpio archive held in *buf*, in any
+    of the newc, crc, odc or old binary formats.  Only the member
+    headers are read.  Members of the same name are indexed by the
+    first of them.
+
+    Raises :py:exc:`ValueError` if *buf* doesn't parse.
+    """
+    def __init__(self, buf):
+        self.buf = buf
+        self.format = _cpio_format(buf[0:6])
+        if self.format is None:
+            raise ValueError('not a cpio archive')
+
+        self.members = []
+        self.index = {}
+
+        offset = 0
+        while True:
+            (member, offset) = self._member(offset)
+            if member.name == _cpio_trailer:
+                break
+
+            self.members.append(member)
+            self.index.setdefault(member.name, member)
+
+    @property
+    def names(self):
+        return [member.name for member in self.members]
+
+    def _name(self, start, namesize):
+        if start + namesize > len(self.buf):
+            raise ValueError('cpio archive truncated at offset {}'.format(start))
+
+        return bytes(self.buf[start:start + namesize - 1])
+
+    def _member(self, offset):
+        buf = self.buf
+
+        if self.format == 'newc':
+            if offset + _cpio_newc.size > len(buf):
+                raise ValueError('cpio archive truncated at offset {}'.format(offset))
+
+            fields = _cpio_newc.unpack_from(buf, offset)
+            if _cpio_format(fields[0]) != 'newc':
+                raise ValueError('bad cpio header at offset {}'.format(offset))
+
+            (ino, mode, uid, gid, nlink, mtime, filesize,
+             devmajor, devminor, rdevmajor, rdevminor, namesize, check) = [int(field, 16) for field in fields[1:]]
+
+            start = offset + _cpio_newc.size
+            name = self._name(start, namesize)
+            data = _pad(start + namesize, 4)
+            member = _CpioMember(self, name, ino, mode, uid, gid, nlink, mtime,
+                                 (devmajor, devminor), (rdevmajor, rdevminor), filesize, data)
+            return (member, _pad(data + filesize, 4))
+
+        if self.format == 'odc':
+            if offset + _cpio_odc.size > len(buf):
+                raise ValueError('cpio archive truncated at offset {}'.format(offset))
+
+            fields = _cpio_odc.unpack_from(buf, offset)
+            if fields[0] != b'070707':
+                raise ValueError('bad cpio header at offset {}'.format(offset))
+
+            (dev, ino, mode, uid, gid, nlink, rdev, mtime, namesize, filesize) = [int(field, 8) for field in fields[1:]]
+
+            start = offset + _cpio_odc.size
+            name = self._name(start, namesize)
+            data = start + namesize
+            member = _CpioMember(self, name, ino, mode, uid, gid, nlink, mtime,
+                                 (os.major(dev), os.minor(dev)), (os.major(rdev), os.minor(rdev)), filesize, data)
+            return (member, data + filesize)
+
+        header = _cpio_bin[self.format]
+        if offset + header.size > len(buf):
+            raise ValueError('cpio archive truncated at offset {}'.format(offset))
+
+        (magic, dev, ino, mode, uid, gid, nlink, rdev,
+         mtimehigh, mtimelow, namesize, filesizehigh, filesizelow) = header.unpack_from(buf, offset)
+        if magic != 0o070707:
+            raise ValueError('bad cpio header at offset {}'.format(offset))
+
+        start = offset + header.size
+        name = self._name(start, namesize)
+        data = _pad(start + namesize, 2)
+        filesize = (filesizehigh << 16) | filesizelow
+        member = _CpioMember(self, name, ino, mode, uid, gid, nlink, (mtimehigh << 16) | mtimelow,
+                             (os.major(dev), os.minor(dev)), (os.major(rdev), os.minor(rdev)), filesize, data)
+        return (member, _pad(data + filesize, 2))
+
+@contextlib.contextmanager
+def opencpio(filename, buf):
+    """
+    Index the cpio archive held in *buf*.
+    """
+    yield _CpioArchive(buf)
+
+@_loggable
+class CpioComparator(UnixBox):
+    """
+    Cpio archive files are different if any of the important members
+    are different.
+
+    .. note:: This is a strategy - there are no instance
+       properties. Rather, the content is stored in the comparison
+       pairs.
+    """
+
+    _packer = _Packer('{cpio}')
+
+    @staticmethod
+    def _applies(item):
+        """
+        Magic numbers turn up by chance, the binary formats' two bytes
+        in any file and the ascii formats' six digits in text, so the
+        first header must also parse and its name end where its size
+        says.
+        """
+        format = _cpio_format(item.peek(6))
+        if format is None:
+            return False
+
+        header = _cpio_bin[format] if format in _cpio_bin else _cpio_ascii[format][0]
+        block = item.peek(header.size + 0xffff)
+        if len(block) < header.size:
+            return False
+
+        fields = header.unpack_from(block)
+        if format in _cpio_bin:
+            namesize = fields[10]
+        else:
+            (digits, base, field) = _cpio_ascii[format][1:]
+            if any(bytes(f).strip(digits) for f in fields[1:]):
+                return False
+
+            namesize = int(fields[field], base)
+
+        name = bytes(block[header.size:header.size + namesize])
+        return namesize > 0 and len(name) == namesize and name.find(b'\x00') == namesize - 1
+
+    @staticmethod
+    def getmember(item):
+        return item.parent.cpio.index[item.shortname]
+
+    @classmethod
+    def box_keys(cls, item):
+        if not hasattr(item, 'names'):
+            item.names = item.cpio.names
+
+        return item.names
+
+    @staticmethod
+    def member_size(member):
+        return member.parent.box.getmember(member).filesize
+
+    @staticmethod
+    def member_content(member):
+        return member.parent.box.getmember(member).content
+
+    @staticmethod
+    def member_isreg(member):
+        return stat.S_ISREG(member.parent.box.getmember(member).mode)
+
+    @staticmethod
+    def member_islnk(member):
+        return stat.S_ISLNK(member.parent.box.getmember(member).mode)
+
+    @staticmethod
+    def member_link(member):
+        return member.content
+
+    @staticmethod
+    def _member_same(left, right, ignore_ownerships):
+        return (left.name == right.name
+                and left.mode == right.mode
+                and (ignore_ownerships
+                     or (left.uid == right.uid
+                         and left.gid == right.gid))
+                and left.rdevmajor == right.rdevmajor
+                and left.rdevminor == right.rdevminor
+                and left.filesize == right.filesize
+                and left.view() == right.view())
+
+    @classmethod
+    def _settle(cls, comparison):
+        """
+        Walk both member lists in lockstep, settling members which are
+        the same as they go past.  Members out of step are left to be
+        compared individually.
+
+        :returns: (settled, unsettled) sets of member names
+        """
+        (settled, unsettled) = (set(), set())
+        (left, right) = [p.cpio.members for p in comparison.pair]
+
+        for i in range(max(len(left), len(right))):
+            pair = [members[i] for members in [left, right] if i < len(members)]
+
+            if len(pair) == 2 and cls._member_same(pair[0], pair[1], comparison.ignore_ownerships):
+                settled.add(pair[0].name)
+            else:
+                unsettled.update(member.name for member in pair)
+
+        # a name seen more than once is only settled if it always matched.
+        return (settled - unsettled, unsettled)
+
+    @classmethod
+    def cmp(cls, comparison):
+        with contextlib.nested(_content_buffer(comparison.pair[0]),
+                               _content_buffer(comparison.pair[1])) as (lbuf, rbuf):
+            try:
+                (comparison.pair[0].cpio, comparison.pair[1].cpio) = [_CpioArchive(buf) for buf in (lbuf, rbuf)]
+
+            except ValueError as err:
+                cls.logger.log(logging.DEBUG, '%s could not read %s: %s', cls.__name__,
+                               [i.name for i in comparison.pair], err)
+                cls._log_indeterminate(comparison)
+                return False
+
+            (settled, unsettled) = cls._settle(comparison)
+
+            if not unsettled:
+                cls._log_same(comparison)
+                return Same
+
+            for p in comparison.pair:
+                p.settled = settled
+
+            try:
+                return super(cls, cls).cmp(comparison)
+
+            finally:
+                for p in set(comparison.pair):
+                    del p.settled
+
+
+@_loggable
+class TarMemberMetadataComparator(Comparator):
+    """
+    Verify the metadata of each member of an ar archive.
+    """
+    @staticmethod
+    def _applies(item):
+        return item.parent.box is TarComparator
+
+    @classmethod
+    def cmp(cls, comparison):
+        (left, right) = [i.parent.box.getmember(i) for i in comparison.pair]
+
+        if (left.mode == right.mode
+            and left.type == right.type
+            and left.linkname == right.linkname
+            and (comparison.ignore_ownerships
+                 or (left.uid == right.uid
+                     and left.gid == right.gid
+                     and left.uname == right.uname
+                     and left.gname == right.gname))):
+
+            # if the file has no content then we can say conclusively
+            # that they are the same at this point.
+            if left.size == 0:
+                return Same
+            else:
+                return False
+        else:
+            cls._log_different(comparison)
+            diffmsg = ''
+
+            if left.mode != right.mode:
+                diffmsg += '\n mode = {} {}'.format(left.mode, right.mode)
+
+            if left.type != right.type:
+                diffmsg += '\n type = {} {}'.format(left.type, right.type)
+
+            if left.linkname != right.linkname:
+                diffmsg += '\n linkname = {} {}'.format(left.linkname, right.linkname)
+
+            if left.uid != right.uid:
+                diffmsg += '\n uid = {} {}'.format(left.uid, right.uid)
+
+            if left.gid != right.gid:
+                diffmsg += '\n gid = {} {}'.format(left.gid, right.gid)
+
+            if left.uname != right.uname:
+                diffmsg += '\nuname = {} {}'.format(left.uname, right.uname)
+
+            if left.gname != right.gname:
+                diffmsg += '\ngname = {} {}'.format(left.gname, right.gname)
+
+            diffmsg += '\n\n'
+            cls.logger.log(DIFFERENCES, diffmsg)
+            return Different
+
+
+# TarFile didn't become a context manager until 2.7.  :\.
+import contextlib
+@contextlib.contextmanager
+def opentar(filename, mode, fileobj):
+    """
+    .. todo:: remove opentar once we move to python-2.7
+    """
+    tar = tarfile.open(name=filename, mode=mode, fileobj=fileobj)
+
+    # TarFile.getmember scans the whole member list, backwards, so the
+    # last member of a given name wins.  Streams can't be indexed.
+    if '|' not in mode:
+        tar.index = dict((info.name, info) for info in tar.getmembers())
+
+    yield tar
+    tar.close()
+
+# : tar header bytes, less the checksum field, summed as tarfile does.
+_tar_unsigned = struct.Struct(b'148B8x356B')
+_tar_signed = struct.Struct(b'148b8x356b')
+
+# : the ustar magic, posix and gnu, (the version follows).
+_tar_magics = [b'ustar\x00', b'ustar ']
+
+def _tar_octal(field):
+    """
+    Whether *field* is a plausible octal number field of an old style,
+    (v7), tar header: octal digits padded with spaces or nuls.
+    """
+    return not bytearray(field).translate(None, b'01234567 \x00')
+
+def _tar_header(block):
+    """
+    Whether *block* looks like the first header block of a tar
+    archive.  The checksum must be right and either the ustar magic is
+    present or the fields look like an old style, (v7), header.
+    """
+    if len(block) < tarfile.BLOCKSIZE:
+        return False
+
+    block = bytes(block[0:tarfile.BLOCKSIZE])
+    chksum = block[148:156].split(b'\x00', 1)[0].strip(b' ')
+    if not chksum or b' ' in chksum or not _tar_octal(chksum):
+        # padding only at the ends.
+        return False
+
+    if int(chksum, 8) not in [256 + sum(_tar_unsigned.unpack(block)),
+                              256 + sum(_tar_signed.unpack(block))]:
+        return False
+
+    if block[257:263] in _tar_magics:
+        return True
+
+    return (block[0:1] != b'\x00'
+            and _tar_octal(block[100:148])
+            and block[156:157] in b'\x0001234567')
+
+def _json_text(text):
+    return text.decode('latin-1') if isinstance(text, bytes) else text
+
+def _native_text(text):
+    # tarfile's names are bytes on python2.
+    return text.encode('latin-1') if bytes is str else text
+
+class _RegionReader(object):
+    """
+    A file object decoding the compressed content *buf* front to back
+    while noting where each independently decodable region, (gzip
+    member or bzip2 stream), begins.  What's decoded is checked
+    against *budget*, if there is one, as it comes.
+    """
+    def __init__(self, comptype, buf, budget=None):
+        self.comptype = comptype
+        self.buf = buf
+        self.budget = budget
+        self.regions = []
+        self.coffset = 0
+        self.uoffset = 0
+        self.decoder = None
+        self.pending = b''
+        self.pieces = self._decode()
+
+    def _decode(self):
+        while self.coffset < len(self.buf):
+            if self.decoder is None:
+                self.decoder = _TarIndex.decoders[self.comptype]()
+                self.regions.append((self.coffset, self.uoffset))
+
+            chunk = self.buf[self.coffset:self.coffset + _chunk_size]
+            try:
+                for out in _inflate(self.decoder, chunk):
+                    if out:
+                        if self.budget:
+                            self.budget.check(self.uoffset + len(out), len(self.buf))
+
+                        self.uoffset += len(out)
+                        yield out
+
+            except EOFError:
+                # bzip2 won't take anything past the end of its stream.
+                self.decoder = None
+                continue
+
+            except (IOError, zlib.error):
+                if self.regions[-1] != (self.coffset, self.uoffset):
+                    raise
+
+                # trailing garbage, (like padding), isn't a region.
+                self.regions.pop()
+                self.coffset = len(self.buf)
+                break
+
+            self.coffset += len(chunk) - len(self.decoder.unused_data)
+            if self.decoder.unused_data:
+                self.decoder = None
+
+    def read(self, size=-1):
+        pieces = []
+        while size:
+            if not self.pending:
+                self.pending = next(self.pieces, b'')
+                if not self.pending:
+                    break
+
+            piece = self.pending if size < 0 else self.pending[0:size]
+            self.pending = self.pending[len(piece):]
+            pieces.append(piece)
+            size -= len(piece) if size > 0 else 0
+
+        return b''.join(pieces)
+
+class _TarIndex(object):
+    """
+    A random access index of a compressed tar archive.  It records the
+    offsets of the archive's independently decodable regions, (gzip
+    members or bzip2 streams), and its member headers.  Any member can
+    then be read by decoding only the regions which hold it.
+
+    Building an index means decoding the whole archive once, so
+    indexes are only built when :py:data:`cache_dir` is set, where
+    they are kept for later runs.  Where it can be, an index is built
+    as :py:class:`TarComparator` streams the archive, rather than by
+    decoding it again.  Indexes are keyed on the identity, (path,
+    inode, size and mtime), of the archive file.
+
+    Python's zlib can't resume inflation at an arbitrary bit offset,
+    so an archive written as a single gzip member has but one region
+    and gains nothing here.  Those written by bgzip, pigz --independent
+    or pbzip2 do.
+
+    While open, an index stands in for a :py:class:`tarfile.TarFile`.
+    """
+
+    version = 1
+
+    decoders = {
+        'gz': lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+        'bz2': bz2.BZ2Decompressor,
+    }
+
+    def __init__(self, comptype, regions, members):
+        self.comptype = comptype
+        self.regions = regions
+        self.starts = [uoffset for (coffset, uoffset) in regions]
+        self.members = members
+        self.index = dict((info.name, info) for info in members)
+        self.buf = None
+
+    _fields = ['name', 'type', 'mode', 'uid', 'gid', 'uname', 'gname', 'size', 'mtime', 'linkname', 'offset_data']
+
+    def _dump(self):
+        members = [[_json_text(getattr(info, field)) for field in self._fields] for info in self.members]
+        return {'version': self.version, 'comptype': self.comptype, 'regions': self.regions, 'members': members}
+
+    @classmethod
+    def _load(cls, dump):
+        if dump.get('version') != cls.version:
+            raise ValueError('index version {}'.format(dump.get('version')))
+
+        members = []
+        for fields in dump['members']:
+            info = tarfile.TarInfo()
+            for field, value in zip(cls._fields, fields):
+                setattr(info, field, value)
+
+            info.type = info.type.encode('latin-1')
+            for field in ['name', 'uname', 'gname', 'linkname']:
+                setattr(info, field, _native_text(getattr(info, field)))
+
+            members.append(info)
+
+        return cls(dump['comptype'], [tuple(region) for region in dump['regions']], members)
+
+    @staticmethod
+    def _cache_name(item):
+        return _cache_name('tar', item.name)
+
+    @classmethod
+    def build(cls, comptype, buf, budget=None):
+        reader = _RegionReader(comptype, buf, budget)
+        try:
+            with opentar(None, 'r|', reader) as tar:
+                members = list(tar)
+
+        finally:
+            if budget:
+                budget.spend(reader.uoffset)
+
+        return cls(comptype, reader.regions, members)
+
+    @staticmethod
+    def kept(item):
+        """
+        True if an index of *item* may be kept, which is to say there's
+        a cache and *item* is a file system file.
+        """
+        return bool(cache_dir) and item.parent.box is DirComparator
+
+    @classmethod
+    def cached(cls, item):
+        """
+        True if an index of *item* has been kept already.
+        """
+        return os.path.exists(cls._cache_name(item))
+
+    def save(self, item):
+        """
+        Keep this index of *item* in :py:data:`cache_dir`, if it can be
+        written there.
+        """
+        try:
+            (fd, tmpname) = tempfile.mkstemp(dir=cache_dir)
+            with os.fdopen(fd, 'w') as tmp:
+                json.dump(self._dump(), tmp)
+
+            os.rename(tmpname, self._cache_name(item))
+
+        except (IOError, OSError) as err:
+            TarComparator.logger.log(logging.DEBUG, 'index of %s not kept: %s', item.name, err)
+
+    @classmethod
+    def get(cls, item, comptype, buf):
+        """
+        Load the index of *item* from :py:data:`cache_dir`, building
+        and saving it first if need be.  Return None if no index of
+        *item* may be kept.
+        """
+        if not cls.kept(item):
+            return None
+
+        try:
+            with open(cls._cache_name(item), 'r') as fd:
+                index = cls._load(json.load(fd))
+
+        except (IOError, ValueError, KeyError, TypeError) as err:
+            TarComparator.logger.log(logging.DEBUG, 'building index of %s: %s', item.name, err)
+            index = cls.build(comptype, buf, getattr(item, 'budget', None))
+            index.save(item)
+
+        index.buf = buf
+        return index
+
+    def _decode_region(self, region):
+        cend = self.regions[region + 1][0] if region + 1 < len(self.regions) else len(self.buf)
+        decoder = self.decoders[self.comptype]()
+
+        for coffset in range(self.regions[region][0], cend, _chunk_size):
+            for piece in _inflate(decoder, self.buf[coffset:min(coffset + _chunk_size, cend)]):
+                yield piece
+
+            if decoder.unused_data:
+                break
+
+    def read(self, info, budget=None):
+        """
+        Return the content of the member described by *info*, decoding
+        only the regions which hold it.  They're charged to *budget*,
+        if there is one.
+        """
+        while info.islnk():
+            info = self.index[info.linkname]
+
+        if not info.size:
+            return b''
+
+        end = info.offset_data + info.size
+        first = bisect.bisect_right(self.starts, info.offset_data) - 1
+        last = bisect.bisect_left(self.starts, end) - 1
+
+        (pieces, size) = ([], 0)
+        for region in range(first, last + 1):
+            for piece in self._decode_region(region):
+                size += len(piece)
+                if budget:
+                    budget.check(size, len(self.buf))
+
+                pieces.append(piece)
+
+        if budget:
+            budget.spend(size)
+
+        content = b''.join(pieces)
+        start = info.offset_data - self.starts[first]
+        return content[start:start + info.size]
+
+    def getnames(self):
+        return [info.name for info in self.members]
+
+    def extractfile(self, info):
+        return io.BytesIO(self.read(info))
+
+@_loggable
+class TarComparator(UnixBox):
+    """
+    Tar archive files are different if any of the important members
+    are different.
+
+    Both archives are first read as streams, in lockstep, and members
+    which match as they go past are settled then and there.  Only
+    members which differ, or which turn up in a different order, are
+    compared individually.  Those comparisons need random access.
+
+    .. note:: compressed archives are only taken on when streaming and
+       only settled by streaming.  If anything is left unsettled, the
+       comparison is left to the decoders, (GzipComparator, etc), in
+       order to duck the Python tarfile module's pathological
+       performace with random access to compressed archives.  So this
+       must be called *before* them.
+
+    .. note:: This is a strategy - there are no instance
+       properties. Rather, the content is stored in the comparison
+       pairs.
+    """
+
+    _packer = _Packer('{tar}')
+
+    # : Walk both archives in lockstep before comparing members
+    # : individually.  This is also what allows compressed archives
+    # : to be compared in a single pass.
+    stream = True
+
+    @classmethod
+    def _applies(cls, item):
+        """
+        Look at the first header only.  For gzip compressed archives,
+        only enough to decompress that header is read.  bzip2 can't
+        decompress anything short of a whole block so those are left
+        to tarfile.
+        """
+        if _tar_header(item.peek(tarfile.BLOCKSIZE)):
+            return True
+
+        if not cls.stream:
+            return False
+
+        if item.peek(2) == b'\x1f\x8b':
+            return _tar_header(cls._gunzip_peek(item))
+
+        if item.peek(3) == b'BZh':
+            try:
+                with _content_buffer(item) as buf:
+                    tarfile.open(fileobj=_as_file(buf), mode='r:bz2').close()
+
+            except:
+                return False
+
+            return True
+
+        return False
+
+    @staticmethod
+    def _gunzip_peek(item):
+        """
+        Decompress the first block of a gzip compressed item, reading
+        as little as we can.
+        """
+        size = _peek_size
+        while True:
+            content = item.peek(size)
+            try:
+                block = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(content, tarfile.BLOCKSIZE)
+
+            except zlib.error:
+                return b''
+
+            if len(block) >= tarfile.BLOCKSIZE or len(content) < size or size >= _chunk_size:
+                return block
+
+            size *= 4
+
+    @staticmethod
+    def getmember(item):
+        if not hasattr(item, 'member'):
+            item.member = item.parent.tar.index[item.shortname]
+
+        return item.member
+
+    @classmethod
+    def box_keys(cls, item):
+        if not hasattr(item, 'names'):
+            item.names = item.tar.getnames()
+
+        return item.names
+
+    @staticmethod
+    def member_size(member):
+        return member.parent.box.getmember(member).size
+
+    @staticmethod
+    def member_content(member):
+        info = member.parent.box.getmember(member)
+        assert info
+
+        if info.isdir() or info.isdev():
+            return ''
+
+        if hasattr(member.parent, 'prefetch'):
+            content = member.parent.prefetch.get((member.parent, member.shortname))
+            if content is not None:
+                return content
+
+        # the cached info may be from an earlier opening of this
+        # archive, and hard links are resolved by identity.
+        fileobj = member.parent.tar.extractfile(member.parent.tar.index[member.shortname])
+        if not fileobj:
+            TarComparator.logger.log(logging.ERROR, 'member_content could not find %s, (%s), in %s', member.shortname,
+                                                                                                           member.name,
+                                                                                                           member.parent.name)
+            raise NotImplementedError
+        return fileobj.read()
+
+    @staticmethod
+    def member_isreg(member):
+        return member.parent.box.getmember(member).isreg()
+
+    @staticmethod
+    def member_islnk(member):
+        return member.parent.box.getmember(member).issym()
+
+    @staticmethod
+    def member_link(member):
+        return member.parent.box.getmember(member).linkname
+
+    @staticmethod
+    def _header_same(left, right, ignore_ownerships):
+        return (left.mode == right.mode
+                and left.type == right.type
+                and left.linkname == right.linkname
+                and left.size == right.size
+                and (ignore_ownerships
+                     or (left.uid == right.uid
+                         and left.gid == right.gid
+                         and left.uname == right.uname
+                         and left.gname == right.gname)))
+
+    @staticmethod
+    def _body_same(ltar, linfo, rtar, rinfo):
+        if not linfo.isreg():
+            return True
+
+        return _files_equal(ltar.extractfile(linfo), rtar.extractfile(rinfo))
+
+    @classmethod
+    def _stream(cls, comparison):
+        """
+        Walk both archives in lockstep comparing each pair of members
+        with the same name as they stream past.
+
+        :returns: (settled, unsettled, compressed) where settled is the
+            set of member names found the same, unsettled is the set
+            which will need to be compared individually, and compressed
+            is true if either archive is compressed, in which case the
+            walk stops at the first unsettled member.
+
+        A compressed archive which could be indexed, (see
+        :py:class:`_TarIndex`), but hasn't been is indexed on the way,
+        walking it to the end if the comparison stops short.
+        """
+        (settled, unsettled) = (set(), set())
+        (left, right) = comparison.pair
+
+        with contextlib.nested(_content_buffer(left), _content_buffer(right)) as (lbuf, rbuf):
+            with contextlib.nested(cls._streamed(left, lbuf), cls._streamed(right, rbuf)) as streams:
+                ((ltar, liter), (rtar, riter)) = [stream[0:2] for stream in streams]
+                compressed = any(stream[3] for stream in streams)
+
+                # a stream can't be asked for its next member once it's ended.
+                seen = ([], [])
+                while True:
+                    (linfo, rinfo) = (next(liter, None), next(riter, None))
+                    if linfo is None and rinfo is None:
+                        break
+
+                    for (side, info) in enumerate([linfo, rinfo]):
+                        if info is not None:
+                            seen[side].append(info)
+
+                    if linfo is not None and rinfo is not None and linfo.name == rinfo.name:
+                        if (comparison.ignoring(cls._packer.join(left.name, linfo.name))
+                            or (cls._header_same(linfo, rinfo, comparison.ignore_ownerships)
+                                and cls._body_same(ltar, linfo, rtar, rinfo))):
+                            settled.add(linfo.name)
+                        else:
+                            unsettled.add(linfo.name)
+
+                    else:
+                        unsettled.update(info.name for info in [linfo, rinfo] if info is not None)
+
+                    if unsettled and compressed:
+                        break
+
+                for (item, stream, members) in zip(comparison.pair, streams, seen):
+                    (rest, reader) = stream[1:3]
+                    if reader:
+                        members.extend(rest)
+                        _TarIndex(reader.comptype, reader.regions, members).save(item)
+
+        # a name seen more than once is only settled if it always matched.
+        return (settled - unsettled, unsettled, compressed)
+
+    @staticmethod
+    def _comptype(item):
+        for (comptype, magic) in [('gz', b'\x1f\x8b'), ('bz2', b'BZh')]:
+            if item.peek(len(magic)) == magic:
+                return comptype
+
+        return None
+
+    @classmethod
+    @contextlib.contextmanager
+    def _streamed(cls, item, buf):
+        """
+        Open *item*, with content *buf*, as a stream.
+
+        :returns: (tar, members, reader, compressed) where members
+            iterates over the members of tar, charging any decoding to
+            the item's budget, reader is a :py:class:`_RegionReader` if
+            the archive is to be indexed on the way, (see
+            :py:class:`_TarIndex`), or None, and compressed is true if
+            the archive is compressed.
+        """
+        comptype = cls._comptype(item)
+        reader = None
+        if comptype and _TarIndex.kept(item) and not _TarIndex.cached(item):
+            reader = _RegionReader(comptype, buf)
+
+        with (opentar(item.name, 'r|', reader) if reader else opentar(item.name, 'r|*', _as_file(buf))) as tar:
+            compressed = bool(reader) or tar.fileobj.comptype != 'tar'
+            members = _charged(getattr(item, 'budget', None) if compressed else None, tar, len(buf), _tar_size)
+            yield (tar, iter(members), reader, compressed)
+
+    @classmethod
+    def _read_indexed(cls, key):
+        (item, name) = key
+        return item.tar.read(item.tar.index[name], getattr(item, 'budget', None))
+
+    @classmethod
+    def _indexed_cmp(cls, comparison, settled):
+        """
+        Compare the unsettled members of compressed archives through
+        their indexes, (see :py:class:`_TarIndex`), decoding the
+        members' regions on a thread pool.  If either archive has no
+        index, or only one region, leave it to the decoders.
+        """
+        with contextlib.nested(_content_buffer(comparison.pair[0]),
+                               _content_buffer(comparison.pair[1])) as bufs:
+            indexes = [_TarIndex.get(item, cls._comptype(item), buf) for item, buf in zip(comparison.pair, bufs)]
+
+            if not all(index and len(index.regions) > 1 for index in indexes):
+                cls._log_indeterminate(comparison)
+                return False
+
+            (comparison.pair[0].tar, comparison.pair[1].tar) = indexes
+
+            keys = [(item, name)
+                    for name in indexes[0].getnames() if name not in settled and name in indexes[1].index
+                    for item in comparison.pair]
+
+            with _threadpool() as pool:
+                prefetch = _Prefetcher(pool, cls._read_indexed, keys, 2 * _pool_size())
+                for p in comparison.pair:
+                    (p.prefetch, p.settled) = (prefetch, settled)
+
+                try:
+                    return super(cls, cls).cmp(comparison)
+
+                finally:
+                    for p in set(comparison.pair):
+                        del p.prefetch
+                        del p.settled
+
+    @classmethod
+    def cmp(cls, comparison):
+        settled = frozenset()
+
+        if cls.stream:
+            (settled, unsettled, compressed) = cls._stream(comparison)
+
+            if not unsettled:
+                cls._log_same(comparison)
+                return Same
+
+            if compressed:
+                return cls._indexed_cmp(comparison, settled)
+
+            cls.logger.log(logging.DEBUG, '%s streamed %s settling %d, leaving %d', cls.__name__,
+                           comparison.pair[0].name, len(settled), len(unsettled))
+
+        with contextlib.nested(_content_buffer(comparison.pair[0]),
+                               _content_buffer(comparison.pair[1])) as (lbuf, rbuf):
+            with contextlib.nested(opentar(comparison.pair[0].name, 'r', _as_file(lbuf)),
+                                   opentar(comparison.pair[1].name, 'r', _as_file(rbuf))) as (comparison.pair[0].tar,
+                                                                                              comparison.pair[1].tar):
+                for p in comparison.pair:
+                    p.settled = settled
+
+                try:
+                    return super(cls, cls).cmp(comparison)
+
+                finally:
+                    for p in set(comparison.pair):
+                        del p.settled
+
+
+# ZipFile didn't become a context manager until 2.7.  :\.
+import contextlib
+@contextlib.contextmanager
+def openzip(file, mode):
+    """
+    .. todo:: remove openzip once we move to python-2.7
+
+    .. note:: members are not checked here.  Their crcs are checked
+       as they are read.  See :py:attr:`ZipComparator.verify`.
+    """
+    zip = zipfile.ZipFile(file, mode)
+    yield zip
+    zip.close()
+
+# : local file header, (signature, versions, flags, method, times,
+# : crc, sizes, name length, extra length).
+_zip_local_header = struct.Struct(b'<4s2B4HL2L2H')
+
+@_loggable
+class ZipComparator(ContentOnlyBox):
+    """
+    Zip archive files are different if any of the members are different.
+
+    .. note:: This is a strategy - there are no instance
+       properties. Rather, the content is stored in the comparison
+       pairs.
+    """
+
+    _myname = 'zip'
+
+    _packer = _Packer('{{}}'.format(_myname))
+
+    # : Check each member's crc as it is decompressed.  Set this False
+    # : to skip verification entirely for trusted inputs.
+    verify = True
+
+    @staticmethod
+    def _applies(item):
+        """
+        """
+        try:
+            with _content_buffer(item) as buf:
+                zipfile.ZipFile(_as_file(buf), 'r').close()
+
+        except:
+            return False
+
+        return True
+
+    @classmethod
+    def box_keys(cls, item):
+        return item.zip.namelist()
+
+    @staticmethod
+    def member_size(member):
+        return member.parent.zip.getinfo(member.shortname).file_size
+
+    @classmethod
+    def member_content(cls, member):
+        """
+        Inflate the member's stored data a chunk at a time, checking
+        the crc along the way unless :py:attr:`verify` is False.
+        """
+        if hasattr(member.parent, 'prefetch'):
+            content = member.parent.prefetch.get((member.parent, member.shortname))
+            if content is not None:
+                return content
+
+        info = member.parent.zip.getinfo(member.shortname)
+
+        if not cls._inflatable(info):
+            return _decoded(member, _pieces(member.parent.zip.open(member.shortname)), info.compress_size)
+
+        return cls._inflate((member.parent, member.shortname))
+
+    @staticmethod
+    def _inflatable(info):
+        """
+        Return True if we can inflate the member described by *info*
+        ourselves.  Members which are encrypted, or compressed with
+        something other than deflate, are left to zipfile.
+        """
+        return not info.flag_bits & 0x1 and info.compress_type in [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED]
+
+    @classmethod
+    def _inflate(cls, key):
+        """
+        Inflate member *name* of zip archive *item*.  Reads only the
+        stored data from the archive content so this can run on any
+        thread.
+        """
+        (item, name) = key
+        info = item.zip.getinfo(name)
+        raw = cls._stored(item, name)
+        decoder = zlib.decompressobj(-zlib.MAX_WBITS) if info.compress_type == zipfile.ZIP_DEFLATED else None
+        budget = getattr(item, 'budget', None)
+        chunks = []
+        (crc, size) = (0, 0)
+
+        for offset in range(0, len(raw), _chunk_size):
+            chunk = raw[offset:offset + _chunk_size]
+            while chunk:
+                if decoder:
+                    # bound the output of each step, (zip bombs).
+                    (piece, chunk) = (decoder.decompress(chunk, _chunk_size), decoder.unconsumed_tail)
+                else:
+                    (piece, chunk) = (chunk, b'')
+
+                size += len(piece)
+                if budget:
+                    budget.check(size, len(raw))
+
+                if cls.verify:
+                    crc = binascii.crc32(piece, crc)
+
+                chunks.append(piece)
+
+        if decoder:
+            chunk = decoder.flush()
+            if cls.verify:
+                crc = binascii.crc32(chunk, crc)
+
+            chunks.append(chunk)
+
+        if cls.verify and crc & 0xffffffff != info.CRC:
+            cls.logger.log(logging.ERROR, 'Bad crc-32 for %s', cls._packer.join(item.name, name))
+            raise BadZipfile
+
+        if budget:
+            budget.spend(size)
+
+        return b''.join(chunks)
+
+    @staticmethod
+    def member_raw(member):
+        """
+        Return the member's data as it is stored in the archive, that
+        is, still compressed.
+        """
+        return ZipComparator._stored(member.parent, member.shortname)
+
+    @staticmethod
+    def _stored(item, name):
+        info = item.zip.getinfo(name)
+        content = item.zipbuf
+
+        header = content[info.header_offset:info.header_offset + _zip_local_header.size]
+        if len(header) != _zip_local_header.size or header[0:4] != zipfile.stringFileHeader:
+            raise BadZipfile
+
+        fields = _zip_local_header.unpack(header)
+        start = info.header_offset + _zip_local_header.size + fields[10] + fields[11]
+        return content[start:start + info.compress_size]
+
+    @classmethod
+    def _prefetch_keys(cls, comparison):
+        """
+        List the mated members which will need inflating, in the order
+        in which they'll be compared.  Members which
+        :py:class:`ZipCRCComparator` can settle are left out.
+        """
+        (left, right) = comparison.pair
+        rnames = set(right.zip.namelist())
+        keys = []
+
+        for name in left.zip.namelist():
+            if name not in rnames or comparison.ignoring(cls._packer.join(left.name, name)):
+                continue
+
+            infos = [p.zip.getinfo(name) for p in comparison.pair]
+            if not (cls._inflatable(infos[0]) and cls._inflatable(infos[1])):
+                continue
+
+            if (ZipCRCComparator in comparison.comparators
+                and infos[0].CRC == infos[1].CRC
+                and infos[0].file_size == infos[1].file_size
+                and infos[0].compress_size == infos[1].compress_size
+                and cls._stored(left, name) == cls._stored(right, name)):
+                continue
+
+            keys.append((left, name))
+            if right is not left:
+                keys.append((right, name))
+
+        return keys
+
+    @classmethod
+    def cmp(cls, comparison):
+        with contextlib.nested(_content_buffer(comparison.pair[0]),
+                               _content_buffer(comparison.pair[1])) as (lbuf, rbuf):
+            with contextlib.nested(openzip(_as_file(lbuf), 'r'),
+                                   openzip(_as_file(rbuf), 'r')) as (comparison.pair[0].zip,
+                                                                     comparison.pair[1].zip):
+
+                (comparison.pair[0].zipbuf, comparison.pair[1].zipbuf) = (lbuf, rbuf)
+
+                if comparison.pair[0].zip.comment != comparison.pair[1].zip.comment:
+                    cls._log_different(comparison)
+                    return Different
+
+                # Members are inflated on a thread pool ahead of their
+                # comparisons.  zlib releases the gil while inflating.
+                with _threadpool() as pool:
+                    prefetch = _Prefetcher(pool, cls._inflate, cls._prefetch_keys(comparison), 2 * _pool_size())
+                    for p in comparison.pair:
+                        p.prefetch = prefetch
+
+                    try:
+                        return super(cls, cls).cmp(comparison)
+
+                    finally:
+                        for p in set(comparison.pair):
+                            del p.prefetch
+                            del p.zipbuf
+
+@_loggable
+class DirArchiveComparator(Comparator):
+    """
+    A directory and a tar or zip archive are compared member by
+    member, as though the archive had been extracted into the
+    directory, but without extracting it.  Member names are taken
+    relative to the directory, (as with "tar -C").
+
+    The archive is read once, as a stream, and each member is checked
+    against the file system as it goes past.  Members whose contents
+    differ, or which can't be settled from the stream, (hard links),
+    are then compared individually, with the full list of comparators,
+    reading the archive at random.
+
+    .. note:: like :py:class:`DirComparator`, modes, ownerships and
+       times aren't compared, only types, link targets and contents.
+
+    .. note:: This is a strategy - there are no instance
+       properties.
+    """
+
+    @classmethod
+    def _archive_box(cls, item):
+        if not item.isreg:
+            return None
+
+        for box in [TarComparator, ZipComparator]:
+            if box._applies(item):
+                return box
+
+        return None
+
+    @classmethod
+    def applies(cls, comparison):
+        isdirs = [p.isdir for p in comparison.pair]
+        if isdirs[0] == isdirs[1]:
+            return False
+
+        archive = comparison.pair[isdirs.index(False)]
+        archive.archivebox = cls._archive_box(archive)
+        return archive.archivebox is not None
+
+    @staticmethod
+    def _relname(name):
+        """
+        Member *name* as a path relative to the top of the archive, or
+        '' for the top itself.
+        """
+        name = posixpath.normpath('/' + name).lstrip('/')
+        return '' if name == '.' else name
+
+    @staticmethod
+    def _ancestors(rel):
+        while '/' in rel:
+            rel = rel.rpartition('/')[0]
+            yield rel
+
+    @classmethod
+    def _ignored(cls, comparison, directory, archive, rel, origname):
+        for path in [rel] + list(cls._ancestors(rel)):
+            ignore = (comparison.ignoring(os.path.join(directory.name, path))
+                      or comparison.ignoring(archive.archivebox._packer.join(archive.name, path)))
+            if ignore:
+                return ignore
+
+        return comparison.ignoring(archive.archivebox._packer.join(archive.name, origname))
+
+    @classmethod
+    def _walk(cls, comparison, directory):
+        """
+        Relative names of everything beneath *directory* which isn't
+        ignored.
+        """
+        names = set()
+        for (dirpath, dirnames, filenames) in os.walk(directory.name):
+            for name in list(dirnames):
+                path = os.path.join(dirpath, name)
+                if comparison.ignoring(path):
+                    dirnames.remove(name)
+                else:
+                    names.add(os.path.relpath(path, directory.name))
+
+            names.update(os.path.relpath(os.path.join(dirpath, name), directory.name)
+                         for name in filenames if not comparison.ignoring(os.path.join(dirpath, name)))
+
+        return names
+
+    _tar_kinds = [(tarfile.TarInfo.isreg, stat.S_IFREG),
+                  (tarfile.TarInfo.isdir, stat.S_IFDIR),
+                  (tarfile.TarInfo.issym, stat.S_IFLNK),
+                  (tarfile.TarInfo.islnk, None),
+                  (tarfile.TarInfo.ischr, stat.S_IFCHR),
+                  (tarfile.TarInfo.isblk, stat.S_IFBLK),
+                  (tarfile.TarInfo.isfifo, stat.S_IFIFO)]
+
+    @classmethod
+    def _tar_member(cls, tar, info):
+        """
+        Return (name, kind, link, size, rdev, fileobj) for member *info*
+        of streamed tar archive *tar*, or None for members we don't
+        know how to check.  kind is an :py:mod:`stat` file type, or
+        None for a hard link.
+        """
+        kind = next((kind for (test, kind) in cls._tar_kinds if test(info)), False)
+        if kind is False:
+            return None
+
+        return (info.name,
+                kind,
+                info.linkname,
+                info.size,
+                (info.devmajor, info.devminor),
+                tar.extractfile(info) if kind == stat.S_IFREG else None)
+
+    @classmethod
+    def _tar_members(cls, tar, budget=None, encoded=None):
+        if tar.fileobj.comptype == 'tar':
+            budget = None  # nothing is decoded.
+
+        for info in _charged(budget, tar, encoded, _tar_size):
+            member = cls._tar_member(tar, info)
+            if member:
+                yield member
+
+    @staticmethod
+    def _zip_members(zip):
+        for info in zip.infolist():
+            # unix zips keep the file type in the high bits.
+            kind = stat.S_IFMT(info.external_attr >> 16) if info.create_system == 3 else 0
+            if not kind:
+                kind = stat.S_IFDIR if info.filename.endswith('/') else stat.S_IFREG
+
+            link = zip.read(info) if kind == stat.S_IFLNK else ''
+            yield (info.filename,
+                   kind,
+                   link,
+                   info.file_size,
+                   None,
+                   zip.open(info) if kind == stat.S_IFREG else None)
+
+    @classmethod
+    def _member_same(cls, directory, rel, member, settled):
+        """
+        Check one archive member against its file system counterpart,
+        *rel* beneath *directory*.
+
+        :returns: :py:class:`Same`, :py:class:`Different` or False if
+            the member can't be settled from the stream.
+        """
+        (name, kind, link, size, rdev, fileobj) = member
+        path = os.path.join(directory.name, rel)
+
+        try:
+            statbuf = os.lstat(path)
+
+        except OSError:
+            return Different
+
+        if kind is None:
+            # a hard link is the same if it's linked on disk too, to a
+            # target which matched.
+            target = cls._relname(link)
+            if target in settled and os.path.samefile(path, os.path.join(directory.name, target)):
+                return Same
+
+            return False
+
+        if stat.S_IFMT(statbuf.st_mode) != kind:
+            return Different
+
+        if kind == stat.S_IFLNK:
+            return Same if os.readlink(path) == link else Different
+
+        if kind in [stat.S_IFCHR, stat.S_IFBLK]:
+            return Same if (os.major(statbuf.st_rdev), os.minor(statbuf.st_rdev)) == rdev else Different
+
+        if kind != stat.S_IFREG:
+            return Same
+
+        if statbuf.st_size != size:
+            return False
+
+        with open(path, 'rb') as fd:
+            return Same if _files_equal(fd, fileobj) else False
+
+    @classmethod
+    def _stream(cls, comparison, directory, archive, members, keep=None):
+        """
+        Walk the archive once, checking each of its *members*, (as
+        yielded by :py:meth:`_tar_members`), as it goes past.  If
+        given, *keep* is called with each member left unsettled.
+
+        :returns: a dict mapping the relative name of each member which
+            isn't ignored to a tuple of its name in the archive and its
+            result.
+        """
+        results = {}
+        settled = set()
+
+        for member in members:
+            rel = cls._relname(member[0])
+            if not rel:
+                continue
+
+            ignore = cls._ignored(comparison, directory, archive, rel, member[0])
+            if ignore:
+                cls.logger.log(SAMES, 'Ignoring %s cause %s',
+                               archive.archivebox._packer.join(archive.name, member[0]), ignore)
+                continue
+
+            result = cls._member_same(directory, rel, member, settled)
+            results[rel] = (member[0], result)
+            if result is Same:
+                settled.add(rel)
+            else:
+                settled.discard(rel)
+
+            if result is False and keep:
+                keep(member)
+
+            if result is Different and comparison.exit_asap:
+                break
+
+        return results
+
+    @classmethod
+    def _report(cls, comparison, directory, archive, results):
+        """
+        Log the members found different in the stream and anything on
+        disk the archive doesn't account for.  The directories leading
+        to members are implied.
+        """
+        retval = Same
+
+        for rel in sorted(results):
+            (origname, result) = results[rel]
+            if result is Different:
+                cls.logger.log(DIFFERENCES, 'Different %s %s, %s', cls.__name__,
+                               os.path.join(directory.name, rel),
+                               archive.archivebox._packer.join(archive.name, origname))
+                retval = Different
+
+        present = set(results)
+        for rel in list(results):
+            present.update(cls._ancestors(rel))
+
+        for rel in sorted(cls._walk(comparison, directory) - present):
+            cls.logger.log(DIFFERENCES, 'Different %s No mate: %s', cls.__name__,
+                           os.path.join(directory.name, rel))
+            retval = Different
+
+        return retval
+
+    @classmethod
+    def _mated_cmp(cls, comparison, directory, archive, box, unsettled):
+        """
+        Compare each of the *unsettled* members with its file system
+        counterpart using the full list of comparators.
+        """
+        retval = Same
+
+        for (rel, origname) in unsettled:
+            ditem = Items.find_or_create(os.path.join(directory.name, rel), directory, DirComparator)
+            aitem = Items.find_or_create(box._packer.join(archive.name, origname), archive, box)
+            pair = (ditem, aitem) if directory is comparison.pair[0] else (aitem, ditem)
+
+            r = Comparison(litem=pair[0],
+                           ritem=pair[1],
+                           comparators=comparison.comparators,
+                           ignores=comparison.ignores,
+                           exit_asap=comparison.exit_asap,
+                           ignore_ownerships=comparison.ignore_ownerships,
+                           budget=comparison.budget).cmp()
+
+            if not r:
+                cls._log_indeterminate(comparison)
+                raise IndeterminateResult
+
+            if r == Different:
+                retval = Different
+                if comparison.exit_asap:
+                    break
+
+        return retval
+
+    @classmethod
+    def _members_cmp(cls, comparison, directory, archive, buf, unsettled):
+        """
+        Compare the *unsettled* members individually, opening the
+        archive for random access.
+        """
+        box = archive.archivebox
+
+        if box is TarComparator:
+            opener = opentar(archive.name, 'r', _as_file(buf))
+        else:
+            opener = openzip(_as_file(buf), 'r')
+
+        with opener as handle:
+            if box is TarComparator:
+                archive.tar = handle
+            else:
+                (archive.zip, archive.zipbuf) = (handle, buf)
+
+            archive.box = box
+
+            try:
+                return cls._mated_cmp(comparison, directory, archive, box, unsettled)
+
+            finally:
+                if box is TarComparator:
+                    del archive.tar
+                else:
+                    del archive.zip
+                    del archive.zipbuf
+
+    @staticmethod
+    def _unsettled(results):
+        return sorted((rel, origname) for (rel, (origname, result)) in results.items() if result is False)
+
+    @classmethod
+    def cmp(cls, comparison):
+        isdirs = [p.isdir for p in comparison.pair]
+        directory = comparison.pair[isdirs.index(True)]
+        archive = comparison.pair[isdirs.index(False)]
+
+        with _content_buffer(archive) as buf:
+            if archive.archivebox is TarComparator:
+                with opentar(archive.name, 'r|*', _as_file(buf)) as tar:
+                    results = cls._stream(comparison, directory, archive,
+                                          cls._tar_members(tar, getattr(archive, 'budget', None), len(buf)))
+            else:
+                with openzip(_as_file(buf), 'r') as zip:
+                    results = cls._stream(comparison, directory, archive, cls._zip_members(zip))
+
+            retval = cls._report(comparison, directory, archive, results)
+
+            if retval == Different and comparison.exit_asap:
+                cls._log_different(comparison)
+                return retval
+
+            unsettled = cls._unsettled(results)
+            if unsettled and cls._members_cmp(comparison, directory, archive, buf, unsettled) == Different:
+                retval = Different
+
+        if retval == Same:
+            cls._log_same(comparison)
+        else:
+            cls._log_different(comparison)
+
+        return retval
+
+@_loggable
+class TarStreamComparator(TarComparator):
+    """
+    Tar archives arriving on a pipe, (standard input, an inherited file
+    descriptor or a named pipe, see :py:func:`_stream_item`), can only
+    be read once, from front to back.  They're compared in a single
+    pass against a directory, (as :py:class:`DirArchiveComparator`
+    does), or against another tar archive, (in lockstep, as
+    :py:class:`TarComparator` streams).  Either may be compressed.
+
+    Members which meet their mates as they stream past, (as they all
+    do if both archives list their members in the same order), are
+    compared a chunk at a time.  The contents of the rest are spooled
+    to temporary files until their mates turn up, and kept only for
+    members which then need comparing individually.
+
+    .. note:: This is a strategy - there are no instance
+       properties. Rather, the stream is stored in the comparison
+       pairs.
+    """
+
+    @classmethod
+    def applies(cls, comparison):
+        return any(hasattr(p, 'fileobj') for p in comparison.pair)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _open(item):
+        item.members = {}
+        if hasattr(item, 'fileobj'):
+            with opentar(item.name, 'r|*', item.fileobj) as tar:
+                yield tar
+
+        else:
+            with _content_buffer(item) as buf:
+                with opentar(item.name, 'r|*', _as_file(buf)) as tar:
+                    yield tar
+
+    @staticmethod
+    def getmember(item):
+        return item.parent.members[item.shortname][0]
+
+    @classmethod
+    def box_keys(cls, item):
+        return list(item.members)
+
+    @staticmethod
+    def member_exists(member):
+        return member.parent is streams or Box.member_exists(member)
+
+    @staticmethod
+    def member_size(member):
+        return None if member.parent is streams else TarComparator.member_size(member)
+
+    @staticmethod
+    def member_content(member):
+        if member.parent is streams:
+            return member.fileobj.read()
+
+        spool = member.parent.members[member.shortname][1]
+        spool.seek(0)
+        return spool.read()
+
+    @staticmethod
+    def member_isreg(member):
+        return member.parent is not streams and TarComparator.member_isreg(member)
+
+    @staticmethod
+    def member_islnk(member):
+        return member.parent is not streams and TarComparator.member_islnk(member)
+
+    @classmethod
+    def _dir_cmp(cls, comparison, directory, archive):
+        """
+        Check each member against the file system as it streams past,
+        spooling the contents of those which need comparing further.
+        """
+        infos = {}
+
+        def members(tar):
+            for info in _charged(getattr(archive, 'budget', None), tar, size=_tar_size):
+                member = DirArchiveComparator._tar_member(tar, info)
+                if member:
+                    infos[info.name] = info
+                    if member[5]:
+                        member = member[:5] + (_Tee(member[5]),)
+
+                    yield member
+
+        def keep(member):
+            (name, tee) = (member[0], member[5])
+            spool = _spool()
+            if tee:
+                # what was read before the last piece matched the file
+                # system, so it's copied from there.
+                if tee.offset:
+                    with open(os.path.join(directory.name, DirArchiveComparator._relname(name)), 'rb') as fd:
+                        _copy(fd, spool, tee.offset)
+
+                spool.write(tee.last)
+                _spool(tee.fileobj, spool)
+
+            archive.members[name] = (infos[name], spool)
+
+        archive.archivebox = cls
+        with cls._open(archive) as tar:
+            results = DirArchiveComparator._stream(comparison, directory, archive, members(tar), keep)
+
+        infos.clear()
+
+        retval = DirArchiveComparator._report(comparison, directory, archive, results)
+        if retval == Different and comparison.exit_asap:
+            return retval
+
+        unsettled = DirArchiveComparator._unsettled(results)
+        if unsettled and DirArchiveComparator._mated_cmp(comparison, directory, archive, cls, unsettled) == Different:
+            retval = Different
+
+        return retval
+
+    @classmethod
+    def _lockstep(cls, comparison):
+        """
+        Walk both archives in lockstep, pairing members by name.
+
+        :returns: (pending, unsettled) where pending is a pair of dicts
+            of the members on each side which were never mated and
+            unsettled is the list of names of mated members which need
+            comparing individually.
+        """
+        pending = ({}, {})
+        unsettled = []
+
+        with contextlib.nested(cls._open(comparison.pair[0]), cls._open(comparison.pair[1])) as tars:
+            # a stream's compressed size isn't known up front.
+            iters = [iter(_charged(getattr(item, 'budget', None), tar, size=_tar_size))
+                     for (item, tar) in zip(comparison.pair, tars)]
+            while True:
+                infos = [next(i, None) for i in iters]
+                if infos[0] is None and infos[1] is None:
+                    break
+
+                infos = [None if info is None or comparison.ignoring(cls._packer.join(item.name, info.name)) else info
+                         for (item, info) in zip(comparison.pair, infos)]
+
+                if (infos[0] is not None and infos[1] is not None and infos[0].name == infos[1].name
+                    and not any(infos[0].name in names for names in pending)):
+                    mates = cls._mated(comparison, tars, infos)
+                    if mates:
+                        (comparison.pair[0].members[infos[0].name], comparison.pair[1].members[infos[0].name]) = mates
+                        unsettled.append(infos[0].name)
+
+                    continue
+
+                for (side, info) in enumerate(infos):
+                    if info is None:
+                        continue
+
+                    # a stream member can only be read before the next.
+                    spool = _spool(tars[side].extractfile(info) if info.isreg() else None)
+                    pending[side][info.name] = (info, spool)
+
+                    if info.name not in pending[1 - side]:
+                        continue
+
+                    (left, right) = (pending[0].pop(info.name), pending[1].pop(info.name))
+                    if (cls._header_same(left[0], right[0], comparison.ignore_ownerships)
+                        and _files_equal(left[1], right[1])):
+                        left[1].close()
+                        right[1].close()
+
+                    else:
+                        comparison.pair[0].members[info.name] = left
+                        comparison.pair[1].members[info.name] = right
+                        unsettled.append(info.name)
+
+        return (pending, unsettled)
+
+    @classmethod
+    def _mated(cls, comparison, tars, infos):
+        """
+        Compare *infos*, a pair of members with the same name at the
+        same point in both streams *tars*, a chunk at a time.
+
+        :returns: None if they're the same, or else a pair of (info,
+            spool) tuples holding their contents.
+        """
+        (linfo, rinfo) = infos
+        same = cls._header_same(linfo, rinfo, comparison.ignore_ownerships)
+        if not linfo.isreg():
+            # the headers have checked rinfo's type.
+            return None if same else [(info, _spool()) for info in infos]
+
+        # the left side is copied as it's read.  The right side matched
+        # it up to its last piece.
+        ltee = _Tee(tars[0].extractfile(linfo), _spool())
+        rtee = _Tee(tars[1].extractfile(rinfo) if rinfo.isreg() else io.BytesIO())
+        if same and _files_equal(ltee, rtee):
+            ltee.spool.close()
+            return None
+
+        lspool = _spool(ltee.fileobj, ltee.spool)
+        rspool = _spool()
+        _copy(lspool, rspool, rtee.offset)
+        rspool.write(rtee.last)
+        lspool.seek(0)
+
+        return [(linfo, lspool), (rinfo, _spool(rtee.fileobj, rspool))]
+
+    @classmethod
+    def _lockstep_cmp(cls, comparison):
+        for p in comparison.pair:
+            p.box = cls
+
+        (pending, unsettled) = cls._lockstep(comparison)
+
+        retval = Same
+        for (item, names) in zip(comparison.pair, pending):
+            for name in sorted(names):
+                cls._no_mate(cls._packer.join(item.name, name), logger)
+                names[name][1].close()
+                retval = Different
+
+        if retval == Different and comparison.exit_asap:
+            return retval
+
+        for name in unsettled:
+            (litem, ritem) = [Items.find_or_create(cls._packer.join(p.name, name), p, cls) for p in comparison.pair]
+            child = Comparison(litem=litem,
+                               ritem=ritem,
+                               comparators=comparison.comparators,
+                               ignores=comparison.ignores,
+                               exit_asap=comparison.exit_asap,
+                               ignore_ownerships=comparison.ignore_ownerships,
+                               budget=comparison.budget)
+
+            # metadata is checked as it would be for archives on disk.
+            r = TarMemberMetadataComparator.cmp(child) or child.cmp()
+
+            if not r:
+                cls._log_indeterminate(comparison)
+                raise IndeterminateResult
 
-    @staticmethod
-    def member_islnk(member):
-        return stat.S_ISLNK(member.parent.cpio.get_member(member.shortname).mode)
+            if r == Different:
+                retval = Different
+                if comparison.exit_asap:
+                    break
 
-    @staticmethod
-    def member_link(member):
-        return member.content
+        return retval
 
     @classmethod
     def cmp(cls, comparison):
-        with contextlib.nested(opencpio(comparison.pair[0].name, comparison.pair[0].content),
-                               opencpio(comparison.pair[1].name, comparison.pair[0].content)) as (comparison.pair[0].cpio,
-                                                                                                     comparison.pair[1].cpio):
-            return super(cls, cls).cmp(comparison)
+        (left, right) = comparison.pair
+        if left is right:
+            cls._log_same(comparison)
+            return Same
 
+        try:
+            try:
+                if left.isdir or right.isdir:
+                    (directory, archive) = (left, right) if left.isdir else (right, left)
+                    retval = cls._dir_cmp(comparison, directory, archive)
+                else:
+                    retval = cls._lockstep_cmp(comparison)
 
-@_loggable
-class TarMemberMetadataComparator(Comparator):
-    """
-    Verify the metadata of each member of an ar archive.
-    """
-    @staticmethod
-    def _applies(item):
-        return item.parent.box is TarComparator
+            finally:
+                for p in comparison.pair:
+                    if hasattr(p, 'members'):
+                        for (info, spool) in p.members.values():
+                            spool.close()
 
-    @classmethod
-    def cmp(cls, comparison):
-        (left, right) = [i.parent.box.getmember(i) for i in comparison.pair]
+                        del p.members
 
-        if (left.mode == right.mode
-            and left.type == right.type
-            and left.linkname == right.linkname
-            and (comparison.ignore_ownerships
-                 or (left.uid == right.uid
-                     and left.gid == right.gid
-                     and left.uname == right.uname
-                     and left.gname == right.gname))):
+        except tarfile.TarError as err:
+            cls.logger.log(logging.ERROR, '%s could not read a tar stream: %s', cls.__name__, err)
+            retval = Different
 
-            # if the file has no content then we can say conclusively
-            # that they are the same at this point.
-            if left.size == 0:
-                return Same
-            else:
-                return False
+        if retval == Same:
+            cls._log_same(comparison)
         else:
             cls._log_different(comparison)
-            diffmsg = ''
-
-            if left.mode != right.mode:
-                diffmsg += '\n mode = {} {}'.format(left.mode, right.mode)
-
-            if left.type != right.type:
-                diffmsg += '\n type = {} {}'.format(left.type, right.type)
 
-            if left.linkname != right.linkname:
-                diffmsg += '\n linkname = {} {}'.format(left.linkname, right.linkname)
+        return retval
 
-            if left.uid != right.uid:
-                diffmsg += '\n uid = {} {}'.format(left.uid, right.uid)
+def _stream_item(name):
+    """
+    Return an :py:class:`Item` reading from *name* if it names a
+    stream, that is, '-' for standard input, 'fd:N' for inherited file
+    descriptor N, or a named pipe.  Otherwise return None.
+    """
+    if name == '-':
+        fileobj = getattr(sys.stdin, 'buffer', sys.stdin)
 
-            if left.gid != right.gid:
-                diffmsg += '\n gid = {} {}'.format(left.gid, right.gid)
+    elif os.path.exists(name):
+        if not stat.S_ISFIFO(os.stat(name).st_mode):
+            return None
 
-            if left.uname != right.uname:
-                diffmsg += '\nuname = {} {}'.format(left.uname, right.uname)
+        fileobj = open(name, 'rb')
 
-            if left.gname != right.gname:
-                diffmsg += '\ngname = {} {}'.format(left.gname, right.gname)
+    elif re.match(r'fd:\d+$', name):
+        fileobj = os.fdopen(int(name[3:]), 'rb')
 
-            diffmsg += '\n\n'
-            cls.logger.log(DIFFERENCES, diffmsg)
-            return Different
+    else:
+        return None
 
+    item = Items.find_or_create(name, streams, TarStreamComparator)
+    item.fileobj = fileobj
+    return item
 
-# TarFile didn't become a context manager until 2.7.  :\.
-import contextlib
-@contextlib.contextmanager
-def opentar(filename, mode, fileobj):
-    """
-    .. todo:: remove opentar once we move to python-2.7
+class NormalizeRule(object):
     """
-    tar = tarfile.open(name=filename, mode=mode, fileobj=fileobj)
-    yield tar
-    tar.close()
-
-@_loggable
-class TarComparator(UnixBox):
+    A declarative recipe for comparing one kind of generated file which
+    carries some nondeterminism.  Files are the same if they are the
+    same once normalized.
+
+    The *substitutions* are applied line by line, (that is, compiled
+    :py:data:`re.MULTILINE`), and together rather than in turn: each
+    searches the content for its own matches, and the leftmost match of
+    any of them is replaced first and, where more than one could match
+    at the same place, the first listed wins.  Each is compiled on its
+    own, so its group numbers and inline flags are its own.  Dates are
+    blotted afterwards, from what the substitutions leave.
+
+    :param glob: fnmatch style pattern which the file name must match
+    :type glob: string
+    :param trigger: phrase which must appear within the first *lines*
+        lines, (or None)
+    :type trigger: string
+    :param substitutions: regular expressions and their replacements
+    :type substitutions: list of (string, string) pairs
+    :param lines: number of lines at the head of the file in which to
+        look for *trigger*
+    :type lines: int
+    :param dates: also blot out dates, as :py:func:`date_blot_bytes` does
+    :type dates: boolean
+    :param conclusive: files which differ even once normalized are
+        :py:class:`Different`, rather than indeterminate
+    :type conclusive: boolean
     """
-    Tar archive files are different if any of the important members
-    are different.
-
-    .. note:: must be called *after* GzipComparator in order to duck
-       the Python tarfile module's pathological performace with compressed
-       archives.
+    def __init__(self, glob, trigger=None, substitutions=[], lines=8, dates=False, conclusive=True):
+        self.glob = glob
+        self.trigger = None if trigger is None else trigger.encode('utf-8')
+        self.lines = lines
+        self.dates = dates
+        self.conclusive = conclusive
 
-    .. note:: This is a strategy - there are no instance
-       properties. Rather, the content is stored in the comparison
-       pairs.
-    """
+        patterns = [pattern.encode('utf-8') for (pattern, replacement) in substitutions]
+        self.compiled = [re.compile(pattern, re.MULTILINE) for pattern in patterns]
+        self.replacements = [replacement.encode('utf-8') for (pattern, replacement) in substitutions]
 
-    _packer = _Packer('{tar}')
+    def __repr__(self):
+        return '{}({!r}, {!r})'.format(self.__class__.__name__, self.glob, self.trigger)
 
-    @staticmethod
-    def _applies(item):
-        # NOTE: this doesn't catch old style tar archives but if we're
-        # lucky, we won't need to.
+    @property
+    def version(self):
+        """
+        A digest of everything which determines what this rule makes
+        of a file, (including the :py:data:`date_patterns` if it blots
+        dates).
+        """
+        digest = hashlib.sha1()
+        for part in ([pattern.pattern for pattern in self.compiled] + self.replacements
+                     + [pat.pattern.encode('utf-8') for pat in date_patterns if self.dates]):
+            digest.update(repr(part).encode('utf-8'))
 
-        try:
-            tarfile.open(fileobj=io.BytesIO(item.content)).close()
+        return digest.hexdigest()
 
-        except:
+    def applies(self, item):
+        """
+        Return True if and only if this rule applies to *item*.
+        """
+        if not item.isreg or not fnmatch.fnmatchcase(item.name, self.glob):
             return False
 
-        return True
+        if self.trigger is None:
+            return True
 
-        #return (item.content.find('ustar', 257, 264) > -1)
-                
-    @staticmethod
-    def getmember(item):
-        if not hasattr(item, 'member'):
-            item.member = item.parent.tar.getmember(item.shortname)
+        head = item.peek(_peek_size)
+        p = -1
+        for i in range(self.lines):
+            p = head.find(b'\n', p + 1)
+            if p == -1:
+                p = len(head)
+                break
 
-        return item.member
+        return head.find(self.trigger, 0, p) > -1
 
-    @classmethod
-    def box_keys(cls, item):
-        if not hasattr(item, 'names'):
-            item.names = item.tar.getnames()
+    def _substituted(self, buf, start, end):
+        """
+        Yield the pieces of *buf*, from *start* to *end*, with the
+        substitutions made.  The next match of each substitution is
+        kept, and only searched for again once it's been passed.
+        """
+        (position, after) = (start, start)
+        matches = [compiled.search(buf, start, end) for compiled in self.compiled]
 
-        return item.names
+        while True:
+            for (index, match) in enumerate(matches):
+                if match and match.start() < after:
+                    matches[index] = self.compiled[index].search(buf, after, end) if after <= end else None
 
-    @staticmethod
-    def member_size(member):
-        return member.parent.box.getmember(member).size
+            found = [(match.start(), index) for (index, match) in enumerate(matches) if match]
+            if not found:
+                break
 
-    @staticmethod
-    def member_content(member):
-        info = member.parent.box.getmember(member)
-        assert info
+            # leftmost, and the first listed of those.
+            (at, index) = min(found)
+            match = matches[index]
+            yield buf[position:at]
+            yield match.expand(self.replacements[index])
 
-        if info.isdir() or info.isdev():
-            return ''
+            position = match.end()
+            # as re.sub does, an empty match is followed by a character.
+            after = position + 1 if match.end() == match.start() else position
 
-        fileobj = member.parent.tar.extractfile(member.shortname)
-        if not fileobj:
-            TarComparator.logger.log(logging.ERROR, 'member_content could not find %s, (%s), in %s', member.shortname,
-                                                                                                           member.name,
-                                                                                                           member.parent.name)
-            raise NotImplementedError
-        return fileobj.read()
+        yield buf[position:end]
 
-    @staticmethod
-    def member_isreg(member):
-        return member.parent.box.getmember(member).isreg()
+    def _normalized(self, buf, start, end):
+        if not self.compiled:
+            content = buf[start:end]
 
-    @staticmethod
-    def member_islnk(member):
-        return member.parent.box.getmember(member).issym()
+        else:
+            content = b''.join(self._substituted(buf, start, end))
 
-    @staticmethod
-    def member_link(member):
-        return member.parent.box.getmember(member).linkname
+        if self.dates:
+            content = date_blot_bytes(content)
 
-    @classmethod
-    def cmp(cls, comparison):
-        with contextlib.nested(opentar(comparison.pair[0].name, 'r',
-                                       io.BytesIO(comparison.pair[0].content)),
-                               opentar(comparison.pair[1].name,
-                                       'r',
-                                       io.BytesIO(comparison.pair[1].content))) as (comparison.pair[0].tar,
-                                                                                    comparison.pair[1].tar):
-            return super(cls, cls).cmp(comparison)
+        return content
 
+    def normalize(self, content):
+        """
+        Return *content*, (bytes), normalized.
+        """
+        return self._normalized(content, 0, len(content))
 
-# ZipFile didn't become a context manager until 2.7.  :\.
-import contextlib
-@contextlib.contextmanager
-def openzip(file, mode):
-    """
-    .. todo:: remove openzip once we move to python-2.7
+    def blocks(self, buf):
+        """
+        Yield *buf*, (bytes or an mmap), normalized a block of lines at
+        a time, so that it can be compared without normalizing all of
+        it.  A substitution which spans lines sees only those of its
+        own block.
+        """
+        for (start, end) in _line_blocks(buf):
+            yield self._normalized(buf, start, end)
+
+def load_rules(fileobj):
     """
-    zip = zipfile.ZipFile(file, mode)
+    Read a list of :py:class:`NormalizeRule` from the json file
+    object *fileobj*.  The file holds a list of objects whose members
+    are the rule's parameters, eg::
 
-    if zip.testzip():
-        raise BadZipfile
+        [{"glob": "*Makefile",
+          "trigger": "generated by automake",
+          "substitutions": [["^BUILDINFO = .*$", "BUILDINFO = ..."]],
+          "dates": true}]
 
-    yield zip
-    zip.close()
+    :rtype: list of :py:class:`NormalizeRule`
+    """
+    return [NormalizeRule(**rule) for rule in json.load(fileobj)]
 
-@_loggable
-class ZipComparator(ContentOnlyBox):
+def _digesting(blocks, digest):
     """
-    Zip archive files are different if any of the members are different.
+    Yield *blocks*, updating *digest* with each as it goes.
+    """
+    for block in blocks:
+        digest.update(block)
+        yield block
 
-    .. note:: This is a strategy - there are no instance
-       properties. Rather, the content is stored in the comparison
-       pairs.
+class _NormalizedDigests(object):
+    """
+    Digests of normalized content, kept in :py:data:`cache_dir` from
+    one run to the next, so that a file compared again and again, (say
+    in a baseline tree compared with one build after another), needn't
+    be normalized each time.  Each is keyed on the identity, (path,
+    inode, size and mtime), of the file and the version of the
+    :py:class:`NormalizeRule`, and is only trusted while the file's
+    content still has the digest recorded with it.
     """
 
-    _myname = 'zip'
+    version = 1
 
-    _packer = _Packer('{{}}'.format(_myname))
+    @classmethod
+    def _cache_name(cls, item, rule):
+        return _cache_name('normalized', item.name, cls.version, rule.version)
 
     @staticmethod
-    def _applies(item):
-        """
-        """
-        try:
-            zipfile.ZipFile(io.BytesIO(item.content), 'r').close()
+    def _content_digest(buf):
+        digest = hashlib.sha1()
+        for offset in range(0, len(buf), _chunk_size):
+            digest.update(buf[offset:offset + _chunk_size])
 
-        except:
-            return False
+        return digest.hexdigest()
 
-        return True
+    @staticmethod
+    def _cached(item):
+        return cache_dir and item.parent.box is DirComparator
 
     @classmethod
-    def box_keys(cls, item):
-        return item.zip.namelist()
+    def get(cls, item, rule, buf):
+        """
+        The digest of the content, *buf*, of *item* once normalized by
+        *rule*, or None if it isn't known.
+        """
+        if not cls._cached(item):
+            return None
 
-    @staticmethod
-    def member_size(member):
-        return member.parent.zip.getinfo(member.shortname).file_size
+        try:
+            with open(cls._cache_name(item, rule), 'r') as fd:
+                entry = json.load(fd)
 
-    @staticmethod
-    def member_content(member):
-        return member.parent.zip.read(member.shortname)
+            if entry['content'] == cls._content_digest(buf):
+                return entry['normalized']
+
+        except (IOError, ValueError, KeyError, TypeError) as err:
+            RuleComparator.logger.log(logging.DEBUG, 'no normalized digest of %s: %s', item.name, err)
+
+        return None
 
     @classmethod
-    def cmp(cls, comparison):
-        with contextlib.nested(openzip(io.BytesIO(comparison.pair[0].content), 'r'),
-                               openzip(io.BytesIO(comparison.pair[1].content), 'r')) as (comparison.pair[0].zip,
-                                                                                         comparison.pair[1].zip):
+    def put(cls, item, rule, buf, digest):
+        """
+        Record *digest* as that of the content, *buf*, of *item* once
+        normalized by *rule*, if it can be written to the cache.
+        """
+        if not cls._cached(item):
+            return
 
-            if comparison.pair[0].zip.comment != comparison.pair[1].zip.comment:
-                cls._log_different(comparison)
-                return Different
+        filename = cls._cache_name(item, rule)
+        try:
+            (fd, tmpname) = tempfile.mkstemp(dir=cache_dir)
+            with os.fdopen(fd, 'w') as tmp:
+                json.dump({'content': cls._content_digest(buf), 'normalized': digest}, tmp)
 
-            return super(cls, cls).cmp(comparison)
+            os.rename(tmpname, filename)
+
+        except (IOError, OSError) as err:
+            RuleComparator.logger.log(logging.DEBUG, 'normalized digest of %s not kept: %s', item.name, err)
 
 @_loggable
-class AMComparator(Comparator):
+class RuleComparator(Comparator):
     """
-    Automake generated Makefiles have some nondeterminisms.  They're
-    the same if they're the same aside from that.  (May also need to
-    make some allowance for different tool sets later.)
+    Files which are the same once normalized by a
+    :py:class:`NormalizeRule` are close enough.  The first of
+    :py:attr:`rules` which applies to both is used.  The rules are
+    normally loaded by :py:func:`load_rules`.
     """
 
-    @staticmethod
-    def _applies(item):
-        if not item.name.endswith('Makefile'):
-            return False # must be called 'Makefile'
+    rules = []
 
-        p = -1
-        for i in range(5):
-            p = item.content.find('\n', p + 1, p + 132)
-            if p is -1:
-                return False # must have at least 5 lines no longer than 132 chars each
+    @classmethod
+    def _rule(cls, item):
+        for rule in cls.rules:
+            if rule.applies(item):
+                return rule
+
+        return None
+
+    @classmethod
+    def applies(cls, comparison):
+        rules = [cls._rule(i) for i in comparison.pair]
+        return rules[0] is not None and rules[0] is rules[1]
 
-        return item.content.find('generated by automake', 0, p) > -1 # must contain this phrase
+    context = 3
+    """
+    Lines of context kept for reporting a difference.
+    """
 
     @classmethod
     def cmp(cls, comparison):
-        (left, right) = [i.content.decode('utf8') for i in comparison.pair]
+        rule = cls._rule(comparison.pair[0])
+        difference = None
+
+        with contextlib.nested(_content_buffer(comparison.pair[0]),
+                               _content_buffer(comparison.pair[1])) as bufs:
+            sides = list(zip(comparison.pair, bufs))
+            digests = [_NormalizedDigests.get(item, rule, buf) for (item, buf) in sides]
+            report = rule.conclusive and cls.logger.isEnabledFor(DIFFERENCES)
+            hashes = [hashlib.sha1() for side in sides]
+            streams = [None, None]
+
+            def normalized(side):
+                return _digesting(rule.blocks(sides[side][1]), hashes[side])
+
+            if report and digests == [None, None]:
+                # normalize and compare a block at a time, as far as
+                # the first difference, for the report.
+                streams = [normalized(side) for side in range(2)]
+                difference = _stream_difference(*streams, context=cls.context)
+
+            for (side, ((item, buf), cached)) in enumerate(zip(sides, digests)):
+                if cached is None:
+                    # the rest of the way, so that the digest is kept
+                    # whether or not the sides differ.
+                    for block in streams[side] or normalized(side):
+                        pass
+
+                    digests[side] = hashes[side].hexdigest()
+                    _NormalizedDigests.put(item, rule, buf, digests[side])
+
+            if report and difference is None and digests[0] != digests[1]:
+                # a side was known by its digest alone.
+                difference = _stream_difference(*[rule.blocks(buf) for (item, buf) in sides],
+                                                context=cls.context)
+
+        if digests[0] == digests[1]:
+            cls._log_same(comparison)
+            return Same
+
+        if not rule.conclusive:
+            cls._log_indeterminate(comparison)
+            return False
+
+        cls._log_different(comparison)
+        if difference is not None:
+            (lineno, windows) = difference
+            cls.logger.log(DIFFERENCES, 'first difference at line %s', lineno)
+            cls._log_unidiffs([i.decode('utf-8', 'replace') for i in windows],
+                              [i.name for i in comparison.pair])
 
-        (left, right) = [date_blot(i) for i in [left, right]]
+        return Different
 
-        (left, right) = [re.sub(r'(?m)^MODVERSION = .*$', 'MODVERSION = ...', i, 0) for i in [left, right]]
+@_loggable
+class AMComparator(RuleComparator):
+    """
+    Automake generated Makefiles have some nondeterminisms.  They're
+    the same if they're the same aside from that.  (May also need to
+    make some allowance for different tool sets later.)
+    """
 
-        (left, right) = [re.sub(r'(?m)^BUILDINFO = .*$', 'BUILDINFO = ...', i, 0) for i in [left, right]]
+    rules = [
+        NormalizeRule('*Makefile', 'generated by automake', [
+            (r'^MODVERSION = .*$', 'MODVERSION = ...'),
+            (r'^BUILDINFO = .*$', 'BUILDINFO = ...'),
+            ], lines=5, dates=True),
+        ]
 
-        if left == right:
-            cls._log_same(comparison)
-            return Same
-        else:
-            cls._log_different(comparison)
-            cls._log_unidiffs([left, right],
-                               [i.name for i in comparison.pair])
-            return Different
+_config_substitutions = [
+    (r'/cc.{6}\.([os])', r'/cc------.\1'),
+    (r'MODVERSION.*$', 'MODVERSION...'),
+    ]
 
 @_loggable
-class ConfigLogComparator(Comparator):
+class ConfigLogComparator(RuleComparator):
     """
     When autoconf tests fail, there's a line written to the config.log
     which exposes the name of the underlying temporary file.  Since
@@ -1845,51 +5147,14 @@ class ConfigLogComparator(Comparator):
        I've been more surgical.
     """
 
-    @staticmethod
-    def _applies(item):
-        if item.name.endswith('config.log'):
-            trigger = 'generated by GNU Autoconf'
-        elif item.name.endswith('config.status'):
-            trigger = 'Generated by configure.'
-        elif item.name.endswith('config.h'):
-            trigger = 'Generated from config.h.in by configure.'
-        else:
-            return False # must be named right
-
-        p = -1
-        for i in range(8):
-            p = item.content.find('\n', p + 1) # FIXME: is it worth it to bound this search?
-            if p is -1:
-                return False # must have at least 8 lines no longer than 132 chars each
-
-        return item.content.find(trigger, 0, p) > -1 # must contain this phrase
-
-    @classmethod
-    def cmp(cls, comparison):
-        (left, right) = [i.content for i in comparison.pair]
-        (left, right) = [re.sub(r'(?m)/cc.{6}\.([os])',
-                                '/cc------.\1',
-                                i,
-                                0) for i in [left, right]]
-
-        (left, right) = [re.sub(r'(?m)MODVERSION.*$',
-                                'MODVERSION...',
-                                i,
-                                0) for i in [left, right]]
-
-        (left, right) = [date_blot(i) for i in [left, right]]
-
-        if left == right:
-            cls._log_same(comparison)
-            return Same
-        else:
-            cls._log_different(comparison)
-            cls._log_unidiffs([left, right],
-                               [i.name for i in comparison.pair])
-            return Different
+    rules = [
+        NormalizeRule('*config.log', 'generated by GNU Autoconf', _config_substitutions, dates=True),
+        NormalizeRule('*config.status', 'Generated by configure.', _config_substitutions, dates=True),
+        NormalizeRule('*config.h', 'Generated from config.h.in by configure.', _config_substitutions, dates=True),
+        ]
 
 @_loggable
-class KernelConfComparator(Comparator):
+class KernelConfComparator(RuleComparator):
     """
     When "make config" is run in the kernel, it generates an auto.conf
     file which includes a time stamp.  I think these files are
@@ -1897,37 +5162,11 @@ class KernelConfComparator(Comparator):
     blots out the 4th line.
     """
 
-    @staticmethod
-    def _applies(item):
-        if item.name.endswith('auto.conf'):
-            trigger = 'Automatically generated make config: don\'t edit'
-        elif item.name.endswith('autoconf.h'):
-            trigger = 'Automatically generated C config: don\'t edit'
-        else:
-            return False # must be named right
-
-        p = -1
-        for i in range(8):
-            p = item.content.find('\n', p + 1) # FIXME: is it worth it to bound this search?
-            if p is -1:
-                return False # must have at least 8 lines no longer than 132 chars each
-
-        return item.content.find(trigger, 0, p) > -1 # must contain this phrase
-
-    @classmethod
-    def cmp(cls, comparison):
-        (left, right) = [i.content.split('\n') for i in comparison.pair]
-        del left[3]
-        del right[3]
-
-        if left == right:
-            cls._log_same(comparison)
-            return Same
-        else:
-            cls._log_different(comparison)
-            cls._log_unidiffs([left, right],
-                               [i.name for i in comparison.pair])
-            return Different
+    rules = [
+        NormalizeRule(glob, trigger, [(r'\A((?:.*\n){3}).*$', r'\1')])
+        for (glob, trigger) in [('*auto.conf', 'Automatically generated make config: don\'t edit'),
+                                ('*autoconf.h', 'Automatically generated C config: don\'t edit')]
+        ]
 
 @_loggable
 class ZipMemberMetadataComparator(Comparator):
@@ -1993,6 +5232,105 @@ class ZipMemberMetadataComparator(Comparator):
             return Different
 
 
+@_loggable
+class ZipCRCComparator(Comparator):
+    """
+    Zip archive members are the same if the central directory records
+    the same crc and sizes for them and their stored, (compressed),
+    data is identical.  This doesn't require decompressing either
+    member.
+    """
+    @staticmethod
+    def _applies(item):
+        return item.parent.box is ZipComparator
+
+    @classmethod
+    def cmp(cls, comparison):
+        (left, right) = [i.parent.zip.getinfo(i.shortname) for i in comparison.pair]
+
+        if (left.CRC == right.CRC
+            and left.file_size == right.file_size
+            and left.compress_size == right.compress_size
+            and left.compress_type == right.compress_type
+            and reduce(operator.eq, [ZipComparator.member_raw(i) for i in comparison.pair])):
+            cls._log_same(comparison)
+            return Same
+
+        cls._log_indeterminate(comparison)
+        return False
+
+
+def _decoded(item, pieces, encoded):
+    """
+    Join *pieces*, as they are decoded, into the content of *item*,
+    which was *encoded* bytes before decoding.  They are charged to
+    the item's :py:class:`Budget`, if it has one, as they come.
+    """
+    budget = getattr(item, 'budget', None)
+    (content, size) = ([], 0)
+
+    for piece in pieces:
+        size += len(piece)
+        if budget:
+            budget.check(size, encoded)
+
+        content.append(piece)
+
+    if budget:
+        budget.spend(size)
+
+    return b''.join(content)
+
+def _charged(budget, things, encoded=None, size=len):
+    """
+    Yield *things*, charging each to *budget*, if there is one, before
+    it's yielded, as a member decoded from *encoded* bytes, (or, if
+    that isn't known, from itself).
+
+    :param size: the number of decoded bytes a thing stands for
+    :type size: function
+    """
+    for thing in things:
+        if budget:
+            budget.check(size(thing), size(thing) if encoded is None else encoded)
+            budget.spend(size(thing))
+
+        yield thing
+
+def _tar_size(info):
+    """
+    The number of bytes a tar member stands for in its archive.
+    """
+    return tarfile.BLOCKSIZE + info.size
+
+def _inflate(decoder, data):
+    """
+    Decode *data* with *decoder*, no more than a chunk at a time where
+    the decoder can bound its output, (zlib's can, and on python 3 so
+    can bz2's, but python 2's bz2 can't).
+    """
+    if hasattr(decoder, 'unconsumed_tail'):
+        while True:
+            piece = decoder.decompress(data, _chunk_size)
+            data = decoder.unconsumed_tail
+            yield piece
+            if not data and len(piece) < _chunk_size:
+                break
+
+    elif hasattr(decoder, 'needs_input'):
+        yield decoder.decompress(data, _chunk_size)
+        while not decoder.needs_input and not decoder.eof:
+            yield decoder.decompress(b'', _chunk_size)
+
+    else:
+        yield decoder.decompress(data)
+
+def _pieces(fileobj):
+    """
+    Read *fileobj* a chunk at a time.
+    """
+    return iter(lambda: fileobj.read(_chunk_size), b'')
+
 class Encoder(ContentOnlyBox):
     """
     Most UN*X compression programs compress a single stream of data.
@@ -2030,7 +5368,8 @@ class Encoder(ContentOnlyBox):
                           comparators=comparison.comparators,
                           ignores=comparison.ignores,
                           exit_asap=comparison.exit_asap,
-                          ignore_ownerships=comparison.ignore_ownerships).cmp()
+                          ignore_ownerships=comparison.ignore_ownerships,
+                          budget=comparison.budget).cmp()
 
 @_loggable
 class GzipComparator(Encoder):
@@ -2055,12 +5394,13 @@ class GzipComparator(Encoder):
 
     @staticmethod
     def _applies(item):
-        return bytes(item.content[0:2]) == b'\x1f\x8b'
+        return item.peek(2) == b'\x1f\x8b'
 
     @staticmethod
     def member_content(member):
-        with GzipComparator.open(member.parent.name, 'rb', io.BytesIO(member.parent.content)) as gzipobj:
-            return gzipobj.read()
+        content = member.parent.content
+        with GzipComparator.open(member.parent.name, 'rb', io.BytesIO(content)) as gzipobj:
+            return _decoded(member, _pieces(gzipobj), len(content))
 
 
 @_loggable
@@ -2088,17 +5428,129 @@ class BZ2Comparator(Encoder):
 
     @staticmethod
     def _applies(item):
-        return bytes(item.content[0:2]) == b'BZ'
+        return item.peek(2) == b'BZ'
 
     @staticmethod
     def member_content(member):
-        with BZ2Comparator.open(member.parent.name, 'rb', io.BytesIO(member.parent.content)) as bz2obj:
-            return bz2obj.read()
+        content = member.parent.content
+        with BZ2Comparator.open(member.parent.name, 'rb', io.BytesIO(content)) as bz2obj:
+            return _decoded(member, _pieces(bz2obj), len(content))
+
+_xz_magic = b'\xfd7zXZ\x00'
+_xz_footer_magic = b'YZ'
+
+def _xz_crc32(data):
+    return struct.pack(b'<I', binascii.crc32(data) & 0xffffffff)
+
+def _xz_decode_int(buf, offset):
+    """
+    Decode one of xz's variable length integers.
+
+    :rtype: (value, offset of the following byte)
+    """
+    value = 0
+    for i, byte in enumerate(bytearray(buf[offset:offset + 9])):
+        value |= (byte & 0x7f) << (7 * i)
+        if not byte & 0x80:
+            return (value, offset + i + 1)
+
+    raise ValueError('bad xz integer at {}'.format(offset))
+
+def _xz_encode_int(value):
+    retval = bytearray()
+    while value >= 0x80:
+        retval.append((value & 0x7f) | 0x80)
+        value >>= 7
+
+    retval.append(value)
+    return bytes(retval)
+
+def _xz_blocks(content):
+    """
+    Read the index of each stream in an xz file and return a list of
+    blocks.  Each block is a tuple of (stream flags, block offset,
+    unpadded size, uncompressed size).  Streams, and therefore
+    blocks, are found by working backward from the end of the file.
+
+    Raises :py:exc:`ValueError` if *content* doesn't parse.
+
+    :rtype: list of tuples
+    """
+    blocks = []
+    end = len(content)
+
+    while end > 0:
+        # stream padding
+        while end >= 4 and content[end - 4:end] == b'\x00\x00\x00\x00':
+            end -= 4
+
+        if end == 0:
+            break
+
+        footer = content[end - 12:end]
+        if len(footer) != 12 or footer[10:12] != _xz_footer_magic:
+            raise ValueError('no xz stream footer at {}'.format(end))
+
+        if _xz_crc32(footer[4:10]) != footer[0:4]:
+            raise ValueError('bad xz stream footer crc at {}'.format(end))
+
+        (backward_size,) = struct.unpack(b'<I', footer[4:8])
+        flags = footer[8:10]
+        index_end = end - 12
+        index_start = index_end - (backward_size + 1) * 4
+        index = content[index_start:index_end]
+
+        if index[0:1] != b'\x00' or _xz_crc32(index[:-4]) != index[-4:]:
+            raise ValueError('bad xz index at {}'.format(index_start))
+
+        (count, offset) = _xz_decode_int(index, 1)
+        records = []
+        for i in range(count):
+            (unpadded, offset) = _xz_decode_int(index, offset)
+            (uncompressed, offset) = _xz_decode_int(index, offset)
+            records.append((unpadded, uncompressed))
+
+        start = index_start - sum((r[0] + 3) & ~3 for r in records) - 12
+        if start < 0 or content[start:start + 6] != _xz_magic or content[start + 6:start + 8] != flags:
+            raise ValueError('no xz stream header at {}'.format(start))
+
+        stream_blocks = []
+        offset = start + 12
+        for (unpadded, uncompressed) in records:
+            stream_blocks.append((flags, offset, unpadded, uncompressed))
+            offset += (unpadded + 3) & ~3
+
+        blocks[0:0] = stream_blocks
+        end = start
+
+    return blocks
+
+def _xz_block_stream(content, block):
+    """
+    Wrap a single block from an xz file up as a complete xz stream of
+    its own so that it can be decoded independently.
+    """
+    (flags, offset, unpadded, uncompressed) = block
+
+    index = b'\x00' + _xz_encode_int(1) + _xz_encode_int(unpadded) + _xz_encode_int(uncompressed)
+    index += b'\x00' * (-len(index) % 4)
+    index += _xz_crc32(index)
+
+    tail = struct.pack(b'<I', len(index) // 4 - 1) + flags
+
+    return b''.join([_xz_magic, flags, _xz_crc32(flags),
+                     content[offset:offset + ((unpadded + 3) & ~3)],
+                     index,
+                     _xz_crc32(tail), tail, _xz_footer_magic])
 
 @_loggable
 class XZComparator(Encoder):
     """
     XZ archives only have one member.
+
+    Files written by multi-threaded xz, (xz -T), are composed of
+    several independently compressed blocks.  These are located using
+    the block index and decompressed in parallel.
     """
 
     _myname = 'xz'
@@ -2123,12 +5575,337 @@ class XZComparator(Encoder):
                  failures.  But that seems pretty expensive and besides, who
                  uses lzma?
         """
-        return bytes(item.content[0:6]) == b'\xfd7zXZ\x00'
+        return bool(lzma) and item.peek(6) == _xz_magic
+
+    # : Most compressed bytes fed to a block's decoder at once where the
+    # : decoder can't bound its own output, (python 2's backports.lzma).
+    _feed_size = 256
+
+    @classmethod
+    def _block_pieces(cls, content, block):
+        """
+        Yield *block* of *content* decoded a piece at a time, each no
+        more than a chunk where the decoder allows it.
+
+        Raises :py:exc:`lzma.LZMAError` as soon as the block decodes to
+        more than the index says, or at the end if to less.
+        """
+        decoder = lzma.LZMADecompressor()
+        stream = _xz_block_stream(content, block)
+        step = _chunk_size if hasattr(decoder, 'needs_input') else cls._feed_size
+        size = 0
+
+        for offset in range(0, len(stream), step):
+            for piece in _inflate(decoder, stream[offset:offset + step]):
+                size += len(piece)
+                if size > block[3]:
+                    raise lzma.LZMAError('xz block at {} decodes to more than its {} bytes'.format(block[1], block[3]))
+
+                yield piece
+
+        if size != block[3]:
+            raise lzma.LZMAError('xz block at {} decodes to {} bytes, not {}'.format(block[1], size, block[3]))
+
+    @classmethod
+    def _decode_block(cls, args):
+        return b''.join(cls._block_pieces(*args))
 
     @staticmethod
     def member_content(member):
-        with XZComparator.open(member.parent.name, 'rb', io.BytesIO(member.parent.content)) as xzobj:
-            return xzobj.read()
+        content = member.parent.content
+
+        try:
+            blocks = _xz_blocks(content)
+
+        except ValueError as err:
+            XZComparator.logger.log(logging.DEBUG, 'no usable xz index in %s: %s', member.parent.name, err)
+            blocks = []
+
+        if len(blocks) > 1:
+            # the index gives the decoded sizes up front, and no block
+            # is let decode to more than its size.
+            if getattr(member, 'budget', None):
+                member.budget.check(sum(block[3] for block in blocks), len(content))
+
+            with _threadpool() as pool:
+                return _decoded(member, pool.map(XZComparator._decode_block, [(content, block) for block in blocks]),
+                                len(content))
+
+        with XZComparator.open(member.parent.name, 'rb', io.BytesIO(content)) as xzobj:
+            return _decoded(member, _pieces(xzobj), len(content))
+
+# : Size of the pieces in which compressed content is fed to decoders.
+_chunk_size = 1024 * 1024
+
+def _skippable_frame(content, offset):
+    """
+    Both zstd and lz4 reserve a range of magic numbers for skippable
+    frames.  If there is one at *offset*, return the offset of its
+    end.  Otherwise, return None.
+    """
+    magic = bytearray(content[offset:offset + 4])
+    if len(magic) == 4 and magic[1:4] == b'\x2a\x4d\x18' and magic[0] & 0xf0 == 0x50:
+        size = content[offset + 4:offset + 8]
+        if len(size) != 4:
+            raise ValueError('truncated skippable frame at {}'.format(offset))
+
+        return offset + 8 + struct.unpack(b'<I', size)[0]
+
+    return None
+
+class FramedEncoder(Encoder):
+    """
+    Compressors like zstd and lz4 write a sequence of independently
+    decodable frames.  The frames are located by walking their
+    headers, without decoding them, and then decoded in parallel,
+    each one fed to its decoder a chunk at a time.
+    """
+    __metaclass__ = abc.ABCMeta
+
+    @staticmethod
+    @abc.abstractmethod
+    def _frames(content):
+        """
+        Return a list of (start, end) offsets, one per frame, skipping
+        skippable frames.  Raise :py:exc:`ValueError` if *content*
+        doesn't parse.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    @abc.abstractmethod
+    def _decompressobj():
+        """
+        Return a fresh decoder for a single frame.
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def _frame_pieces(cls, content, start, end):
+        """
+        Yield the frame at *start* to *end* of *content* decoded, no
+        more than a chunk at a time however much a chunk of input
+        expands, so that a :py:class:`Budget` can stop a bomb early.
+        """
+        decoder = cls._decompressobj()
+        for offset in range(start, end, _chunk_size):
+            yield decoder.decompress(content[offset:min(offset + _chunk_size, end)], _chunk_size)
+            while not decoder.needs_input and not decoder.eof:
+                yield decoder.decompress(b'', _chunk_size)
+
+    @classmethod
+    def _decode_frame(cls, args):
+        (content, (start, end), budget) = args
+        if not budget:
+            return b''.join(cls._frame_pieces(content, start, end))
+
+        # check each frame as it's decoded.  The whole is charged later.
+        (pieces, size) = ([], 0)
+        for piece in cls._frame_pieces(content, start, end):
+            size += len(piece)
+            budget.check(size, end - start)
+            pieces.append(piece)
+
+        return b''.join(pieces)
+
+    @classmethod
+    def cmp(cls, comparison):
+        # A single decoder stops at the end of the first frame, so
+        # content whose frames can't be found isn't decoded at all
+        # rather than perhaps only in part.
+        for item in comparison.pair:
+            try:
+                item.frames = cls._frames(item.content)
+
+            except ValueError as err:
+                cls.logger.log(logging.DEBUG, 'cannot find %s frames in %s: %s', cls._myname, item.name, err)
+                cls._log_indeterminate(comparison)
+                return False
+
+        return super(FramedEncoder, cls).cmp(comparison)
+
+    @classmethod
+    def member_content(cls, member):
+        content = member.parent.content
+        frames = getattr(member.parent, 'frames', None)
+        if frames is None:
+            frames = cls._frames(content)
+
+        if len(frames) > 1:
+            budget = getattr(member, 'budget', None)
+            with _threadpool() as pool:
+                return _decoded(member, pool.map(cls._decode_frame, [(content, frame, budget) for frame in frames]),
+                                len(content))
+
+        return _decoded(member, cls._frame_pieces(content, *frames[0]), len(content))
+
+_zstd_magic = b'\x28\xb5\x2f\xfd'
+
+@_loggable
+class ZstdComparator(FramedEncoder):
+    """
+    Zstandard archives only have one member although it may be
+    written as several frames.
+
+    Uses :py:mod:`compression.zstd` where available, (python-3.14),
+    and the zstandard package otherwise.
+    """
+
+    _myname = 'zstd'
+
+    _packer = _Packer('{{{}}}'.format(_myname))
+
+    _content_name = '{{{}content}}'.format(_myname)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def open(filename, mode, fileobj):
+        if hasattr(zstd, 'ZstdFile'):
+            zobj = zstd.ZstdFile(fileobj if fileobj else filename, mode)
+        else:
+            zobj = zstd.ZstdDecompressor().stream_reader(fileobj if fileobj else io.open(filename, mode))
+
+        yield zobj
+        zobj.close()
+
+    @staticmethod
+    def _applies(item):
+        return bool(zstd) and item.peek(4) == _zstd_magic
+
+    @staticmethod
+    def _decompressobj():
+        return zstd.ZstdDecompressor()
+
+    @classmethod
+    def _frame_pieces(cls, content, start, end):
+        if hasattr(zstd, 'ZstdFile'):
+            return super(ZstdComparator, cls)._frame_pieces(content, start, end)
+
+        # the zstandard package's decompressobj can't bound its output
+        # but its stream reader can.
+        return _pieces(zstd.ZstdDecompressor().stream_reader(content[start:end]))
+
+    @staticmethod
+    def _frames(content):
+        frames = []
+        offset = 0
+
+        while offset < len(content):
+            end = _skippable_frame(content, offset)
+            if end is not None:
+                offset = end
+                continue
+
+            if content[offset:offset + 4] != _zstd_magic:
+                raise ValueError('no zstd frame at {}'.format(offset))
+
+            (descriptor,) = bytearray(content[offset + 4:offset + 5])
+            single_segment = bool(descriptor & 0x20)
+            position = (offset + 5
+                        + (0 if single_segment else 1) # window descriptor
+                        + (0, 1, 2, 4)[descriptor & 0x03] # dictionary id
+                        + (int(single_segment), 2, 4, 8)[descriptor >> 6]) # frame content size
+
+            while True:
+                header = bytearray(content[position:position + 3])
+                if len(header) != 3:
+                    raise ValueError('truncated zstd frame at {}'.format(offset))
+
+                value = header[0] | (header[1] << 8) | (header[2] << 16)
+                block_type = (value >> 1) & 0x03
+                if block_type == 3:
+                    raise ValueError('reserved zstd block type at {}'.format(position))
+
+                # rle blocks hold a single byte
+                position += 3 + (1 if block_type == 1 else value >> 3)
+
+                if value & 0x01: # last block
+                    break
+
+            if descriptor & 0x04: # content checksum
+                position += 4
+
+            if position > len(content):
+                raise ValueError('truncated zstd frame at {}'.format(offset))
+
+            frames.append((offset, position))
+            offset = position
+
+        return frames
+
+_lz4_magic = b'\x04\x22\x4d\x18'
+
+@_loggable
+class LZ4Comparator(FramedEncoder):
+    """
+    LZ4 archives, (in the lz4 frame format), only have one member
+    although it may be written as several frames.
+    """
+
+    _myname = 'lz4'
+
+    _packer = _Packer('{{{}}}'.format(_myname))
+
+    _content_name = '{{{}content}}'.format(_myname)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def open(filename, mode, fileobj):
+        lz4obj = lz4frame.LZ4FrameFile(fileobj if fileobj else filename, mode)
+        yield lz4obj
+        lz4obj.close()
+
+    @staticmethod
+    def _applies(item):
+        return bool(lz4frame) and item.peek(4) == _lz4_magic
+
+    @staticmethod
+    def _decompressobj():
+        return lz4frame.LZ4FrameDecompressor()
+
+    @staticmethod
+    def _frames(content):
+        frames = []
+        offset = 0
+
+        while offset < len(content):
+            end = _skippable_frame(content, offset)
+            if end is not None:
+                offset = end
+                continue
+
+            if content[offset:offset + 4] != _lz4_magic:
+                raise ValueError('no lz4 frame at {}'.format(offset))
+
+            (flags,) = bytearray(content[offset + 4:offset + 5])
+            position = (offset + 7 # magic, flags, block descriptor, header checksum
+                        + (8 if flags & 0x08 else 0) # content size
+                        + (4 if flags & 0x01 else 0)) # dictionary id
+            block_checksum = 4 if flags & 0x10 else 0
+
+            while True:
+                header = content[position:position + 4]
+                if len(header) != 4:
+                    raise ValueError('truncated lz4 frame at {}'.format(offset))
+
+                (size,) = struct.unpack(b'<I', header)
+                position += 4
+
+                if size == 0: # end mark
+                    break
+
+                position += (size & 0x7fffffff) + block_checksum
+
+            if flags & 0x04: # content checksum
+                position += 4
+
+            if position > len(content):
+                raise ValueError('truncated lz4 frame at {}'.format(offset))
+
+            frames.append((offset, position))
+            offset = position
+
+        return frames
 
 @_loggable
 class FailComparator(Comparator):
@@ -2136,15 +5913,71 @@ class FailComparator(Comparator):
     Used as a catchall - just return Difference
     """
 
+    report_ranges = 8
+    """
+    Most differing ranges of binary files dumped.
+    """
+
+    report_bytes = 64
+    """
+    Most bytes of each differing range of binary files dumped.
+    """
+
     @staticmethod
     def _applies(item):
         return True
 
+    @staticmethod
+    def _binary(item):
+        return item.exists and item.isreg and b'\0' in item.peek(_peek_size)
+
+    @classmethod
+    def _binary_report(cls, bufs):
+        """
+        Yield lines reporting the differences between the binary
+        contents *bufs*.
+        """
+        (left, right) = bufs
+        yield 'sizes {} and {} bytes'.format(len(left), len(right))
+
+        first = _first_difference(left, right)
+        if first is None:
+            yield 'contents are identical'
+            return
+
+        yield 'first difference at offset {:#x}'.format(first)
+
+        (count, windows) = (0, [])
+        for (start, end) in _differing_ranges(left, right):
+            count += 1
+            if count > cls.report_ranges:
+                continue
+
+            windows.append('@@ {:#x}-{:#x} @@'.format(start, end))
+            stop = min(end, start + cls.report_bytes)
+            for (prefix, buf) in [('-', left), ('+', right)]:
+                windows.extend(prefix + line for line in _hexdump(buf[start:stop], start))
+
+        yield '{} differing ranges'.format(count)
+
+        for line in windows:
+            yield line
+
+        if count > cls.report_ranges:
+            yield '... {} more differing ranges not shown'.format(count - cls.report_ranges)
+
     @classmethod
     def cmp(cls, comparison):
         cls._log_different(comparison)
         cls.logger.log(DIFFERENCES, '\n')
-        cls._log_unidiffs_comparison(comparison)
+
+        if [i for i in comparison.pair if cls._binary(i)]:
+            with contextlib.nested(_content_buffer(comparison.pair[0]),
+                                   _content_buffer(comparison.pair[1])) as bufs:
+                cls.logger.log(DIFFERENCES, '\n'.join(cls._binary_report(bufs)))
+
+        else:
+            cls._log_unidiffs_comparison(comparison)
 
         return Different
 
@@ -2216,34 +6049,15 @@ class SymlinkComparator(Comparator):
 
 
 @_loggable
-class MapComparator(Comparator):
+class MapComparator(RuleComparator):
     """
     Linker map files include a reference to the output file which is
     typically a generated temp file name.
     """
-    @staticmethod
-    def _applies(item):
-        try:
-            retval = item.content.startswith('Archive member included')
-
-        except UnicodeDecodeError:
-            # must not be.
-            retval = False
-
-        return retval
-
-    _pattern = re.compile('tmp-\d*')
-
-    @classmethod
-    def cmp(cls, comparison):
-        munged = [cls._pattern.sub('tmp-0', i.content) for i in comparison.pair]
-        if reduce(operator.eq, munged):
-            cls._log_same(comparison)
-            return Same
 
-        else:
-            cls._log_indeterminate(comparison)
-            return False
+    rules = [
+        NormalizeRule('*', 'Archive member included', [(r'tmp-\d*', 'tmp-0')], lines=1, conclusive=False),
+        ]
 
 
 @_loggable
@@ -2261,28 +6075,36 @@ class _ComparisonCommon(object):
     :type exit_asap: boolean
     :param ignore_ownerships: ignore differences in element ownerships
     :type ignore_ownerships: boolean
+    :param budget: limits on decoding, (None for no limits)
+    :type budget: :py:class:`Budget`
     """
 
     default_comparators = [
         NoSuchFileComparator,
+        TarStreamComparator,
         InodeComparator,
         EmptyFileComparator,
         DirComparator,
+        DirArchiveComparator,
         ArMemberMetadataComparator,
+        ZipCRCComparator,
         BitwiseComparator,
         SymlinkComparator,
         #BuriedPathComparator,
         ElfComparator,
         ArComparator,
+        RuleComparator,
         AMComparator,
         ConfigLogComparator,
         KernelConfComparator,
-        #XZComparator,
+        TarMemberMetadataComparator,
+        TarComparator, # must be before GzipComparator
+        XZComparator,
+        ZstdComparator,
+        LZ4Comparator,
         BZ2Comparator,
         GzipComparator,
         ZipComparator,
-        TarMemberMetadataComparator,
-        TarComparator, # must be before GzipComparator
         CpioMemberMetadataComparator,
         CpioComparator,
         MapComparator,
@@ -2298,12 +6120,14 @@ class _ComparisonCommon(object):
                  comparators=False,
                  ignores=[],
                  exit_asap=False,
-                 ignore_ownerships=False):
+                 ignore_ownerships=False,
+                 budget=None):
 
         self.comparators = comparators if comparators is not False else self.default_comparators
         self.ignores = ignores
         self.exit_asap = exit_asap
         self.ignore_ownerships=ignore_ownerships
+        self.budget = budget
 
 
     def ignoring(self, fname):
@@ -2335,8 +6159,15 @@ class Comparison(_ComparisonCommon):
     If ignore_ownerships is true, then any differences in element ownerships
     are ignored.
 
+    If a budget is given, a pair which would exceed it is reported as
+    :py:class:`Different` rather than compared.
+
     .. todo:: exit_asap is not currently functional.
 
+    Either name may also be '-', 'fd:N' or the name of a named pipe, in
+    which case a tar stream is read from it, (see
+    :py:class:`TarStreamComparator`).
+
     :param lname: path name of the first thing, (the leftmost one)
     :type lname: string
     :param rname: path name of the second thing, (the rightmost one)
@@ -2349,6 +6180,8 @@ class Comparison(_ComparisonCommon):
     :type exit_asap: boolean
     :param ignore_ownerships: ignore differences in element ownerships
     :type ignore_ownerships: boolean
+    :param budget: limits on decoding, (None for no limits)
+    :type budget: :py:class:`Budget`
     """
 
     @property
@@ -2377,23 +6210,29 @@ class Comparison(_ComparisonCommon):
                  comparators=False,
                  ignores=[],
                  exit_asap=False,
-                 ignore_ownerships=False):
+                 ignore_ownerships=False,
+                 budget=None):
 
         _ComparisonCommon.__init__(self,
                                    comparators=comparators,
                                    ignores=ignores,
                                    exit_asap=exit_asap,
-                                   ignore_ownerships=ignore_ownerships)
+                                   ignore_ownerships=ignore_ownerships,
+                                   budget=budget)
 
         if rname and not ritem:
-            ritem = Items.find_or_create(rname, root, DirComparator)
+            ritem = _stream_item(rname) or Items.find_or_create(rname, root, DirComparator)
 
         if lname and not litem:
-            litem = Items.find_or_create(lname, root, DirComparator)
+            litem = _stream_item(lname) or Items.find_or_create(lname, root, DirComparator)
 
         self.pair = (litem, ritem)
         self.children = []
 
+        # decoders find the budget through the items they decode.
+        for item in self.pair:
+            item.budget = budget
+
         for item in self.pair:
             i = self.ignoring(item.name)
             if i:
@@ -2430,15 +6269,26 @@ class Comparison(_ComparisonCommon):
         .. todo:: exit_asap is not currently functional.
         """
         for comparator in self.comparators:
-            if not comparator.applies(self):
+            try:
+                if not comparator.applies(self):
+                    self.logger.log(logging.DEBUG,
+                                    'does not apply - %s %s', comparator, self._pair[0].name)
+                    continue
+
                 self.logger.log(logging.DEBUG,
-                                'does not apply - %s %s', comparator, self._pair[0].name)
-                continue
+                                'applies - %s %s', comparator, self._pair[0].name)
+
+                if self.budget and issubclass(comparator, Box) and comparator is not DirComparator:
+                    self.budget.descend(self._pair[0])
+
+                result = comparator.cmp(self)
+
+            except BudgetExceeded as err:
+                self.logger.log(DIFFERENCES, 'Different %s over budget: %s, %s',
+                                comparator.__name__, self._pair[0].name, err)
+                self.reset()
+                return Different
 
-            self.logger.log(logging.DEBUG,
-                            'applies - %s %s', comparator, self._pair[0].name)
-            
-            result = comparator.cmp(self)
             if result:
                 self.logger.log(logging.DEBUG, '%s %s', result.__name__, self.__class__.__name__)
                 self.reset()
@@ -2468,12 +6318,14 @@ class ComparisonList(_ComparisonCommon):
                  comparators=False,
                  ignores=[],
                  exit_asap=False,
-                 ignore_ownerships=False):
+                 ignore_ownerships=False,
+                 budget=None):
         _ComparisonCommon.__init__(self,
                                    comparators=comparators,
                                    ignores=ignores,
                                    exit_asap=exit_asap,
-                                   ignore_ownerships=ignore_ownerships)
+                                   ignore_ownerships=ignore_ownerships,
+                                   budget=budget)
 
         self.stuff = []
         for lst in stuff:
@@ -2512,7 +6364,8 @@ class ComparisonList(_ComparisonCommon):
                                     comparators=self.comparators,
                                     ignores=self.ignores,
                                     exit_asap=self.exit_asap,
-                                    ignore_ownerships=self.ignore_ownerships)
+                                    ignore_ownerships=self.ignore_ownerships,
+                                    budget=self.budget)
             c = comparison.cmp()
 
             if not c:
@@ -2535,3 +6388,6 @@ class ComparisonList(_ComparisonCommon):
 
 # : this is used to parent top level Items
 root = Item('{root}', True)
+
+# : parent of the items read from streams, (see :py:func:`_stream_item`).
+streams = Item('{streams}', True, TarStreamComparator)
@@ -54,6 +54,17 @@ def main():
     logger.setLevel(log_level)
     logger.addHandler(handler)
 
+    rcmp.threads = options.jobs
+    rcmp.ZipComparator.verify = options.verify
+    rcmp.TarComparator.stream = options.stream
+    rcmp.cache_dir = options.cache_dir
+    rcmp.ElfComparator.build_id = options.elf_build_id
+    rcmp.ElfComparator.ignore_sections = rcmp.ElfComparator.ignore_sections + options.elf_ignore_sections
+
+    for rfile in options.rulefiles:
+        with open(rfile, 'r') as rulefile:
+            rcmp.RuleComparator.rules = rcmp.RuleComparator.rules + rcmp.load_rules(rulefile)
+
     ignores = []
 
     for ifile in options.ignorefiles:
@@ -66,11 +77,17 @@ def main():
     else:
         ignores = rcmp.fntore(ignores)
 
+    budget = None
+    limits = [options.max_depth, options.max_member, options.max_total, options.max_ratio]
+    if [limit for limit in limits if limit is not None]:
+        budget = rcmp.Budget(*limits)
+
     result = rcmp.Comparison(lname=options.left,
                              rname=options.right,
                              ignores=ignores,
                              exit_asap=options.exit_asap,
-                             ignore_ownerships=options.ignore_ownerships).cmp()
+                             ignore_ownerships=options.ignore_ownerships,
+                             budget=budget).cmp()
 
     return 0 if result == rcmp.Same else 1
 
@@ -83,8 +100,8 @@ def _parse_args():
     """
     parser = argparse.ArgumentParser(description='Recursively CoMPares two trees.')
     
-    parser.add_argument('left', help='First tree to check.')
-    parser.add_argument('right', help='Second tree to check.')
+    parser.add_argument('left', help='First tree to check.  (\'-\', fd:N or a named pipe to read a tar stream)')
+    parser.add_argument('right', help='Second tree to check.  (\'-\', fd:N or a named pipe to read a tar stream)')
 
     parser.add_argument('-e', '--exit-asap', '--exit-early',
                         default=False, action='store_true', help='Exit on first difference. [default %(default)s]')
@@ -98,9 +115,39 @@ def _parse_args():
     parser.add_argument('--no-ignores', action='store_const', dest='ignorefiles', const=[],
                         help='reset the list of ignore files')
 
+    parser.add_argument('-r', '--rules', action='append', type=str, default=[], dest='rulefiles',
+                        help='Read normalization rules for generated files from the named json file. (can be repeated)')
+
     parser.add_argument('--ignore-ownerships', default=False, action='store_true',
                         help='Ignore differences in element ownerships. [default %(default)s]')
 
+    parser.add_argument('--no-verify', default=True, action='store_false', dest='verify',
+                        help='Trust archives.  Skip checking zip member crcs. [default verify]')
+
+    parser.add_argument('--no-stream', default=True, action='store_false', dest='stream',
+                        help='Compare tar archives member by member without first streaming through them. [default stream]')
+
+    parser.add_argument('--elf-build-id', default=False, action='store_true',
+                        help='Take elf files with the same gnu build-id to be the same. [default %(default)s]')
+
+    parser.add_argument('--elf-ignore-section', action='append', default=[], dest='elf_ignore_sections',
+                        help='Also ignore the contents of elf sections matching this pattern. (can be repeated)')
+
+    parser.add_argument('--cache-dir', default=None,
+                        help='Keep indexes of compressed tar archives in this directory between runs. [default none]')
+
+    parser.add_argument('--max-depth', default=None, type=int,
+                        help='Treat anything nested more than this many archives deep as different. [default no limit]')
+    parser.add_argument('--max-member', default=None, type=int,
+                        help='Treat any member decompressing to more than this many bytes as different. [default no limit]')
+    parser.add_argument('--max-total', default=None, type=int,
+                        help='Treat anything past this many decompressed bytes as different. [default no limit]')
+    parser.add_argument('--max-ratio', default=None, type=float,
+                        help='Treat any member decompressing by more than this ratio as different. [default no limit]')
+
+    parser.add_argument('-j', '--jobs', default=None, type=int,
+                        help='Number of threads to use for parallel decoding. [default one per cpu]')
+
     parser.add_argument('-v', '--verbose', action='count', help='Be more verbose. (can be repeated)')
 
     return parser.parse_args()
@@ -26,11 +26,20 @@ from __future__ import unicode_literals, print_function
 __docformat__ = 'restructuredtext en'
 
 import abc
+import contextlib
+import difflib
+import gzip
+import io
 import os
+import random
 import shutil
+import struct
 import subprocess
+import tarfile
 import tempfile
+import threading
 import time
+import zipfile
 
 import nose
 from nose.tools import assert_false, assert_equal, raises
@@ -454,6 +463,40 @@ class testAr(object):
             ], exit_asap=self.exit_asap)
         assert_equal(r.cmp(), rcmp.Same)
 
+class testArIndex(object):
+    """
+    Member names, including long ones, are recovered from the headers.
+    """
+    longname = 'a_member_with_a_long_name.py'
+    fname = 'longnames.a'
+
+    def setUp(self):
+        shutil.copy(rcmp_py, self.longname)
+        subprocess.check_call(['ar', 'cr', self.fname, self.longname, tests_py])
+
+    def tearDown(self):
+        for fname in [self.fname, self.longname]:
+            os.remove(fname)
+
+    def testGNU(self):
+        with open(self.fname, 'rb') as fd:
+            ar = rcmp._ArArchive(fd.read())
+
+        assert_equal(sorted(ar.archived_files), sorted([self.longname.encode(), os.path.basename(tests_py).encode()]))
+        with open(rcmp_py, 'rb') as fd:
+            assert_equal(ar.archived_files[self.longname.encode()].read(), fd.read())
+
+    def testBSD(self):
+        name = self.longname.encode()
+        header = '#1/{}'.format(len(name)).encode().ljust(16) + b'0'.ljust(12) + b'0'.ljust(6) + b'0'.ljust(6)
+        header += b'644'.ljust(8) + '{}'.format(len(name) + 3).encode().ljust(10) + b'`\n'
+        ar = rcmp._ArArchive(b'!<arch>\n' + header + name + b'abc')
+        assert_equal(ar.archived_files[name].read(), b'abc')
+
+    @raises(ValueError)
+    def testBad(self):
+        rcmp._ArArchive(b'!<arch>\n' + b'x' * 60)
+
 class testArSlow(testAr):
     exit_asap = False
 
@@ -564,6 +607,181 @@ class testConfigLog(SimpleAbstract):
 #     filenames = ['auto.conf', 'autoconf.h']
 #     comparators = [rcmp.KernelConfComparator]
 
+class testRules(object):
+    """
+    Rules loaded from json normalize generated files in one pass.
+    """
+    fnames = ['rules.left/gen.h', 'rules.right/gen.h']
+
+    rules = """[{"glob": "*gen.h",
+                 "trigger": "generated by gen",
+                 "lines": 2,
+                 "substitutions": [["^/\\\\* build (\\\\w+) on .*$", "/* build \\\\1 on ... */"],
+                                   ["tmp-[0-9]+", "tmp-0"],
+                                   ["tmp-.*", "never"]],
+                 "dates": true}]"""
+
+    def setUp(self):
+        rcmp.Items.reset()
+        self.saved = rcmp.RuleComparator.rules
+        rcmp.RuleComparator.rules = rcmp.load_rules(io.StringIO(self.rules))
+        for fname in self.fnames:
+            os.mkdir(os.path.dirname(fname))
+
+    def tearDown(self):
+        rcmp.RuleComparator.rules = self.saved
+        rcmp.Items.reset()
+        for fname in self.fnames:
+            rmtree(os.path.dirname(fname))
+
+    def write(self, left, right):
+        for (fname, content) in zip(self.fnames, [left, right]):
+            with open(fname, 'wb') as f:
+                f.write(content)
+
+    def cmp(self):
+        return rcmp.Comparison(lname=self.fnames[0], rname=self.fnames[1],
+                               comparators=[rcmp.RuleComparator]).cmp()
+
+    def testNormalize(self):
+        (rule,) = rcmp.RuleComparator.rules
+        assert_equal(rule.normalize(b'/* build 7 on host */\ntmp-12 tmp-x\nSun Feb 13 12:29:28 2011\n'),
+                     b'/* build 7 on ... */\ntmp-0 never\nDay Mon 00 00:00:00 2011\n')
+
+    def testOwnGroups(self):
+        # each substitution's group numbers, names and flags are its own.
+        rule = rcmp.NormalizeRule('*', substitutions=[[r'x', 'X'], [r'(\w)\1', r'<\1>']])
+        assert_equal(rule.normalize(b'aa bb x'), b'<a> <b> X')
+
+        rule = rcmp.NormalizeRule('*', substitutions=[[r'(?i)abc', 'ABC'], [r'xyz', 'XYZ']])
+        assert_equal(rule.normalize(b'aBc xyz XYZ Xyz'), b'ABC XYZ XYZ Xyz')
+
+        rule = rcmp.NormalizeRule('*', substitutions=[[r'(?P<n>[0-9]+)px', r'\g<n>'], [r'#(?P<n>\w+)', r'\g<n>']])
+        assert_equal(rule.normalize(b'12px #fff'), b'12 fff')
+
+    def testEmptyMatch(self):
+        rule = rcmp.NormalizeRule('*', substitutions=[[r'^', '> '], [r'$', ';']])
+        assert_equal(rule.normalize(b'a\nb'), b'> a;\n> b;')
+
+    def testSame(self):
+        self.write(b'// generated by gen\n/* build a on one */\ntmp-1 April  7, 2011\n',
+                   b'// generated by gen\n/* build a on two */\ntmp-22 May 13, 2012\n')
+        assert_equal(self.cmp(), rcmp.Same)
+
+    def testDifferent(self):
+        self.write(b'// generated by gen\n/* build a on one */\n',
+                   b'// generated by gen\n/* build b on one */\n')
+        assert_equal(self.cmp(), rcmp.Different)
+
+    @raises(rcmp.IndeterminateResult)
+    def testTrigger(self):
+        self.write(b'\n\n// generated by gen\ntmp-1\n', b'\n\n// generated by gen\ntmp-2\n')
+        self.cmp()
+
+    def testDigestCache(self):
+        (rule,) = rcmp.RuleComparator.rules
+        normalized = []
+        blocks = rule.blocks
+        def counting(buf):
+            normalized.append(buf)
+            return blocks(buf)
+
+        rule.blocks = counting
+        rcmp.cache_dir = tempfile.mkdtemp()
+        try:
+            self.write(b'// generated by gen\ntmp-1\n', b'// generated by gen\ntmp-2\n')
+            assert_equal(self.cmp(), rcmp.Same)
+            assert_equal(len(normalized), 2)
+            assert_equal(len(os.listdir(rcmp.cache_dir)), 2)
+
+            # the left is known, so only the right is normalized.
+            rcmp.Items.reset()
+            with open(self.fnames[1], 'wb') as f:
+                f.write(b'// generated by gen\ntmp-333\n')
+
+            assert_equal(self.cmp(), rcmp.Same)
+            assert_equal(len(normalized), 3)
+
+            # both are known.
+            rcmp.Items.reset()
+            assert_equal(self.cmp(), rcmp.Same)
+            assert_equal(len(normalized), 3)
+
+        finally:
+            shutil.rmtree(rcmp.cache_dir)
+            rcmp.cache_dir = None
+
+    def testDigestCacheDifferent(self):
+        (rule,) = rcmp.RuleComparator.rules
+        normalized = []
+        blocks = rule.blocks
+        def counting(buf):
+            normalized.append(buf)
+            return blocks(buf)
+
+        rule.blocks = counting
+        rcmp.cache_dir = tempfile.mkdtemp()
+        logger = rcmp.RuleComparator.logger
+        level = logger.level
+        try:
+            # both digests are kept though the sides differ.
+            self.write(b'// generated by gen\n/* build a on one */\n',
+                       b'// generated by gen\n/* build b on one */\n')
+            assert_equal(self.cmp(), rcmp.Different)
+            assert_equal(len(normalized), 2)
+            assert_equal(len(os.listdir(rcmp.cache_dir)), 2)
+
+            # and, with no difference to report, nothing is normalized.
+            logger.setLevel(rcmp.DIFFERENCES + 1)
+            rcmp.Items.reset()
+            assert_equal(self.cmp(), rcmp.Different)
+            assert_equal(len(normalized), 2)
+
+        finally:
+            logger.setLevel(level)
+            shutil.rmtree(rcmp.cache_dir)
+            rcmp.cache_dir = None
+
+    def testDigestCacheUnwritable(self):
+        rcmp.cache_dir = os.path.join(tempfile.mkdtemp(), 'missing')
+        try:
+            self.write(b'// generated by gen\ntmp-1\n', b'// generated by gen\ntmp-2\n')
+            assert_equal(self.cmp(), rcmp.Same)
+
+        finally:
+            shutil.rmtree(os.path.dirname(rcmp.cache_dir))
+            rcmp.cache_dir = None
+
+def testCacheName():
+    # a path given as bytes or as text is the same file.
+    (cache_dir, rcmp.cache_dir) = (rcmp.cache_dir, 'cache')
+    try:
+        assert_equal(rcmp._cache_name('tar', rcmp_py.encode('utf-8')), rcmp._cache_name('tar', rcmp_py))
+        assert rcmp._cache_name('normalized', rcmp_py, 1) != rcmp._cache_name('normalized', rcmp_py, 2)
+
+    finally:
+        rcmp.cache_dir = cache_dir
+
+class testKernelConf(object):
+    fnames = ['kernel.left/auto.conf', 'kernel.right/auto.conf']
+
+    def setUp(self):
+        rcmp.Items.reset()
+        for (fname, stamp) in zip(self.fnames, [b'Sun Feb 13', b'Mon Jun 4']):
+            os.mkdir(os.path.dirname(fname))
+            with open(fname, 'wb') as f:
+                f.write(b'#\n# Automatically generated make config: don\'t edit\n# Linux kernel\n# '
+                        + stamp + b'\n#\nCONFIG_X=y\n')
+
+    def tearDown(self):
+        rcmp.Items.reset()
+        for fname in self.fnames:
+            rmtree(os.path.dirname(fname))
+
+    def testStamp(self):
+        assert_equal(rcmp.Comparison(lname=self.fnames[0], rname=self.fnames[1],
+                                     comparators=[rcmp.KernelConfComparator]).cmp(), rcmp.Same)
+
 class testGzip(SimpleAbstract):
     filenames = ['Makefile.in.gz', 'yo.gz.gz.gz']
     comparators = [rcmp.GzipComparator, rcmp.BitwiseComparator]
@@ -577,6 +795,180 @@ if rcmp.lzma:
         filenames = ['Makefile.in.xz', 'yo.xz.xz.xz']
         comparators = [rcmp.XZComparator, rcmp.BitwiseComparator]
 
+    class testXZBlocks(object):
+        blocked = 'blocked.xz'
+        unblocked = 'unblocked.xz'
+
+        def setUp(self):
+            rcmp.Items.reset()
+            for fname, args in [(self.blocked, ['--block-size=4096', '-T2']),
+                                (self.unblocked, [])]:
+                with open(fname, 'wb') as f:
+                    subprocess.check_call(['xz', '-c'] + args + [rcmp_py], stdout=f)
+
+        def tearDown(self):
+            rcmp.Items.reset()
+            for fname in [self.blocked, self.unblocked]:
+                os.remove(fname)
+
+        def testIndex(self):
+            with open(self.blocked, 'rb') as f:
+                assert len(rcmp._xz_blocks(f.read())) > 1
+
+        def testBlocked(self):
+            assert_equal(rcmp.Comparison(lname=self.blocked, rname=self.unblocked, comparators=[
+                rcmp.XZComparator,
+                rcmp.BitwiseComparator,
+                ], exit_asap=True).cmp(), rcmp.Same)
+
+        def testForgedIndex(self):
+            # an index understating the blocks' sizes isn't trusted.
+            with open(self.blocked, 'rb') as f:
+                content = f.read()
+
+            blocks = rcmp._xz_blocks(content)
+            index = b'\x00' + rcmp._xz_encode_int(len(blocks))
+            for (flags, offset, unpadded, uncompressed) in blocks:
+                index += rcmp._xz_encode_int(unpadded) + rcmp._xz_encode_int(200)
+
+            index += b'\x00' * (-len(index) % 4)
+            index += rcmp._xz_crc32(index)
+            forged = content[:-12 - len(index)] + index + content[-12:]
+            assert_equal(len(forged), len(content))
+
+            for block in rcmp._xz_blocks(forged):
+                assert_equal(block[3], 200)
+                decoded = []
+                try:
+                    for piece in rcmp.XZComparator._block_pieces(forged, block):
+                        decoded.append(piece)
+
+                except rcmp.lzma.LZMAError:
+                    assert sum(len(piece) for piece in decoded) <= 200
+
+                else:
+                    assert False, 'forged block decoded'
+
+class testBudget(object):
+    """
+    Pairs which would exceed their budget are different.
+    """
+    fnames = ['left.gz', 'right.gz']
+
+    def setUp(self):
+        rcmp.Items.reset()
+        for fname, level in zip(self.fnames, [1, 9]):
+            with contextlib.closing(gzip.GzipFile(fname, 'wb', level)) as gz:
+                gz.write(b'\x00' * 4 * 1024 * 1024)
+
+    def tearDown(self):
+        rcmp.Items.reset()
+        for fname in self.fnames:
+            os.remove(fname)
+
+    def cmp(self, budget):
+        return rcmp.Comparison(lname=self.fnames[0], rname=self.fnames[1], comparators=[
+            rcmp.GzipComparator,
+            rcmp.BitwiseComparator,
+            ], exit_asap=True, budget=budget).cmp()
+
+    def testUnlimited(self):
+        assert_equal(self.cmp(rcmp.Budget()), rcmp.Same)
+
+    def testDepth(self):
+        assert_equal(self.cmp(rcmp.Budget(max_depth=0)), rcmp.Different)
+
+    def testMember(self):
+        assert_equal(self.cmp(rcmp.Budget(max_member=1024 * 1024)), rcmp.Different)
+
+    def testTotal(self):
+        budget = rcmp.Budget(max_total=6 * 1024 * 1024)
+        assert_equal(self.cmp(budget), rcmp.Different)
+        assert budget.total <= budget.max_total
+
+    def testRatio(self):
+        assert_equal(self.cmp(rcmp.Budget(max_ratio=100)), rcmp.Different)
+
+class FramedAbstract(object):
+    """
+    Compare a file written as several frames against the same content
+    written as one frame.
+    """
+    __metaclass__ = abc.ABCMeta
+
+    framed = 'framed'
+    unframed = 'unframed'
+
+    @abc.abstractproperty
+    def comparator(self):
+        return None
+
+    @abc.abstractmethod
+    def compress(self, content):
+        return None
+
+    def setUp(self):
+        rcmp.Items.reset()
+        with open(rcmp_py, 'rb') as f:
+            content = f.read()
+
+        with open(self.framed, 'wb') as f:
+            for offset in range(0, len(content), 4096):
+                f.write(self.compress(content[offset:offset + 4096]))
+
+        with open(self.unframed, 'wb') as f:
+            f.write(self.compress(content))
+
+    def tearDown(self):
+        rcmp.Items.reset()
+        for fname in [self.framed, self.unframed]:
+            os.remove(fname)
+
+    def testFrames(self):
+        with open(self.framed, 'rb') as f:
+            assert len(self.comparator._frames(f.read())) > 1
+
+    def testBounded(self):
+        # a small input chunk expanding hugely is still decoded a chunk
+        # at a time.
+        content = self.compress(b'\x00' * 8 * 1024 * 1024)
+        (frame,) = self.comparator._frames(content)
+        sizes = [len(piece) for piece in self.comparator._frame_pieces(content, *frame)]
+        assert_equal(sum(sizes), 8 * 1024 * 1024)
+        assert max(sizes) <= rcmp._chunk_size
+
+    def testUnframed(self):
+        # trailing garbage means the frames can't all be found.
+        with open(self.framed, 'ab') as f:
+            f.write(b'garbage')
+
+        comparison = rcmp.Comparison(lname=self.framed, rname=self.unframed,
+                                     comparators=[rcmp.BitwiseComparator])
+        assert_false(self.comparator.cmp(comparison))
+
+    def testFramed(self):
+        assert_equal(rcmp.Comparison(lname=self.framed, rname=self.unframed, comparators=[
+            self.comparator,
+            rcmp.BitwiseComparator,
+            ], exit_asap=True).cmp(), rcmp.Same)
+
+if rcmp.zstd:
+    class testZstd(FramedAbstract):
+        comparator = rcmp.ZstdComparator
+
+        def compress(self, content):
+            if hasattr(rcmp.zstd, 'compress'):
+                return rcmp.zstd.compress(content)
+
+            return rcmp.zstd.ZstdCompressor().compress(content)
+
+if rcmp.lz4frame:
+    class testLZ4(FramedAbstract):
+        comparator = rcmp.LZ4Comparator
+
+        def compress(self, content):
+            return rcmp.lz4frame.compress(content)
+
 class testZip(SimpleAbstract):
     #filenames = ['jarfile.jar', 'tst_unzip_file.zip', 'third.zip']
     filenames = ['zipfile.zip']
@@ -612,11 +1004,204 @@ class testZip(SimpleAbstract):
         for fname in self.fnames:
             os.remove(fname)
 
+class testZipCRC(SimpleAbstract):
+    filenames = ['zipfile.zip']
+    comparators = [
+        rcmp.ZipCRCComparator,
+        rcmp.ZipComparator,
+        ]
+
+class testZipVerify(object):
+    fnames = ['left.zip', 'right.zip']
+
+    def setUp(self):
+        rcmp.Items.reset()
+        for fname in self.fnames:
+            with rcmp.openzip(fname, 'w') as z:
+                z.writestr('member', b'some stored content')
+
+            # corrupt the stored member without touching its recorded crc.
+            with open(fname, 'rb') as f:
+                content = f.read()
+
+            with open(fname, 'wb') as f:
+                f.write(content.replace(b'stored', b'STORED'))
+
+    def tearDown(self):
+        rcmp.Items.reset()
+        rcmp.ZipComparator.verify = True
+        for fname in self.fnames:
+            os.remove(fname)
+
+    def comparison(self):
+        return rcmp.Comparison(lname=self.fnames[0], rname=self.fnames[1], comparators=[
+            rcmp.ZipComparator,
+            rcmp.BitwiseComparator,
+            ], exit_asap=True)
+
+    @raises(rcmp.BadZipfile)
+    def testVerify(self):
+        self.comparison().cmp()
+
+    def testTrusted(self):
+        rcmp.ZipComparator.verify = False
+        assert_equal(self.comparison().cmp(), rcmp.Same)
+
+class testZipPrefetch(object):
+    """
+    Members stored differently on each side have to be inflated, (on
+    the thread pool), to be compared.
+    """
+    fnames = ['deflated.zip', 'stored.zip']
+
+    def setUp(self):
+        rcmp.Items.reset()
+        for fname, compression in zip(self.fnames, [zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED]):
+            with rcmp.openzip(fname, 'w') as z:
+                for i in range(20):
+                    z.write(rcmp_py, 'member{}'.format(i), compression)
+
+    def tearDown(self):
+        rcmp.Items.reset()
+        for fname in self.fnames:
+            os.remove(fname)
+
+    def testPrefetch(self):
+        assert_equal(rcmp.Comparison(lname=self.fnames[0], rname=self.fnames[1], comparators=[
+            rcmp.ZipCRCComparator,
+            rcmp.ZipComparator,
+            rcmp.BitwiseComparator,
+            ], exit_asap=True).cmp(), rcmp.Same)
+
+    def testPassedOver(self):
+        # results never asked for, (members settled some other way),
+        # don't keep the window from moving on.
+        with rcmp._threadpool() as pool:
+            prefetch = rcmp._Prefetcher(pool, lambda key: key * 2, range(20), 4)
+            for key in range(0, 20, 3):
+                assert_equal(prefetch.get(key), key * 2)
+                assert len(prefetch.pending) <= 4
+
+class testMapped(object):
+    """
+    File system files are peeked at and mapped rather than read.
+    """
+    fnames = ['mapped.zip', 'empty']
+
+    def setUp(self):
+        rcmp.Items.reset()
+        with rcmp.openzip(self.fnames[0], 'w') as z:
+            z.write(rcmp_py, 'member')
+
+        open(self.fnames[1], 'wb').close()
+
+    def tearDown(self):
+        rcmp.Items.reset()
+        for fname in self.fnames:
+            os.remove(fname)
+
+    def testPeek(self):
+        item = rcmp.Items.find_or_create(self.fnames[0], rcmp.root)
+        assert_equal(item.peek(2), b'PK')
+        assert rcmp.ZipComparator._applies(item)
+        assert_equal(item._content, False)
+
+    def testEmpty(self):
+        assert_equal(rcmp.Comparison(lname=self.fnames[1], rname=self.fnames[1], comparators=[
+            rcmp.BitwiseComparator,
+            ], exit_asap=True).cmp(), rcmp.Same)
+
 # FIXME: need some test files
 # class testDateBlot(SimpleAbstract):
 #     filenames = ['icu-config', 'acinclude.m4', 'compile.h']
 #     comparators = [rcmp.DateBlotBitwiseComparator]
 
+def testDateBlot():
+    text = ('built Sun Feb 13 12:29:28 PST 2011 on\n'
+            'nothing here, 2 x 9\n'
+            '13 feb 2011 11:52 and April  7, 2011\n'
+            'release 2011-04-13, stamp 20110413T170033Z')
+    blotted = ('built Day Mon 00 00:00:00 LOC 2011 on\n'
+               'nothing here, 2 x 9\n'
+               '00 MON 2011 00:00 and Month 00, 2011\n'
+               'release 2011-00-00, stamp 00000000T000000Z')
+
+    assert_equal(rcmp.date_blot(text), blotted)
+    assert_equal(rcmp.date_blot_bytes(text.encode('ascii') + b'\xff'), blotted.encode('ascii') + b'\xff')
+
+def testDateBlotBlocks():
+    # candidate lines near and far apart, and text given as bytes.
+    text = ''.join(['x' * 1000 + '\n' if i % 7 else 'at 12:29:28 on Wed Apr 13 2011\n' for i in range(100)]
+                   + ['line {}\n'.format(i) for i in range(1000)])
+    blotted = text
+    for pat in rcmp.date_patterns:
+        blotted = pat.compiled.sub(pat.replacement, blotted)
+
+    assert_equal(rcmp.date_blot(text), blotted)
+    assert_equal(rcmp.date_blot(text.encode('ascii')), blotted.encode('ascii'))
+    assert_equal(rcmp.date_blot_bytes(text.encode('ascii')), blotted.encode('ascii'))
+
+def testDateBlotRandom():
+    # lines pieced together at random from bits of dates and near
+    # misses, against the patterns applied one after another.
+    bits = ['Sun Feb 13 12:29:28 PST 2011', 'Sun Feb 13 12:29:28 2011', '13 feb 2011 11:52', 'April  7, 2011',
+            'Wed Apr 13 2011', 'Wed 13 Apr 2011', 'Wed 13 April 2011', '2011-04-13', 'Apr 2011', '12:29:28',
+            '1999-07-11T170033Z', 'Sun', 'Wed', 'Feb', 'feb', 'APR', 'April', 'July', ' ', '  ', ', ', '\\, ',
+            ':', '-', 'T', 'Z', '0', '2', '7', '13', '20', '2011', '1999', '11:52', '170033', 'PST', 'x',
+            'configure:']
+    chooser = random.Random(44)
+    for _ in range(50):
+        text = '\n'.join(''.join(chooser.choice(bits) for _ in range(chooser.randint(0, 6)))
+                         for _ in range(chooser.randint(1, 200)))
+        blotted = text
+        for pat in rcmp.date_patterns:
+            blotted = pat.compiled.sub(pat.replacement, blotted)
+
+        assert_equal(rcmp.date_blot(text), blotted)
+        assert_equal(rcmp.date_blot_bytes(text.encode('ascii')), blotted.encode('ascii'))
+
+class testDateBlotStream(object):
+    """
+    Date blotted comparison a chunk at a time, with dates of differing
+    lengths falling on either side of the chunk boundaries.
+    """
+    fnames = ['dates.left', 'dates.right']
+
+    def setUp(self):
+        rcmp.Items.reset()
+        self.chunk_size = rcmp._chunk_size
+        rcmp._chunk_size = 64
+
+    def tearDown(self):
+        rcmp._chunk_size = self.chunk_size
+        rcmp.Items.reset()
+        for fname in self.fnames:
+            os.remove(fname)
+
+    def write(self, left, right):
+        for (fname, content) in zip(self.fnames, [left, right]):
+            with open(fname, 'wb') as f:
+                f.write(content)
+
+    def cmp(self):
+        return rcmp.Comparison(lname=self.fnames[0], rname=self.fnames[1],
+                               comparators=[rcmp.DateBlotBitwiseComparator]).cmp()
+
+    def testSame(self):
+        self.write(b'x' * 50 + b' April  7, 2011\n' * 20 + b'y' * 200,
+                   b'x' * 50 + b' June 13, 2012\n' * 20 + b'y' * 200)
+        assert_equal(self.cmp(), rcmp.Same)
+
+    @raises(rcmp.IndeterminateResult)
+    def testDifferent(self):
+        self.write(b'2011-04-13 left\n' * 20, b'2011-04-13 left\n' * 19 + b'2011-04-13 rght\n')
+        self.cmp()
+
+    @raises(rcmp.IndeterminateResult)
+    def testLength(self):
+        self.write(b'2011-04-13\n' * 20, b'2011-04-13\n' * 20 + b'\n')
+        self.cmp()
+
 class testCpio(SimpleAbstract):
     filenames = ['cpiofile.cpio']
     comparators = [
@@ -626,6 +1211,123 @@ class testCpio(SimpleAbstract):
         rcmp.CpioComparator,
         ]
 
+def newc(members, mtime=0):
+    """
+    Write a newc cpio archive of *members*, (name, content) pairs.
+    """
+    out = b''
+    for ino, (name, content) in enumerate(members + [(b'TRAILER!!!', b'')]):
+        fields = [ino, 0o100644 if content else 0, 0, 0, 1, mtime, len(content), 0, 0, 0, 0, len(name) + 1, 0]
+        out += b'070701' + ''.join('{:08x}'.format(field) for field in fields).encode() + name + b'\x00'
+        out += b'\x00' * (-len(out) % 4) + content
+        out += b'\x00' * (-len(out) % 4)
+
+    return out
+
+def odc(members):
+    """
+    Write an odc cpio archive of *members*, (name, content) pairs.
+    """
+    out = b''
+    for ino, (name, content) in enumerate(members + [(b'TRAILER!!!', b'')]):
+        fields = ['{:06o}'.format(field) for field in [0, ino, 0o100644, 0, 0, 1, 0]]
+        fields += ['{:011o}'.format(0), '{:06o}'.format(len(name) + 1), '{:011o}'.format(len(content))]
+        out += b'070707' + ''.join(fields).encode() + name + b'\x00' + content
+
+    return out
+
+def binary(members, order=b'<'):
+    """
+    Write an old binary cpio archive of *members*, (name, content)
+    pairs, in byte *order*.
+    """
+    out = b''
+    for ino, (name, content) in enumerate(members + [(b'TRAILER!!!', b'')]):
+        out += struct.pack(order + b'13H', 0o070707, 0, ino, 0o100644, 0, 0, 1, 0, 0, 0,
+                           len(name) + 1, len(content) >> 16, len(content) & 0xffff)
+        out += name + b'\x00' + b'\x00' * ((len(name) + 1) % 2)
+        out += content + b'\x00' * (len(content) % 2)
+
+    return out
+
+class testCpioFormats(object):
+    members = [(b'a', b'hello'), (b'b', b'world!')]
+    fnames = ['left.cpio', 'right.cpio']
+
+    def setUp(self):
+        rcmp.Items.reset()
+
+    def tearDown(self):
+        rcmp.Items.reset()
+        for fname in self.fnames:
+            if os.path.exists(fname):
+                os.remove(fname)
+
+    def check(self, content):
+        cpio = rcmp._CpioArchive(content)
+        assert_equal(cpio.names, [name for name, data in self.members])
+        assert_equal([member.content for member in cpio.members], [data for name, data in self.members])
+
+    def testNewc(self):
+        self.check(newc(self.members))
+
+    def testOdc(self):
+        self.check(odc(self.members))
+
+    def testBinary(self):
+        for order in [b'<', b'>']:
+            self.check(binary(self.members, order))
+
+    @raises(ValueError)
+    def testTruncated(self):
+        rcmp._CpioArchive(newc(self.members)[:-20])
+
+    def write(self, left, right):
+        for fname, content in zip(self.fnames, [left, right]):
+            with open(fname, 'wb') as fd:
+                fd.write(content)
+
+    def comparison(self, comparators):
+        return rcmp.Comparison(lname=self.fnames[0], rname=self.fnames[1],
+                               comparators=comparators, exit_asap=True)
+
+    def testLockstep(self):
+        self.write(newc(self.members), newc(self.members, mtime=1))
+        assert_equal(self.comparison([rcmp.CpioComparator]).cmp(), rcmp.Same)
+
+    def testBinaryMagic(self):
+        # two bytes which happen to look like the binary magic aren't
+        # enough.
+        self.write(b'\xc7\x71' + b'\xff' * 64, b'\xc7\x71' + b'\xff' * 64)
+        assert_false(rcmp.CpioComparator.applies(self.comparison([rcmp.CpioComparator])))
+        assert_equal(self.comparison([rcmp.CpioComparator, rcmp.BitwiseComparator]).cmp(), rcmp.Same)
+
+        rcmp.Items.reset()
+        self.write(binary(self.members), binary(self.members, b'>'))
+        assert rcmp.CpioComparator.applies(self.comparison([rcmp.CpioComparator]))
+
+    def testAsciiMagic(self):
+        # nor are six digits at the start of a text file.
+        for magic in [b'070701', b'070707']:
+            rcmp.Items.reset()
+            self.write(magic + b' is a number\n' * 16, magic + b' is a number\n' * 16)
+            assert_false(rcmp.CpioComparator.applies(self.comparison([rcmp.CpioComparator])))
+            assert_equal(self.comparison([rcmp.CpioComparator, rcmp.BitwiseComparator]).cmp(), rcmp.Same)
+
+    def testUnreadable(self):
+        # a good first header followed by a truncated archive.
+        self.write(newc(self.members)[:-20], newc(self.members)[:-20])
+        assert rcmp.CpioComparator.applies(self.comparison([rcmp.CpioComparator]))
+        assert_equal(self.comparison([rcmp.CpioComparator, rcmp.BitwiseComparator]).cmp(), rcmp.Same)
+
+    def testOutOfOrder(self):
+        self.write(newc(self.members), newc(list(reversed(self.members))))
+        assert_equal(self.comparison([
+            rcmp.CpioMemberMetadataComparator,
+            rcmp.CpioComparator,
+            rcmp.BitwiseComparator,
+            ]).cmp(), rcmp.Same)
+
 class testTar(SimpleAbstract):
     filenames = ['tarfile.tar']
     comparators = [
@@ -635,6 +1337,630 @@ class testTar(SimpleAbstract):
         rcmp.TarComparator,
         ]
 
+class testTarIndex(object):
+    """
+    Members are looked up by name through an index.  As with
+    :py:meth:`tarfile.TarFile.getmember`, the last of several members
+    with the same name is the one that counts.
+    """
+    fnames = ['left.tar', 'right.tar']
+
+    def setUp(self):
+        rcmp.Items.reset()
+        for fname, contents in zip(self.fnames, [[b'old', b'new'], [b'new']]):
+            with rcmp.opentar(fname, 'w', None) as tar:
+                for i in range(200):
+                    self.add(tar, 'member{}'.format(i), '{}'.format(i).encode())
+
+                for content in contents:
+                    self.add(tar, 'dup', content)
+
+    @staticmethod
+    def add(tar, name, content):
+        info = tarfile.TarInfo(name)
+        info.size = len(content)
+        tar.addfile(info, io.BytesIO(content))
+
+    def tearDown(self):
+        rcmp.Items.reset()
+        for fname in self.fnames:
+            os.remove(fname)
+
+    def testIndex(self):
+        assert_equal(rcmp.Comparison(lname=self.fnames[0], rname=self.fnames[1], comparators=[
+            rcmp.TarMemberMetadataComparator,
+            rcmp.TarComparator,
+            rcmp.BitwiseComparator,
+            ], exit_asap=True).cmp(), rcmp.Same)
+
+class testTarStream(object):
+    """
+    Compressed tar archives are settled in a single streaming pass
+    when their members match, in order.  Otherwise they're left to the
+    decoders.
+    """
+    fnames = ['left.tar.gz', 'right.tar.gz']
+
+    def setUp(self):
+        rcmp.Items.reset()
+
+    def tearDown(self):
+        rcmp.Items.reset()
+        rcmp.TarComparator.stream = True
+        for fname in self.fnames:
+            os.remove(fname)
+
+    def write(self, members):
+        for fname, level, names in zip(self.fnames, [1, 9], members):
+            with contextlib.closing(tarfile.open(fname, 'w:gz', compresslevel=level)) as tar:
+                for name in names:
+                    tar.add(rcmp_py, name)
+
+    def comparison(self, comparators):
+        return rcmp.Comparison(lname=self.fnames[0], rname=self.fnames[1],
+                               comparators=comparators, exit_asap=True)
+
+    def testStreamed(self):
+        self.write([['a', 'b'], ['a', 'b']])
+        assert_equal(self.comparison([rcmp.TarComparator]).cmp(), rcmp.Same)
+
+    def testOutOfOrder(self):
+        self.write([['a', 'b'], ['b', 'a']])
+        assert_false(rcmp.TarComparator.cmp(self.comparison([rcmp.TarComparator])))
+        assert_equal(self.comparison([
+            rcmp.TarComparator,
+            rcmp.GzipComparator,
+            rcmp.BitwiseComparator,
+            ]).cmp(), rcmp.Same)
+
+    def testUnstreamed(self):
+        rcmp.TarComparator.stream = False
+        self.write([['a', 'b'], ['a', 'b']])
+        assert_false(rcmp.TarComparator.applies(self.comparison([rcmp.TarComparator])))
+
+    def testBudget(self):
+        for fname in self.fnames:
+            with contextlib.closing(tarfile.open(fname, 'w:gz')) as tar:
+                info = tarfile.TarInfo('zeros')
+                info.size = 4 * 1024 * 1024
+                tar.addfile(info, io.BytesIO(b'\x00' * info.size))
+
+        budget = rcmp.Budget(max_member=1024 * 1024)
+        assert_equal(rcmp.Comparison(lname=self.fnames[0], rname=self.fnames[1], comparators=[
+            rcmp.TarComparator,
+            rcmp.BitwiseComparator,
+            ], exit_asap=True, budget=budget).cmp(), rcmp.Different)
+        assert budget.total <= budget.max_member
+
+class testTarDetect(object):
+    """
+    Tar archives are recognized from their first header.
+    """
+    fnames = ['ustar.tar', 'v7.tar', 'bad.tar', 'ustar.tar.gz']
+
+    def setUp(self):
+        rcmp.Items.reset()
+        for fname, mode in [(self.fnames[0], 'w'), (self.fnames[3], 'w:gz')]:
+            with contextlib.closing(tarfile.open(fname, mode)) as tar:
+                tar.add(rcmp_py, 'member')
+
+        with open(self.fnames[0], 'rb') as f:
+            header = bytearray(f.read(tarfile.BLOCKSIZE))
+
+        # an old style header has no magic.
+        header[257:265] = b'\x00' * 8
+        header[148:156] = b' ' * 8
+        header[148:155] = '{:06o}\x00'.format(sum(header)).encode()
+        with open(self.fnames[1], 'wb') as f:
+            f.write(header)
+
+        header[0:1] = b'X'
+        with open(self.fnames[2], 'wb') as f:
+            f.write(header)
+
+    def tearDown(self):
+        rcmp.Items.reset()
+        for fname in self.fnames:
+            os.remove(fname)
+
+    def applies(self, fname):
+        return rcmp.TarComparator._applies(rcmp.Items.find_or_create(fname, rcmp.root))
+
+    def testUstar(self):
+        assert self.applies(self.fnames[0])
+
+    def testV7(self):
+        assert self.applies(self.fnames[1])
+
+    def testBad(self):
+        assert_false(self.applies(self.fnames[2]))
+
+    def testSpacedChecksum(self):
+        # spaces within the checksum field aren't padding.
+        with open(self.fnames[2], 'wb') as f:
+            f.write(b'x' * 148 + b'1 2 3 4 ' + b'x' * 356)
+
+        assert_false(self.applies(self.fnames[2]))
+
+    def testCompressed(self):
+        assert self.applies(self.fnames[3])
+
+    def testOther(self):
+        assert_false(self.applies(rcmp_py))
+
+class testTarIndexCache(object):
+    """
+    Compressed tar archives written as many gzip members are indexed
+    into the cache and compared member by member from there.
+    """
+    fnames = ['left.tar.gz', 'right.tar.gz']
+
+    def setUp(self):
+        rcmp.Items.reset()
+        rcmp.cache_dir = tempfile.mkdtemp()
+
+        for fname, level, names in zip(self.fnames, [1, 9], [['a', 'b'], ['b', 'a']]):
+            tarball = io.BytesIO()
+            with contextlib.closing(tarfile.open(fileobj=tarball, mode='w')) as tar:
+                for name in names:
+                    tar.add(rcmp_py, name)
+
+            # one gzip member per 4k of tar, as bgzip might.
+            content = tarball.getvalue()
+            with open(fname, 'wb') as fd:
+                for offset in range(0, len(content), 4096):
+                    with contextlib.closing(gzip.GzipFile(fileobj=fd, mode='wb', compresslevel=level)) as gz:
+                        gz.write(content[offset:offset + 4096])
+
+    def tearDown(self):
+        rcmp.Items.reset()
+        shutil.rmtree(rcmp.cache_dir)
+        rcmp.cache_dir = None
+        for fname in self.fnames:
+            os.remove(fname)
+
+    def comparison(self, budget=None):
+        return rcmp.Comparison(lname=self.fnames[0], rname=self.fnames[1], comparators=[
+            rcmp.TarMemberMetadataComparator,
+            rcmp.TarComparator,
+            rcmp.BitwiseComparator,
+            ], exit_asap=True, budget=budget)
+
+    def testIndexed(self):
+        assert_equal(self.comparison().cmp(), rcmp.Same)
+        assert_equal(len(os.listdir(rcmp.cache_dir)), 2)
+
+        rcmp.Items.reset()
+        assert_equal(self.comparison().cmp(), rcmp.Same)
+
+    def testStreamIndexed(self):
+        # the first streaming pass builds the indexes.
+        def build(cls, comptype, buf, budget=None):
+            raise AssertionError('decoded again to index')
+
+        (rcmp._TarIndex.build, original) = (classmethod(build), rcmp._TarIndex.build)
+        try:
+            assert_equal(self.comparison().cmp(), rcmp.Same)
+
+        finally:
+            rcmp._TarIndex.build = original
+
+        assert_equal(len(os.listdir(rcmp.cache_dir)), 2)
+
+    def testBudget(self):
+        # enough to stream the first members but not to index both
+        # archives on the way.
+        budget = rcmp.Budget(max_total=3 * os.path.getsize(rcmp_py))
+        assert_equal(self.comparison(budget).cmp(), rcmp.Different)
+        assert budget.total <= budget.max_total
+
+    def testUnwritable(self):
+        # a cache which can't be written to only goes unused.
+        (cache_dir, rcmp.cache_dir) = (rcmp.cache_dir, os.path.join(rcmp.cache_dir, 'missing'))
+        try:
+            assert_equal(self.comparison().cmp(), rcmp.Same)
+
+        finally:
+            rcmp.cache_dir = cache_dir
+
+    def testUncached(self):
+        (cache_dir, rcmp.cache_dir) = (rcmp.cache_dir, None)
+        assert_false(rcmp.TarComparator.cmp(self.comparison()))
+        rcmp.cache_dir = cache_dir
+
+class testDirArchive(object):
+    """
+    A directory is compared against tar and zip archives of it without
+    extracting them.
+    """
+    tree = 'tree'
+    fnames = ['tree.tar.gz', 'tree.zip']
+
+    def setUp(self):
+        rcmp.Items.reset()
+        os.makedirs(os.path.join(self.tree, 'sub'))
+        shutil.copy(rcmp_py, os.path.join(self.tree, 'a'))
+        shutil.copy(tests_py, os.path.join(self.tree, 'sub', 'b'))
+        os.symlink('a', os.path.join(self.tree, 'link'))
+
+        with contextlib.closing(tarfile.open(self.fnames[0], 'w:gz')) as tar:
+            tar.add(self.tree, '.')
+
+        with contextlib.closing(zipfile.ZipFile(self.fnames[1], 'w', zipfile.ZIP_DEFLATED)) as zip:
+            for name in ['a', 'sub/b']:
+                zip.write(os.path.join(self.tree, name), name)
+
+    def tearDown(self):
+        rcmp.Items.reset()
+        shutil.rmtree(self.tree)
+        for fname in self.fnames:
+            os.remove(fname)
+
+    def comparison(self, fname):
+        return rcmp.Comparison(lname=self.tree, rname=fname, exit_asap=True)
+
+    def testTar(self):
+        assert_equal(self.comparison(self.fnames[0]).cmp(), rcmp.Same)
+
+    def testZip(self):
+        os.remove(os.path.join(self.tree, 'link'))
+        assert_equal(self.comparison(self.fnames[1]).cmp(), rcmp.Same)
+
+    def testInverted(self):
+        assert_equal(rcmp.Comparison(lname=self.fnames[0], rname=self.tree).cmp(), rcmp.Same)
+
+    def testDifferent(self):
+        with open(os.path.join(self.tree, 'sub', 'b'), 'ab') as fd:
+            fd.write(b'more')
+
+        assert_equal(self.comparison(self.fnames[0]).cmp(), rcmp.Different)
+
+    def testDecoded(self):
+        # bitwise different, but the same once decoded.
+        with open(rcmp_py, 'rb') as fd:
+            content = fd.read()
+
+        for mtime in [0, 1]:
+            with contextlib.closing(gzip.GzipFile(os.path.join(self.tree, 'c.gz'), 'wb', mtime=mtime)) as gz:
+                gz.write(content)
+
+            if not mtime:
+                with contextlib.closing(tarfile.open(self.fnames[0], 'w:gz')) as tar:
+                    tar.add(self.tree, '.')
+
+        assert_equal(self.comparison(self.fnames[0]).cmp(), rcmp.Same)
+
+    def testNoMate(self):
+        with open(os.path.join(self.tree, 'extra'), 'wb') as fd:
+            fd.write(b'extra')
+
+        assert_equal(self.comparison(self.fnames[0]).cmp(), rcmp.Different)
+
+    def testIgnored(self):
+        with open(os.path.join(self.tree, 'extra'), 'wb') as fd:
+            fd.write(b'extra')
+
+        assert_equal(rcmp.Comparison(lname=self.tree, rname=self.fnames[0],
+                                     ignores=rcmp.fntore(['*/extra'])).cmp(), rcmp.Same)
+
+class testTarStreamInput(object):
+    """
+    Tar streams read from pipes are compared in a single pass.
+    """
+    tree = 'tree'
+    fnames = ['tree.tar.gz', 'reordered.tar']
+
+    def setUp(self):
+        rcmp.Items.reset()
+        os.makedirs(os.path.join(self.tree, 'sub'))
+        shutil.copy(rcmp_py, os.path.join(self.tree, 'a'))
+        shutil.copy(tests_py, os.path.join(self.tree, 'sub', 'b'))
+
+        with contextlib.closing(tarfile.open(self.fnames[0], 'w:gz')) as tar:
+            tar.add(self.tree, '.')
+
+        with contextlib.closing(tarfile.open(self.fnames[1], 'w')) as tar:
+            for name in ['sub/b', 'sub', 'a', '.']:
+                tar.add(os.path.join(self.tree, name), './' + name if name != '.' else name, recursive=False)
+
+    def tearDown(self):
+        rcmp.Items.reset()
+        shutil.rmtree(self.tree)
+        for fname in self.fnames:
+            os.remove(fname)
+
+    @contextlib.contextmanager
+    def pipe(self, fname):
+        """
+        Yield the 'fd:N' name of a pipe fed from *fname*.
+        """
+        (r, w) = os.pipe()
+
+        def feed():
+            with open(fname, 'rb') as src, os.fdopen(w, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+
+        feeder = threading.Thread(target=feed)
+        feeder.start()
+        yield 'fd:{}'.format(r)
+        feeder.join()
+
+    def testDir(self):
+        with self.pipe(self.fnames[0]) as name:
+            assert_equal(rcmp.Comparison(lname=self.tree, rname=name, exit_asap=True).cmp(), rcmp.Same)
+
+    def testLockstep(self):
+        with self.pipe(self.fnames[0]) as name:
+            assert_equal(rcmp.Comparison(lname=name, rname=self.fnames[1], ignore_ownerships=True).cmp(), rcmp.Same)
+
+    def testDifferent(self):
+        with open(os.path.join(self.tree, 'a'), 'ab') as fd:
+            fd.write(b'more')
+
+        with self.pipe(self.fnames[0]) as name:
+            assert_equal(rcmp.Comparison(lname=self.tree, rname=name).cmp(), rcmp.Different)
+
+    def big(self, fname, change):
+        """
+        Write a tar archive of a member a few chunks long, (with the
+        byte at *change* altered), and return its content.
+        """
+        content = bytearray(b'0123456789abcdef' * (3 * rcmp._chunk_size // 16))
+        content[change] ^= 1
+        content = bytes(content)
+
+        with contextlib.closing(tarfile.open(fname, 'w')) as tar:
+            info = tarfile.TarInfo('./a')
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+
+        return content
+
+    def testSpooled(self):
+        # mates which differ late are spooled whole.
+        contents = [self.big(fname, change) for fname, change in zip(self.fnames, [0, 5 * rcmp._chunk_size // 2])]
+        with self.pipe(self.fnames[0]) as name:
+            comparison = rcmp.Comparison(lname=name, rname=self.fnames[1])
+            with contextlib.nested(*[rcmp.TarStreamComparator._open(p) for p in comparison.pair]) as tars:
+                infos = [tar.next() for tar in tars]
+                mates = rcmp.TarStreamComparator._mated(comparison, tars, infos)
+
+        assert_equal([spool.read() for (info, spool) in mates], contents)
+
+    def testSpooledDir(self):
+        # what matched the file system before a late difference is
+        # spooled from there.
+        with open(os.path.join(self.tree, 'a'), 'wb') as fd:
+            fd.write(self.big(self.fnames[0], 0))
+
+        content = self.big(self.fnames[1], 5 * rcmp._chunk_size // 2)
+        with self.pipe(self.fnames[1]) as name:
+            comparison = rcmp.Comparison(lname=self.tree, rname=name)
+            (directory, archive) = comparison.pair
+            rcmp.TarStreamComparator._dir_cmp(comparison, directory, archive)
+
+        archive.members['./a'][1].seek(0)
+        assert_equal(archive.members['./a'][1].read(), content)
+
+    def testFifo(self):
+        fifo = 'fifo'
+        os.mkfifo(fifo)
+        try:
+            def feed():
+                with open(self.fnames[0], 'rb') as src, open(fifo, 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+
+            feeder = threading.Thread(target=feed)
+            feeder.start()
+            assert_equal(rcmp.Comparison(lname=fifo, rname=self.tree).cmp(), rcmp.Same)
+            feeder.join()
+
+        finally:
+            os.remove(fifo)
+
+    def testStdin(self):
+        with open(self.fnames[0], 'rb') as stdin:
+            assert_equal(subprocess.call(['rcmp', '-', self.tree], stdin=stdin), 0)
+
+def elf(sections):
+    """
+    Write a little endian, 64 bit, relocatable elf file of *sections*,
+    (name, type, content) triples.
+    """
+    names = b'\x00'
+    for (name, type, content) in sections + [(b'.shstrtab', 3, b'')]:
+        names += name + b'\x00'
+
+    (body, headers) = (b'', [b'\x00' * 64])
+    for (name, type, content) in sections + [(b'.shstrtab', 3, names)]:
+        body += b'\x00' * (-len(body) % 8)
+        headers.append(struct.pack(b'<IIQQQQIIQQ', names.index(name + b'\x00'), type, 0, 0,
+                                   64 + len(body), len(content), 0, 0, 4, 0))
+        body += content
+
+    body += b'\x00' * (-len(body) % 8)
+    header = struct.pack(b'<HHIQQQIHHHHHH', 1, 62, 1, 0, 0, 64 + len(body), 0, 64, 0, 0, 64,
+                         len(headers), len(headers) - 1)
+    return b'\x7fELF\x02\x01\x01' + b'\x00' * 9 + header + body + b''.join(headers)
+
+def note(name, type, desc):
+    name += b'\x00'
+    return (struct.pack(b'<III', len(name), len(desc), type)
+            + name + b'\x00' * (-len(name) % 4) + desc + b'\x00' * (-len(desc) % 4))
+
+class testElfBuildId(object):
+    """
+    Elf files with the same build-id are the same, when asked.
+    """
+    fnames = ['left.o', 'right.o']
+
+    def setUp(self):
+        rcmp.Items.reset()
+
+    def tearDown(self):
+        rcmp.Items.reset()
+        rcmp.ElfComparator.build_id = False
+        for fname in self.fnames:
+            os.remove(fname)
+
+    def write(self, *build_ids):
+        for (fname, text, build_id) in zip(self.fnames, [b'\x90' * 16, b'\xc3' * 16], build_ids):
+            sections = [(b'.text', 1, text)]
+            if build_id:
+                sections.append((b'.note.gnu.build-id', 7, note(b'GNU', 3, build_id)))
+
+            with open(fname, 'wb') as fd:
+                fd.write(elf(sections))
+
+    def comparison(self):
+        return rcmp.Comparison(lname=self.fnames[0], rname=self.fnames[1], comparators=[
+            rcmp.ElfComparator,
+            rcmp.FailComparator,
+            ])
+
+    def testBuildId(self):
+        self.write(b'\x01' * 20, b'\x01' * 20)
+        assert_equal(rcmp.ElfComparator._build_id(rcmp.Items.find_or_create(self.fnames[0], rcmp.root)), b'\x01' * 20)
+
+        rcmp.ElfComparator.build_id = True
+        assert_equal(self.comparison().cmp(), rcmp.Same)
+
+    def testOff(self):
+        self.write(b'\x01' * 20, b'\x01' * 20)
+        assert_equal(self.comparison().cmp(), rcmp.Different)
+
+    def testMismatch(self):
+        rcmp.ElfComparator.build_id = True
+        self.write(b'\x01' * 20, b'\x02' * 20)
+        assert_equal(self.comparison().cmp(), rcmp.Different)
+
+    def testNone(self):
+        self.write(None, None)
+        assert_equal(rcmp.ElfComparator._build_id(rcmp.Items.find_or_create(self.fnames[0], rcmp.root)), None)
+
+class testElfSections(object):
+    """
+    Elf files are compared section by section, ignoring some.
+    """
+    fnames = ['left.o', 'right.o']
+
+    def setUp(self):
+        rcmp.Items.reset()
+        self.ignore_sections = rcmp.ElfComparator.ignore_sections
+
+    def tearDown(self):
+        rcmp.Items.reset()
+        rcmp.ElfComparator.ignore_sections = self.ignore_sections
+        for fname in self.fnames:
+            os.remove(fname)
+
+    def write(self, texts, comments):
+        for (fname, text, comment) in zip(self.fnames, texts, comments):
+            with open(fname, 'wb') as fd:
+                fd.write(elf([(b'.text', 1, text), (b'.comment', 1, comment)]))
+
+    def cmp(self):
+        return rcmp.ElfComparator.cmp(rcmp.Comparison(lname=self.fnames[0], rname=self.fnames[1]))
+
+    def testIgnored(self):
+        self.write([b'\x90' * 16] * 2, [b'GCC: 1\x00', b'GCC: 2\x00'])
+        assert_equal(self.cmp(), rcmp.Same)
+
+    def testDifferent(self):
+        self.write([b'\x90' * 16, b'\xc3' * 16], [b'GCC: 1\x00'] * 2)
+        assert_equal(self.cmp(), rcmp.Different)
+
+    def testNotIgnored(self):
+        rcmp.ElfComparator.ignore_sections = []
+        self.write([b'\x90' * 16] * 2, [b'GCC: 1\x00', b'GCC: 2\x00'])
+        assert_equal(self.cmp(), rcmp.Different)
+
+    def testReport(self):
+        self.write([b'\x90' * 4096, b'\x90' * 100 + b'\xc3' + b'\x90' * 3995], [b'GCC: 1\x00'] * 2)
+        images = []
+        for fname in self.fnames:
+            with open(fname, 'rb') as fd:
+                images.append(rcmp._ElfImage(fd.read()))
+
+        lines = rcmp.ElfComparator._report(images, self.fnames)
+        assert_equal(lines[0:2], ['--- left.o:.text', '+++ right.o:.text'])
+        assert '+ 0060 90909090 c3909090 90909090 90909090  ................' in lines
+        assert_equal(lines[-1], '... 3008 more bytes of .text not shown')
+
+    def testUnreadable(self):
+        # the section count differs first, so the overrun is only found
+        # when reporting.
+        contents = [elf([(b'.text', 1, b'\x90' * 16)]),
+                    bytearray(elf([(b'.text', 1, b'\x90' * 16), (b'.data', 1, b'x')]))]
+        struct.pack_into(b'<Q', contents[1], len(contents[1]) - 3 * 64 + 32, 1024 * 1024)
+        for (fname, content) in zip(self.fnames, contents):
+            with open(fname, 'wb') as fd:
+                fd.write(content)
+
+        assert_equal(self.cmp(), rcmp.Different)
+
+        images = [rcmp._ElfImage(bytes(content)) for content in contents]
+        assert 'section .text unreadable: elf section .text overruns the file' in rcmp.ElfComparator._report(images, self.fnames)
+
+    def testBad(self):
+        for fname in self.fnames:
+            with open(fname, 'wb') as fd:
+                fd.write(b'\x7fELF\x09')
+
+        assert_false(self.cmp())
+
+def testFirstDifference():
+    for view in [bytes, memoryview]:
+        assert_equal(rcmp._first_difference(view(b'abcdef'), view(b'abcxef')), 3)
+        assert_equal(rcmp._first_difference(view(b'abc'), view(b'abcdef')), 3)
+        assert_equal(rcmp._first_difference(view(b'abc'), view(b'abc')), None)
+
+def testDifferingRanges():
+    left = b'\0' * 256
+    right = b'\0' * 20 + b'x' + b'\0' * 30 + b'yy' + b'\0' * 100 + b'z' * 40 + b'\0' * 63
+
+    assert_equal(list(rcmp._differing_ranges(left, left)), [])
+    assert_equal(list(rcmp._differing_ranges(left, right)), [(16, 32), (48, 64), (144, 208)])
+    assert_equal(list(rcmp._differing_ranges(left, left + b'more')), [(256, 260)])
+    assert_equal(list(rcmp._differing_ranges(left, right[:250])), [(16, 32), (48, 64), (144, 208), (250, 256)])
+
+def testBinaryReport():
+    left = b'\0' * 4096
+    right = b'\0' * 100 + b'\x01' + b'\0' * 3000 + b'\x02' * 995
+
+    lines = list(rcmp.FailComparator._binary_report([left, right]))
+    assert_equal(lines[0:3], ['sizes 4096 and 4096 bytes', 'first difference at offset 0x64', '2 differing ranges'])
+    assert_equal(lines[3], '@@ 0x60-0x70 @@')
+    assert '+ 0060 00000000 01000000 00000000 00000000  ................' in lines
+    assert_equal(lines[-1], '+ 0c40 02020202 02020202 02020202 02020202  ................')
+
+def testUnifiedDiff():
+    left = ['line {}'.format(i) for i in range(100)]
+    right = left[:10] + ['new'] + left[10:50] + left[51:]
+
+    assert_equal(list(rcmp._unified_diff(left, left, ['l', 'r'])), [])
+    assert_equal(list(rcmp._unified_diff(left, right, ['l', 'r'])),
+                 list(difflib.unified_diff(left, right, 'l', 'r', '', '', 3, '')))
+    assert_equal(list(rcmp._unified_diff(left, right, ['l', 'r'], edits=1)),
+                 ['41 lines differ, first at line 11'])
+    assert_equal(list(rcmp._unified_diff(left, right, ['l', 'r'], lines=10)),
+                 ['41 lines differ, first at line 11'])
+    assert_equal(list(rcmp._unified_diff(left, right, ['l', 'r'], output=4))[-1],
+                 '... 14 more lines of diff not shown')
+
+def testStreamDifference():
+    lines = ['line {}\n'.format(i).encode('ascii') for i in range(20)]
+    text = b''.join(lines)
+    changed = text.replace(b'line 10\n', b'line ten\n')
+
+    def blocks(content, size):
+        return [content[i:i + size] for i in range(0, len(content), size)]
+
+    assert_equal(rcmp._stream_difference(blocks(text, 7), blocks(text, 13)), None)
+    assert_equal(rcmp._stream_difference(blocks(text, 7), blocks(changed, 13), 2),
+                 (11, [b''.join(lines[8:13]), b'line 8\nline 9\nline ten\nline 11\nline 12\n']))
+    assert_equal(rcmp._stream_difference([text], [text, b'more']), (21, [b''.join(lines[17:]), b''.join(lines[17:]) + b'more']))
+
 class SimilarAbstract(SimpleAbstract):
     sides = ['red', 'black']
 
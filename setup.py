@@ -20,6 +20,7 @@
 
 import os
 import platform
+import sys
 
 import distribute_setup
 distribute_setup.use_setuptools()
@@ -32,18 +33,20 @@ __docformat__ = "restructuredtext en"
 me='K Richard Pixley'
 memail='rich@noir.com'
 
-lzma = False
-
 install_requires = [
-    'arpy',
     'bz2file',
-    'cpiofile',
-    'elffile',
 ]
 
-if lzma:
+if sys.version_info < (3, 3):
+    # lzma didn't join the standard library until 3.3.
     install_requires.append('backports.lzma')
 
+extras_require = {
+    # python-3.14 and later have compression.zstd.
+    'zstd': ['zstandard'],
+    'lz4': ['lz4'],
+}
+
 setup_requirements = install_requires + [
     'nose',
     'setuptools_git',
@@ -80,6 +83,7 @@ setuptools.setup(
     long_description='',
     setup_requires=setup_requirements,
     install_requires=install_requires,
+    extras_require=extras_require,
     py_modules=['rcmp'],
     packages=setuptools.find_packages(),
     include_package_data=True,